@@ -1,4 +1,44 @@
-from adept_augmentations.analyzers.analyzer import Analyzer
-from adept_augmentations.augmenters import EntitySwapAugmenter
+import importlib
+from typing import TYPE_CHECKING, Any, List
 
-__all__ = ["Analyzer", "EntitySwapAugmenter"]
+if TYPE_CHECKING:
+    from adept_augmentations.analyzers.analyzer import Analyzer
+    from adept_augmentations.augmenters import (
+        Deduplicator,
+        EntitySwapAugmenter,
+        KnowledgeBaseSwapAugmenter,
+        SentenceCropAugmenter,
+        SubwordEncoder,
+    )
+
+# The modules of the public names, which are only imported on first access, so `import adept_augmentations` doesn't
+# pull in `datasets` or spaCy until they are used
+_LAZY_IMPORTS = {
+    "Analyzer": "adept_augmentations.analyzers.analyzer",
+    "Deduplicator": "adept_augmentations.augmenters.deduplication",
+    "EntitySwapAugmenter": "adept_augmentations.augmenters.augmenter",
+    "KnowledgeBaseSwapAugmenter": "adept_augmentations.augmenters.augmenter",
+    "SentenceCropAugmenter": "adept_augmentations.augmenters.sentence_crop",
+    "SubwordEncoder": "adept_augmentations.augmenters.subwords",
+}
+
+__all__ = [
+    "Analyzer",
+    "Deduplicator",
+    "EntitySwapAugmenter",
+    "KnowledgeBaseSwapAugmenter",
+    "SentenceCropAugmenter",
+    "SubwordEncoder",
+]
+
+
+def __getattr__(name: str) -> Any:
+    if name in _LAZY_IMPORTS:
+        value = getattr(importlib.import_module(_LAZY_IMPORTS[name]), name)
+        globals()[name] = value
+        return value
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def __dir__() -> List[str]:
+    return sorted(set(globals()) | set(__all__))
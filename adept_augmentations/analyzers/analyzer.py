@@ -1,2 +1,267 @@
-class Analyzer(object):
-    pass
+import math
+from collections import defaultdict
+from collections.abc import Iterable
+from typing import TYPE_CHECKING, Any, Dict, List, Optional, Tuple, Union
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+from datasets import Dataset, IterableDataset
+
+from adept_augmentations.augmenters.augmenter import iter_batches, to_arrow_batch
+from adept_augmentations.augmenters.extractors import (
+    LabelScheme,
+    entity_token_positions,
+    flatten_list_array,
+)
+from adept_augmentations.augmenters.hashing import hash_sequences, hash_strings
+from adept_augmentations.augmenters.knowledge_base import (
+    KnowledgeBase,
+    MemoryMappedKnowledgeBase,
+)
+from adept_augmentations.profilers import count, profiled
+from adept_augmentations.utils import convert_docbin_to_dataset, is_docbin
+
+if TYPE_CHECKING:
+    from spacy.tokens import DocBin
+
+
+def add_histograms(histogram: np.ndarray, other: np.ndarray) -> np.ndarray:
+    """Add two histograms of which the last axis may differ in length, e.g. of lengths up to different maxima."""
+    if histogram.shape[-1] < other.shape[-1]:
+        histogram, other = other, histogram
+    histogram = histogram.copy()
+    histogram[..., : other.shape[-1]] += other
+    return histogram
+
+
+def expected_unique_draws(num_combinations: int, N: int) -> float:
+    """Return the expected number of unique values among `N` uniform draws, with replacement, from
+    `num_combinations` values."""
+    if num_combinations <= 1:
+        return float(num_combinations)
+    return -num_combinations * math.expm1(N * math.log1p(-1 / num_combinations))
+
+
+class Analyzer:
+    """Statistics of a NER dataset, and of the knowledge base that it implies, to decide how to augment it.
+
+    All statistics are gathered in one streaming pass over Arrow batches of the dataset, with the entities of every
+    batch extracted at once from the flattened label ids like `EntitySwapAugmenter` does. Only the tokens of the
+    entities are read, to count the unique entities per label, and none at all if a `knowledge_base` is given. Memory
+    stays bounded by the batch size, except for the 8 byte hash that is kept per unique entity.
+
+    Args:
+        dataset (Union[Dataset, DocBin, IterableDataset, Iterable]): The dataset to analyze, like for
+            `EntitySwapAugmenter`.
+        labels (Optional[List[str]]): The label names. Defaults to None, i.e. inferred from the dataset features.
+        label_column (str): The column with the label ids. Defaults to `"ner_tags"`.
+        knowledge_base (Optional[Union[KnowledgeBase, MemoryMappedKnowledgeBase]]): The knowledge base that the
+            entities will be swapped with, e.g. an external gazetteer keyed by label names. Defaults to None, i.e.
+            the unique entities of the dataset itself.
+        batch_size (int): The number of rows per Arrow batch. Defaults to 100,000.
+    """
+
+    def __init__(
+        self,
+        dataset: Union[Dataset, "DocBin", IterableDataset, Iterable],
+        labels: Optional[List[str]] = None,
+        label_column: str = "ner_tags",
+        knowledge_base: Optional[Union[KnowledgeBase, MemoryMappedKnowledgeBase]] = None,
+        batch_size: int = 100_000,
+    ) -> None:
+        if is_docbin(dataset):
+            dataset = convert_docbin_to_dataset(dataset, labels)
+        elif not isinstance(dataset, Iterable):
+            raise TypeError(
+                "dataset must be either a `datasets.Dataset`, a `spacy.tokens.DocBin`, a `datasets.IterableDataset` or"
+                " an iterable of `(tokens, ner_tags)` pairs."
+            )
+        if labels is None:
+            if getattr(dataset, "features", None) is None:
+                raise ValueError("`labels` must be provided if the dataset has no features to infer them from.")
+            labels = dataset.features[label_column].feature.names
+        self.labels = labels
+        self.label_column = label_column
+        self.label_scheme, self.entity_extractor = LabelScheme.from_labels(labels)
+        self.reduced_labels: List[str] = self.entity_extractor.reduced_labels
+        self.knowledge_base = knowledge_base
+
+        self.num_rows = 0
+        self.num_tokens = 0
+        # `sentence_lengths[n]` is the number of rows with `n` tokens, and `entity_lengths[label][n]` the number of
+        # entities of (reduced) label id `label` with `n` tokens
+        self.sentence_lengths = np.zeros(1, dtype=np.int64)
+        self.entity_lengths = np.zeros((len(self.reduced_labels), 1), dtype=np.int64)
+        # The number of rows for every combination of numbers of entities per label, e.g. (0, 2, 1) for a row with
+        # two entities of label 1 and one of label 2, from which the number of possible augmentations follows
+        self.entity_count_rows: Dict[Tuple[int, ...], int] = defaultdict(int)
+        # The sorted, unique keys of the entities, i.e. their label in the top `label_bits` bits and their hash in
+        # the remaining bits, and those of the batches since the last merge
+        self.label_bits = max(len(self.reduced_labels) - 1, 1).bit_length()
+        self._entity_keys = np.zeros(0, dtype=np.uint64)
+        self._pending_keys: List[np.ndarray] = []
+
+        self.analyze(dataset, batch_size)
+
+    @profiled("analyze")
+    def analyze(self, dataset: Union[Dataset, IterableDataset, Iterable], batch_size: int = 100_000) -> None:
+        """Add the statistics of (more of) a dataset, in batches of `batch_size` rows."""
+        columns = [self.label_column] if self.knowledge_base is not None else ["tokens", self.label_column]
+        if isinstance(dataset, Dataset):
+            for batch in dataset.select_columns(columns).with_format("arrow").iter(batch_size):
+                self.update(batch)
+        else:
+            for batch_tokens, batch_labels in iter_batches(dataset, self.label_column, batch_size):
+                self.update(to_arrow_batch(batch_tokens, batch_labels, self.label_column))
+
+    def update(self, batch: Union[pa.Table, pa.RecordBatch]) -> None:
+        """Add the statistics of one Arrow batch with the label column, and the `tokens` column unless a knowledge
+        base is given."""
+        ner_tags, offsets = flatten_list_array(batch.column(self.label_column))
+        labels, starts, ends, entity_offsets = self.entity_extractor.extract_batch(ner_tags, offsets)
+        labels = labels.astype(np.int64)
+        lengths = (ends - starts).astype(np.int64)
+        num_rows = len(offsets) - 1
+        num_labels = len(self.reduced_labels)
+        self.num_rows += num_rows
+        self.num_tokens += len(ner_tags)
+        count("analyze.rows", num_rows)
+        count("analyze.entities", len(labels))
+
+        self.sentence_lengths = add_histograms(self.sentence_lengths, np.bincount(np.diff(offsets)))
+        if len(labels):
+            stride = int(lengths.max()) + 1
+            entity_lengths = np.bincount(labels * stride + lengths, minlength=num_labels * stride)
+            self.entity_lengths = add_histograms(self.entity_lengths, entity_lengths.reshape(num_labels, stride))
+
+        rows = np.repeat(np.arange(num_rows), np.diff(entity_offsets))
+        row_counts = np.bincount(rows * num_labels + labels, minlength=num_rows * num_labels).reshape(
+            num_rows, num_labels
+        )
+        base = int(row_counts.max(initial=0)) + 1
+        if base**num_labels <= np.iinfo(np.int64).max:
+            # Encode the entity counts of every row as one number in base `base`, which is far quicker to count
+            unique_keys, num_unique_rows = np.unique(row_counts @ base ** np.arange(num_labels), return_counts=True)
+            unique_counts = unique_keys[:, None] // base ** np.arange(num_labels) % base
+        else:
+            unique_counts, num_unique_rows = np.unique(row_counts, axis=0, return_counts=True)
+        for entity_counts, num_entity_rows in zip(unique_counts.tolist(), num_unique_rows.tolist()):
+            self.entity_count_rows[tuple(entity_counts)] += num_entity_rows
+
+        if self.knowledge_base is None and len(labels):
+            self.update_entity_keys(batch.column("tokens"), labels, starts, ends, entity_offsets)
+
+    def update_entity_keys(
+        self,
+        tokens: Union[pa.ListArray, pa.ChunkedArray],
+        labels: np.ndarray,
+        starts: np.ndarray,
+        ends: np.ndarray,
+        entity_offsets: np.ndarray,
+    ) -> None:
+        if isinstance(tokens, pa.ChunkedArray):
+            tokens = tokens.combine_chunks()
+        token_offsets = np.asarray(tokens.offsets, dtype=np.int64)
+        positions, length_offsets = entity_token_positions(
+            token_offsets - token_offsets[0], starts, ends, entity_offsets
+        )
+        # Hash the entity tokens straight from the buffers of the Arrow string array
+        entity_tokens = pc.list_flatten(tokens).take(pa.array(positions))
+        offset_type = np.int64 if pa.types.is_large_string(entity_tokens.type) else np.int32
+        _, string_offsets, data = entity_tokens.buffers()
+        string_offsets = np.frombuffer(string_offsets, dtype=offset_type)[: len(entity_tokens) + 1]
+        data = np.zeros(0, dtype=np.uint8) if data is None else np.frombuffer(data, dtype=np.uint8)
+        hashes = hash_sequences(hash_strings(data, string_offsets), length_offsets)
+
+        # The label is stored in the top bits of the key, so all labels are deduplicated at once
+        keys = (hashes >> np.uint64(self.label_bits)) | (labels.astype(np.uint64) << np.uint64(64 - self.label_bits))
+        self._pending_keys.append(np.unique(keys))
+        # Merge once the pending keys outgrow the merged ones, so every key is only merged a few times
+        if sum(len(keys) for keys in self._pending_keys) > len(self._entity_keys):
+            self.merge_entity_keys()
+
+    def merge_entity_keys(self) -> np.ndarray:
+        if self._pending_keys:
+            self._entity_keys = np.unique(np.concatenate([self._entity_keys, *self._pending_keys]))
+            self._pending_keys.clear()
+        return self._entity_keys
+
+    @property
+    def entity_labels(self) -> List[int]:
+        """The (reduced) label ids of all entities in the dataset."""
+        return np.flatnonzero(self.entity_lengths.sum(axis=1)).tolist()
+
+    def num_entities(self, label: int) -> int:
+        """Return the number of entities of (reduced) label id `label` in the dataset."""
+        return int(self.entity_lengths[label].sum())
+
+    def num_unique_entities(self, label: int) -> int:
+        """Return the number of unique entities that an entity of (reduced) label id `label` can be swapped with,
+        i.e. the cardinality of its label in the knowledge base."""
+        if self.knowledge_base is None:
+            keys = self.merge_entity_keys()
+            shift = np.uint64(64 - self.label_bits)
+            start = np.searchsorted(keys, np.uint64(label) << shift)
+            end = (
+                len(keys)
+                if label + 1 >= 2**self.label_bits
+                else np.searchsorted(keys, np.uint64(label + 1) << shift)
+            )
+            return int(end - start)
+        if label not in self.knowledge_base:
+            # e.g. an external knowledge base that is keyed by label names
+            label = self.reduced_labels[label]
+        return self.knowledge_base.num_entities(label) if label in self.knowledge_base else 0
+
+    def num_combinations(self) -> Dict[int, int]:
+        """Return the number of rows per number of unique combinations of entities that a row can be augmented to,
+        i.e. the product of the knowledge base cardinalities of its entities."""
+        cardinalities = [max(self.num_unique_entities(label), 1) for label in range(len(self.reduced_labels))]
+        num_rows = defaultdict(int)
+        for entity_counts, num_entity_rows in self.entity_count_rows.items():
+            num_combinations = math.prod(
+                cardinality**num_entities for cardinality, num_entities in zip(cardinalities, entity_counts)
+            )
+            num_rows[num_combinations] += num_entity_rows
+        return dict(sorted(num_rows.items()))
+
+    def expected_unique_augmentations(self, N: int) -> float:
+        """Return the expected number of unique augmentations per row of `augment(N=N)`, i.e. after deduplication."""
+        if not self.num_rows:
+            return 0.0
+        return (
+            sum(
+                expected_unique_draws(num_combinations, N) * num_rows
+                for num_combinations, num_rows in self.num_combinations().items()
+            )
+            / self.num_rows
+        )
+
+    def to_dict(self, Ns: Tuple[int, ...] = (1, 4, 16)) -> Dict[str, Any]:
+        """Export the statistics as a JSON serializable dict, including the expected unique augmentations per row
+        for every `N` in `Ns`."""
+        combinations = self.num_combinations()
+        cumulative_rows = np.cumsum(list(combinations.values()))
+        median = list(combinations)[np.searchsorted(cumulative_rows, self.num_rows / 2)] if combinations else 0
+        return {
+            "label_scheme": self.label_scheme.name,
+            "rows": self.num_rows,
+            "tokens": self.num_tokens,
+            "rows_without_entities": self.entity_count_rows.get((0,) * len(self.reduced_labels), 0),
+            "sentence_lengths": self.sentence_lengths.tolist(),
+            "labels": {
+                self.reduced_labels[label]: {
+                    "entities": self.num_entities(label),
+                    "unique_entities": self.num_unique_entities(label),
+                    "entity_lengths": np.trim_zeros(self.entity_lengths[label], "b").tolist(),
+                }
+                for label in self.entity_labels
+            },
+            "combinations": {
+                "min": min(combinations, default=0),
+                "median": median,
+                "max": max(combinations, default=0),
+            },
+            "expected_unique_augmentations": {N: self.expected_unique_augmentations(N) for N in Ns},
+        }
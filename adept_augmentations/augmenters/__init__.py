@@ -1,3 +1,40 @@
-from .augmenter import EntitySwapAugmenter
+import importlib
+from typing import TYPE_CHECKING, Any, List
 
-__all__ = ["EntitySwapAugmenter"]
+if TYPE_CHECKING:
+    from .augmenter import EntitySwapAugmenter, KnowledgeBaseSwapAugmenter
+    from .deduplication import Deduplicator
+    from .sentence_crop import SentenceCropAugmenter
+    from .spacy_augmenter import create_entity_swap_augmenter
+    from .subwords import SubwordEncoder
+
+# Imported on first access, so e.g. the spaCy augmenter doesn't import `datasets` and vice versa
+_LAZY_IMPORTS = {
+    "Deduplicator": ".deduplication",
+    "EntitySwapAugmenter": ".augmenter",
+    "KnowledgeBaseSwapAugmenter": ".augmenter",
+    "SentenceCropAugmenter": ".sentence_crop",
+    "SubwordEncoder": ".subwords",
+    "create_entity_swap_augmenter": ".spacy_augmenter",
+}
+
+__all__ = [
+    "Deduplicator",
+    "EntitySwapAugmenter",
+    "KnowledgeBaseSwapAugmenter",
+    "SentenceCropAugmenter",
+    "SubwordEncoder",
+    "create_entity_swap_augmenter",
+]
+
+
+def __getattr__(name: str) -> Any:
+    if name in _LAZY_IMPORTS:
+        value = getattr(importlib.import_module(_LAZY_IMPORTS[name], __name__), name)
+        globals()[name] = value
+        return value
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def __dir__() -> List[str]:
+    return sorted(set(globals()) | set(__all__))
@@ -1,157 +1,1246 @@
+import json
+import math
+import os
+import queue
 import random
-from collections import defaultdict
-from enum import Enum, auto
-from typing import List, Optional, Set, Union
+import shutil
+import sys
+import tempfile
+from collections.abc import Iterable
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from itertools import chain, compress, islice
+from pathlib import Path
+from typing import (
+    TYPE_CHECKING,
+    Any,
+    Callable,
+    Dict,
+    Iterator,
+    List,
+    Optional,
+    Tuple,
+    Union,
+)
 
-from datasets import Dataset
-from spacy.tokens import DocBin
+import numpy as np
+import pyarrow as pa
+from datasets import (
+    ClassLabel,
+    Dataset,
+    DatasetInfo,
+    Features,
+    IterableDataset,
+    Sequence,
+    Value,
+    concatenate_datasets,
+    config,
+    is_caching_enabled,
+)
+from datasets.fingerprint import Hasher, generate_random_fingerprint
+from datasets.iterable_dataset import ExamplesIterable
+from multiprocess import Pool
 
 from adept_augmentations.augmenters.constants import Entity
+from adept_augmentations.augmenters.deduplication import Deduplicator
 from adept_augmentations.augmenters.extractors import (
-    EntityExtractorBILOU,
-    EntityExtractorBIOES,
-    EntityExtractorIOB,
-    EntityExtractorNoScheme,
+    LabelScheme,
+    entity_token_positions,
+    flatten_list_array,
+)
+from adept_augmentations.augmenters.knowledge_base import (
+    KnowledgeBase,
+    MemoryMappedKnowledgeBase,
 )
+from adept_augmentations.augmenters.spans import EntitySpans
+from adept_augmentations.augmenters.subwords import SubwordEncoder
+from adept_augmentations.profilers import count, get_profiler, profiled, stage
 from adept_augmentations.utils import (
     convert_dataset_to_docbin,
     convert_docbin_to_dataset,
+    is_docbin,
+    write_arrow_file,
+    write_shards,
 )
 
+if TYPE_CHECKING:
+    from spacy.tokens import DocBin
 
-class LabelScheme(Enum):
-    NONE = auto()
-    IOB2 = auto()  # Works for IOB, too
-    BIOES = auto()
-    BILOU = auto()
+# Bump whenever the extracted entities or the knowledge base format change, to invalidate existing caches
+EXTRACTION_CACHE_VERSION = "4"
+# Bump whenever the format of a saved augmenter changes, see `EntitySwapAugmenter.save`
+AUGMENTER_STATE_VERSION = "2"
+AUGMENTER_STATE_FILE = "augmenter.json"
 
-    @staticmethod
-    def are_labels_schemed(labels) -> bool:
-        """True if all labels are strings matching one of the two following rules:
 
-        * `label == "O"`
-        * `label[0] in "BIESLU"` and `label[1] == "-"`, e.g. in `"I-LOC"`
+def iter_batches(
+    examples: Iterable, label_column: str, batch_size: int
+) -> Iterator[Tuple[List[List[str]], List[List[int]]]]:
+    """Group a stream of examples into batches of tokens and label ids.
 
-        We ensure that the first index is in `"BIELSU"` because of these definitions:
-        * `"B"` for `"begin"`
-        * `"I"` for `"in"`
-        * `"E"` for `"end"`
-        * `"L"` for `"last"`
-        * `"S"` for `"singular"`
-        * `"U"` for `"unit"`
+    Args:
+        examples (Iterable): Either dictionaries with `"tokens"` and `label_column` keys, e.g. from an
+            `IterableDataset`, or `(tokens, ner_tags)` pairs.
+        label_column (str): The key of the label ids in the example dictionaries.
+        batch_size (int): The maximum number of examples per batch.
 
-        Args:
-            id2label (Dict[int, str]): Dictionary of label ids to label strings.
+    Yields:
+        Tuple[List[List[str]], List[List[int]]]: The tokens and label ids of every example in the batch.
+    """
+    examples = iter(examples)
+    while batch := list(islice(examples, batch_size)):
+        if isinstance(batch[0], dict):
+            yield [example["tokens"] for example in batch], [example[label_column] for example in batch]
+        else:
+            yield [tokens for tokens, _ in batch], [labels for _, labels in batch]
 
-        Returns:
-            bool: True if it seems like a labeling scheme is used.
-        """
-        return all(label == "O" or (len(label) > 2 and label[0] in "BIELSU" and label[1] == "-") for label in labels)
 
-    def get_scheme_tags(labels) -> Set[str]:
-        return set(label[0] for label in labels)
+def to_arrow_batch(batch_tokens: List[List[str]], batch_labels: List[List[int]], label_column: str) -> pa.Table:
+    return pa.table(
+        {
+            "tokens": pa.array(batch_tokens, type=pa.list_(pa.string())),
+            label_column: pa.array(batch_labels, type=pa.list_(pa.int64())),
+        }
+    )
 
-    @classmethod
-    def from_labels(cls, labels: List[str]):
-        if not cls.are_labels_schemed(labels):
-            return cls.NONE, EntityExtractorNoScheme(labels)
 
-        tags = cls.get_scheme_tags(labels)
-        if tags == set("IOB"):
-            return cls.IOB2, EntityExtractorIOB(labels)
-        if tags == set("BIOES"):
-            return cls.BIOES, EntityExtractorBIOES(labels)
-        if tags == set("BILOU"):
-            return cls.BILOU, EntityExtractorBILOU(labels)
-        raise NotImplementedError(f"The detected labeling scheme with tags {tags!r} has not been implemented.")
+def generate_augmented_examples(augmenter: "EntitySwapAugmenter", **kwargs: Any) -> Iterator[Tuple[int, dict]]:
+    """Yield the keyed examples of `augmenter.augment_iter(**kwargs)`, for the `IterableDataset` of a streamed
+    `EntitySwapAugmenter.augment`."""
+    yield from enumerate(augmenter.augment_iter(**kwargs))
+
+
+def length_budget(length: int, max_length: Optional[int], length_tolerance: Optional[int]) -> Optional[int]:
+    """Return the maximum length of the sentences augmented from a sentence of `length` tokens, if any."""
+    if length_tolerance is not None:
+        max_length = length + length_tolerance if max_length is None else min(max_length, length + length_tolerance)
+    return max_length
+
+
+def save_directory(save: Callable[[Path], None], path: Path, replace: bool = True) -> None:
+    """Save to the directory `path` through a temporary directory, so an interrupted save never leaves a partial one.
+
+    Args:
+        save (Callable[[Path], None]): Saves to the given directory, e.g. `KnowledgeBase.save`.
+        path (Path): The directory to save to.
+        replace (bool): Whether to replace `path` if it exists. Otherwise the existing directory is kept, e.g. when
+            another process has cached the same data in the meantime. Defaults to True.
+    """
+    temporary_path = Path(tempfile.mkdtemp(dir=path.parent))
+    save(temporary_path)
+    if replace:
+        shutil.rmtree(path, ignore_errors=True)
+    try:
+        temporary_path.rename(path)
+    except OSError:
+        shutil.rmtree(temporary_path)
 
 
 class EntitySwapAugmenter:
+    @profiled("EntitySwapAugmenter.__init__")
     def __init__(
-        self, dataset: Union[Dataset, DocBin], labels: Optional[List[str]] = None, label_column: str = "ner_tags"
+        self,
+        dataset: Union[Dataset, "DocBin", IterableDataset, Iterable],
+        labels: Optional[List[str]] = None,
+        label_column: str = "ner_tags",
+        num_proc: Optional[int] = None,
+        knowledge_base: Optional[KnowledgeBase] = None,
+        load_from_cache_file: Optional[bool] = None,
     ) -> None:
         self.dataset_type = type(dataset)
-        if self.dataset_type == DocBin:
+        self.is_docbin = is_docbin(dataset)
+        # Iterable datasets and generators are only iterated over, never materialized
+        self.streaming = self.dataset_type is not Dataset and not self.is_docbin
+        if self.is_docbin:
             dataset = convert_docbin_to_dataset(dataset, labels)
-        elif self.dataset_type != Dataset:
-            raise TypeError("dataset must be either a `datasets.Dataset` or a `spacy.tokens.DocBin`.")
+        elif self.streaming and not isinstance(dataset, Iterable):
+            raise TypeError(
+                "dataset must be either a `datasets.Dataset`, a `spacy.tokens.DocBin`, a `datasets.IterableDataset` or"
+                " an iterable of `(tokens, ner_tags)` pairs."
+            )
 
-        self.dataset = dataset
         if labels is None:
+            if getattr(dataset, "features", None) is None:
+                raise ValueError("`labels` must be provided if the dataset has no features to infer them from.")
             # TODO: This won't always work
             labels = dataset.features[label_column].feature.names
         self.labels = labels
         self.label_column = label_column
 
         self.label_scheme, self.entity_extractor = LabelScheme.from_labels(labels)
+        # The directory that the augmenter was last saved to or loaded from, and its number of examples at the time
+        self.saved_state: Optional[Tuple[Path, int]] = None
+        # A knowledge base that was passed in may be shared with other augmenters, so it is copied before extending it
+        self.shared_knowledge_base = knowledge_base is not None
 
         # TODO: Require `tokens` in dataset
-        # TODO: Ensure that "entities" doesn't already exist in dataset
-        self.knowledge_base = defaultdict(set)
-        self.dataset = self.dataset.map(
-            self.extract_entities, input_columns=["tokens", label_column], load_from_cache_file=False
+        if self.streaming:
+            # Only the knowledge base is kept: the entities are extracted again when augmenting
+            self.entity_spans = None
+            self.knowledge_base = KnowledgeBase() if knowledge_base is None else knowledge_base
+            if knowledge_base is None:
+                for batch_tokens, batch_labels in iter_batches(dataset, label_column, batch_size=1000):
+                    self.extract_entities_batch(to_arrow_batch(batch_tokens, batch_labels, label_column))
+            with stage("build_knowledge_base"):
+                self.knowledge_base.build()
+        else:
+            self.entity_spans, self.knowledge_base = self.extract(
+                dataset, num_proc, knowledge_base, load_from_cache_file
+            )
+        # The dataset is never rewritten: the entities of its rows are kept in `self.entity_spans` instead. It is only
+        # set after extracting, so the workers of `extract` don't receive a pickled copy of it.
+        self.dataset = dataset
+
+        profiler = get_profiler()
+        if profiler is not None:
+            reduced_labels = self.entity_extractor.reduced_labels
+            profiler.record(
+                "knowledge_base.entities",
+                {
+                    reduced_labels[label]
+                    if isinstance(label, int)
+                    else str(label): self.knowledge_base.num_entities(label)
+                    for label in self.knowledge_base.labels
+                },
+            )
+
+    @profiled("extract")
+    def extract(
+        self,
+        dataset: Dataset,
+        num_proc: Optional[int] = None,
+        knowledge_base: Optional[KnowledgeBase] = None,
+        load_from_cache_file: Optional[bool] = None,
+    ) -> Tuple[EntitySpans, KnowledgeBase]:
+        """Extract the entities of the dataset, and build the knowledge base unless one is provided.
+
+        Both are cached on disk, keyed by the fingerprint of the dataset, the labels and the label scheme, so creating
+        another augmenter for the same dataset reuses them instead of extracting again. The dataset itself is only
+        read, never rewritten.
+
+        Args:
+            dataset (Dataset): The dataset to extract the entities from.
+            num_proc (Optional[int]): The number of processes to extract with. Defaults to None, i.e. no
+                multiprocessing.
+            knowledge_base (Optional[KnowledgeBase]): A prebuilt knowledge base to use, e.g. a global knowledge base
+                merged from the knowledge bases of all shards of a larger dataset. Defaults to None.
+            load_from_cache_file (Optional[bool]): Whether to use and update the cache. Defaults to None, i.e.
+                whenever caching is enabled in `datasets` and the dataset is stored in cache files, next to which the
+                cache is written. Like `datasets`, in-memory datasets are only cached in the global
+                `HF_DATASETS_CACHE` when this is True, as nothing cleans these caches up.
+
+        Returns:
+            Tuple[EntitySpans, KnowledgeBase]: The entities of every row of the dataset, and the knowledge base.
+        """
+        if load_from_cache_file is None:
+            load_from_cache_file = is_caching_enabled() and bool(dataset.cache_files)
+        num_shards = num_proc if num_proc is not None and num_proc > 1 else 1
+        cache_paths = [None] * num_shards
+        if load_from_cache_file:
+            cache_key = Hasher.hash(
+                [
+                    dataset._fingerprint,
+                    self.labels,
+                    self.label_scheme.name,
+                    self.label_column,
+                    EXTRACTION_CACHE_VERSION,
+                ]
+            )
+            if dataset.cache_files:
+                cache_dir = Path(dataset.cache_files[0]["filename"]).parent
+            else:
+                cache_dir = Path(config.HF_DATASETS_CACHE) / "adept_augmentations"
+            cache_dir.mkdir(parents=True, exist_ok=True)
+            cache_paths = [
+                cache_dir / f"entities-{cache_key}_{index:05d}_of_{num_shards:05d}" for index in range(num_shards)
+            ]
+            knowledge_base_path = cache_dir / f"knowledge_base-{cache_key}"
+            if knowledge_base is None and knowledge_base_path.exists():
+                knowledge_base = KnowledgeBase.load(knowledge_base_path)
+
+        # The entities only have to be gathered into a knowledge base if none is provided or cached
+        update_knowledge_base = knowledge_base is None
+        if num_shards > 1:
+            # Every worker extracts the entities of a contiguous shard into its own partial knowledge base.
+            # When called from `__init__`, neither `self.dataset` nor `self.knowledge_base` is set yet, so the workers
+            # don't receive a pickled copy of them.
+            shards = [dataset.shard(num_shards, index, contiguous=True) for index in range(num_shards)]
+            with Pool(num_shards) as pool:
+                entity_spans, knowledge_bases = zip(
+                    *pool.starmap(
+                        self.extract_shard,
+                        [(shard, update_knowledge_base, cache_path) for shard, cache_path in zip(shards, cache_paths)],
+                    )
+                )
+            entity_spans = EntitySpans.concatenate(entity_spans)
+        else:
+            entity_spans, knowledge_base_shard = self.extract_shard(dataset, update_knowledge_base, cache_paths[0])
+            knowledge_bases = [knowledge_base_shard]
+
+        if update_knowledge_base:
+            knowledge_base = KnowledgeBase.merge(knowledge_bases) if num_shards > 1 else knowledge_bases[0]
+            if load_from_cache_file:
+                save_directory(knowledge_base.save, knowledge_base_path, replace=False)
+        return entity_spans, knowledge_base
+
+    def extract_shard(
+        self, dataset: Dataset, update_knowledge_base: bool = True, cache_path: Optional[Path] = None
+    ) -> Tuple[EntitySpans, KnowledgeBase]:
+        """Extract the entities of (a shard of) the dataset into a fresh knowledge base.
+
+        Args:
+            dataset (Dataset): The (shard of the) dataset to extract the entities from.
+            update_knowledge_base (bool): Whether to gather the entities into the knowledge base. If False, only the
+                entity spans are extracted and the returned knowledge base is empty.
+            cache_path (Optional[Path]): The directory to cache the entity spans in. Unless the knowledge base is
+                updated, the cached spans are loaded from here if they exist. Defaults to None, i.e. no caching.
+
+        Returns:
+            Tuple[EntitySpans, KnowledgeBase]: The entities of every row of the dataset, and the built knowledge base
+            of the entities in this dataset.
+        """
+        knowledge_base = KnowledgeBase()
+        if cache_path is not None and not update_knowledge_base and cache_path.exists():
+            return EntitySpans.load(cache_path), knowledge_base
+        entity_spans = self.extract_entity_spans(dataset, update_knowledge_base, knowledge_base=knowledge_base)
+        with stage("build_knowledge_base"):
+            knowledge_base.build()
+        if cache_path is not None:
+            save_directory(entity_spans.save, cache_path, replace=False)
+        return entity_spans, knowledge_base
+
+    def extract_entity_spans(
+        self,
+        dataset: Dataset,
+        update_knowledge_base: bool = True,
+        batch_size: int = 1000,
+        knowledge_base: Optional[KnowledgeBase] = None,
+    ) -> EntitySpans:
+        """Extract the entities of every row of the dataset from zero-copy Arrow batches of its columns.
+
+        Args:
+            dataset (Dataset): The dataset to extract the entities from.
+            update_knowledge_base (bool): Whether to add the entities to the knowledge base, without building it.
+                If False, only the label column is read. Defaults to True.
+            batch_size (int): The number of rows to extract at once. Defaults to 1000.
+            knowledge_base (Optional[KnowledgeBase]): The knowledge base to add the entities to. Defaults to None,
+                i.e. `self.knowledge_base`.
+
+        Returns:
+            EntitySpans: The entities of every row of the dataset.
+        """
+        columns = ["tokens", self.label_column] if update_knowledge_base else [self.label_column]
+        batches = dataset.select_columns(columns).with_format("arrow").iter(batch_size)
+        return EntitySpans.concatenate(
+            self.extract_entities_batch(batch, update_knowledge_base, knowledge_base=knowledge_base)
+            for batch in batches
         )
 
-    def augment(self, N: int = 4, deduplicate: bool = True) -> Union[Dataset, DocBin]:
+    @profiled("add_examples")
+    def add_examples(self, dataset: Union[Dataset, "DocBin"]) -> Dataset:
+        """Add new gold examples, e.g. the sentences that were annotated since the augmenter was created or loaded.
+
+        Only the entities of the new examples are extracted and added to the knowledge base, which is updated in
+        place, so adding examples takes time in proportion to the number of new examples rather than the size of the
+        dataset. A knowledge base that was passed to the augmenter, and may be shared with other augmenters, is
+        copied once before it is first updated. External knowledge bases, e.g. of `KnowledgeBaseSwapAugmenter`, are
+        not updated. Afterwards, the new
+        examples are part of the dataset that `augment` augments, while `augment(examples=...)` augments only them:
+
+            num_examples = len(augmenter.dataset)
+            new_examples = augmenter.add_examples(new_gold_dataset)
+            augmented_examples = augmenter.augment(N=4, seed=42, examples=new_examples, index_offset=num_examples)
+
+        With the same `seed`, these are the last augmented examples that `augmenter.augment(N=4, seed=42)` creates.
+
+        Args:
+            dataset (Union[Dataset, DocBin]): The new examples, with the same labels as the dataset.
+
+        Returns:
+            Dataset: The new examples, converted to a `Dataset` if they were given as a `DocBin`.
+        """
+        if self.streaming:
+            raise ValueError("Adding examples requires a `datasets.Dataset`, as streamed datasets aren't stored.")
+        if is_docbin(dataset):
+            dataset = convert_docbin_to_dataset(dataset, [label for label in self.labels if label != "O"])
+        # Label ids without label names can't be checked
+        labels = getattr(dataset.features[self.label_column].feature, "names", self.labels)
+        if labels != self.labels:
+            raise ValueError(
+                f"The labels of the new examples {labels!r} differ from the labels of the augmenter {self.labels!r}."
+            )
+
+        update_knowledge_base = isinstance(self.knowledge_base, KnowledgeBase)
+        if update_knowledge_base and self.shared_knowledge_base:
+            self.knowledge_base = self.knowledge_base.copy()
+            self.shared_knowledge_base = False
+        entity_spans = self.extract_entity_spans(dataset, update_knowledge_base)
+        if update_knowledge_base:
+            with stage("build_knowledge_base"):
+                self.knowledge_base.build()
+        self.dataset = concatenate_datasets([self.dataset, dataset])
+        self.entity_spans = EntitySpans.concatenate([self.entity_spans, entity_spans])
+        return dataset
+
+    @profiled("augment")
+    def augment(
+        self,
+        N: int = 4,
+        deduplicate: bool = True,
+        num_proc: Optional[int] = None,
+        seed: Optional[int] = None,
+        index_offset: int = 0,
+        deduplicator: Optional[Deduplicator] = None,
+        exclude_gold: bool = False,
+        exact: bool = False,
+        max_length: Optional[int] = None,
+        length_tolerance: Optional[int] = None,
+        examples: Optional[Union[Dataset, "DocBin"]] = None,
+        subword_encoder: Optional[SubwordEncoder] = None,
+    ) -> Union[Dataset, "DocBin", IterableDataset]:
+        """Create up to `N` augmented sentences for every sentence in the dataset.
+
+        Args:
+            N (int): The number of times that every sentence is reused. Defaults to 4.
+            deduplicate (bool): Whether to skip augmented sentences that were already created from the same sentence.
+                Defaults to True.
+            num_proc (Optional[int]): The number of processes to augment with. Defaults to None, i.e. no
+                multiprocessing.
+            seed (Optional[int]): If set, the swaps of every example are randomized with a seed derived from `seed`
+                and the index of the example, so the output is reproducible. Defaults to None, i.e. the global
+                `random` module is used.
+            index_offset (int): The global index of the first example, e.g. when augmenting one contiguous shard of a
+                larger dataset with the merged knowledge base of all shards. Then the concatenated output of all
+                shards is identical to augmenting the full dataset at once with the same `seed`. Defaults to 0.
+            deduplicator (Optional[Deduplicator]): If set, augmented sentences that are identical to any sentence
+                that was created before, e.g. from another gold sentence or in an earlier run with the same
+                deduplicator, are skipped as well. Requires a single process. Defaults to None.
+            exclude_gold (bool): Whether to skip augmented sentences that are identical to a gold sentence, i.e.
+                that swapped every entity for itself. Defaults to False.
+            exact (bool): Whether to create exactly `N` unique sentences from every sentence, or all of them if fewer
+                exist, by drawing distinct combinations of knowledge base entities without replacement rather than
+                discarding duplicate draws. Defaults to False.
+            max_length (Optional[int]): If set, swapped in entities are only sampled from those that keep the
+                augmented sentence at most this many tokens long, e.g. to stay within a padding bucket. Entities for
+                which no knowledge base entity fits are kept as is. Defaults to None.
+            length_tolerance (Optional[int]): If set, augmented sentences are at most this many tokens longer than
+                their gold sentence, in the same way as `max_length`. Defaults to None.
+            examples (Optional[Union[Dataset, DocBin]]): The examples to augment instead of the dataset, e.g. the new
+                examples returned by `add_examples`. Their entities are swapped with those of the knowledge base, but
+                they are not added to it. Ignored for streamed datasets, see `augment_iter` instead. Defaults to None.
+            subword_encoder (Optional[SubwordEncoder]): If set, the augmented sentences consist of `input_ids` and
+                subword-aligned `labels` rather than tokens and label ids. These are spliced together from the
+                subword ids of the gold sentence and of the swapped in entities, which are only tokenized once, so
+                the augmented sentences don't have to be tokenized again. Defaults to None.
+
+        Returns:
+            Union[Dataset, DocBin, IterableDataset]: The augmented dataset, of the same type as the dataset the
+            augmenter was created with, or a `Dataset` with `subword_encoder`. For streamed datasets, this is an
+            `IterableDataset` that augments lazily with `augment_iter`, and `num_proc` is ignored. This requires a
+            dataset that can be iterated over again, so for generators, use `augment_iter(examples=...)` instead.
+        """
         # TODO: Rename N, perhaps to "runs"?
-        # N is the number of times we reuse every sentence
-        augmented_dataset = self.dataset.map(
-            self.replace_entities,
-            input_columns=["tokens", self.label_column, "entities"],
-            remove_columns=self.dataset.column_names,
-            load_from_cache_file=False,
-            fn_kwargs={"N": N, "deduplicate": deduplicate},
-            batched=True,
+        if self.streaming:
+            if iter(self.dataset) is self.dataset:
+                raise ValueError(
+                    "The iterator that the augmenter was created with has already been consumed to build the knowledge"
+                    " base, use `augment_iter(examples=...)` to augment a fresh iterator of the examples instead."
+                )
+            # Unlike `IterableDataset.from_generator`, this neither pickles nor hashes the augmenter, its knowledge
+            # base or the dataset that it streams
+            features = self.features if subword_encoder is None else subword_encoder.features
+            return IterableDataset(
+                ExamplesIterable(
+                    generate_augmented_examples,
+                    {
+                        "augmenter": self,
+                        "N": N,
+                        "deduplicate": deduplicate,
+                        "seed": seed,
+                        "index_offset": index_offset,
+                        "deduplicator": deduplicator,
+                        "exclude_gold": exclude_gold,
+                        "exact": exact,
+                        "max_length": max_length,
+                        "length_tolerance": length_tolerance,
+                        "subword_encoder": subword_encoder,
+                    },
+                ),
+                info=DatasetInfo(features=features),
+            )
+        if num_proc is not None and num_proc > 1:
+            if deduplicator is not None or exclude_gold:
+                raise ValueError("Deduplicating across sentences requires a single process, i.e. `num_proc=None`.")
+            if seed is None:
+                # The workers are forked with identical `random` states, so give every example its own seed instead
+                seed = random.getrandbits(64)
+        if examples is None:
+            examples, entity_spans = self.dataset, self.entity_spans
+        else:
+            if is_docbin(examples):
+                examples = convert_docbin_to_dataset(examples, [label for label in self.labels if label != "O"])
+            entity_spans = self.extract_entity_spans(examples, update_knowledge_base=False)
+        deduplicator = self.prepare_deduplicator(deduplicator, exclude_gold, examples)
+        if subword_encoder is not None:
+            # Tokenize all knowledge base entities at once, rather than as they are swapped in
+            subword_encoder.add_words(self.knowledge_base.vocab)
+        columns = ["tokens", self.label_column]
+        augmented_dataset = (
+            examples.select_columns(columns)
+            .with_format("arrow")
+            .map(
+                self.replace_entities_batch,
+                remove_columns=columns,
+                load_from_cache_file=False,
+                # The output is never cached, so skip hashing the augmenter and its knowledge base
+                new_fingerprint=generate_random_fingerprint(),
+                fn_kwargs={
+                    "entity_spans": entity_spans,
+                    "N": N,
+                    "deduplicate": deduplicate,
+                    "seed": seed,
+                    "index_offset": index_offset,
+                    "deduplicator": deduplicator,
+                    "exact": exact,
+                    "max_length": max_length,
+                    "length_tolerance": length_tolerance,
+                    "subword_encoder": subword_encoder,
+                },
+                features=None if subword_encoder is None else subword_encoder.features,
+                batched=True,
+                with_indices=True,
+                num_proc=num_proc,
+            )
+            .with_format(examples.format["type"])
         )
-        if self.dataset_type == DocBin:
-            return convert_dataset_to_docbin(augmented_dataset)
+        if self.is_docbin and subword_encoder is None:
+            return convert_dataset_to_docbin(augmented_dataset, self.label_column)
         else:
             return augmented_dataset
 
-    def extract_entities(self, tokens: List[str], labels: List[int]):
-        entities = list(self.entity_extractor(labels))
-        for label, start, end in entities:
-            entity = tuple(tokens[start:end])
-            # TODO: Check why sometimes the entity has length 0
-            if entity:
-                self.knowledge_base[label].add(entity)
-        return {"tokens": tokens, self.label_column: labels, "entities": entities}
+    def augment_iter(
+        self,
+        N: int = 4,
+        deduplicate: bool = True,
+        seed: Optional[int] = None,
+        index_offset: int = 0,
+        examples: Optional[Iterable] = None,
+        batch_size: int = 1000,
+        deduplicator: Optional[Deduplicator] = None,
+        exclude_gold: bool = False,
+        exact: bool = False,
+        max_length: Optional[int] = None,
+        length_tolerance: Optional[int] = None,
+        subword_encoder: Optional[SubwordEncoder] = None,
+    ) -> Iterator[Dict[str, List[Any]]]:
+        """Lazily yield augmented examples, so memory usage is bounded by the knowledge base and `batch_size`.
+
+        Args:
+            N (int): The number of times that every sentence is reused. Defaults to 4.
+            deduplicate (bool): Whether to skip augmented sentences that were already created from the same sentence.
+                Defaults to True.
+            seed (Optional[int]): See `augment`. Defaults to None, i.e. the global `random` module is used.
+            index_offset (int): See `augment`. Defaults to 0.
+            examples (Optional[Iterable]): The examples to augment, in the same form as the dataset that the augmenter
+                was created with. Defaults to None, i.e. that dataset is iterated over again, which requires a second
+                pass over it. Provide `examples` to augment e.g. a fresh generator instead.
+            batch_size (int): The number of examples that are augmented at once. Defaults to 1000.
+            deduplicator (Optional[Deduplicator]): See `augment`. Defaults to None.
+            exclude_gold (bool): See `augment`, which requires an additional pass over the examples. Defaults to False.
+            exact (bool): See `augment`. Defaults to False.
+            max_length (Optional[int]): See `augment`. Defaults to None.
+            length_tolerance (Optional[int]): See `augment`. Defaults to None.
+            subword_encoder (Optional[SubwordEncoder]): See `augment`. Defaults to None.
+
+        Yields:
+            Dict[str, List[Any]]: The tokens and label ids of the augmented examples, or their `input_ids` and
+            `labels` with `subword_encoder`.
+        """
+        for batch in self.iter_augmented_batches(
+            N,
+            deduplicate,
+            seed,
+            index_offset,
+            examples,
+            batch_size,
+            deduplicator,
+            exclude_gold,
+            exact,
+            max_length,
+            length_tolerance,
+            subword_encoder,
+        ):
+            for values in zip(*batch.values()):
+                yield dict(zip(batch, values))
+
+    def iter_augmented_batches(
+        self,
+        N: int = 4,
+        deduplicate: bool = True,
+        seed: Optional[int] = None,
+        index_offset: int = 0,
+        examples: Optional[Iterable] = None,
+        batch_size: int = 1000,
+        deduplicator: Optional[Deduplicator] = None,
+        exclude_gold: bool = False,
+        exact: bool = False,
+        max_length: Optional[int] = None,
+        length_tolerance: Optional[int] = None,
+        subword_encoder: Optional[SubwordEncoder] = None,
+    ) -> Iterator[Dict[str, List[Any]]]:
+        """Batched equivalent of `augment_iter`, yielding the augmented examples of every `batch_size` examples."""
+        if examples is None:
+            examples = self.dataset
+            if self.streaming and iter(examples) is examples:
+                raise ValueError(
+                    "The examples to augment must be provided, as the iterator that the augmenter was created with has"
+                    " already been consumed to build the knowledge base."
+                )
+        deduplicator = self.prepare_deduplicator(deduplicator, exclude_gold, examples, batch_size)
+        if subword_encoder is not None:
+            subword_encoder.add_words(self.knowledge_base.vocab)
+
+        if isinstance(examples, Dataset):
+            if examples is self.dataset:
+                entity_spans = self.entity_spans
+            else:
+                entity_spans = self.extract_entity_spans(examples, update_knowledge_base=False)
+
+            def dataset_batches():
+                start = 0
+                for batch in (
+                    examples.select_columns(["tokens", self.label_column]).with_format("arrow").iter(batch_size)
+                ):
+                    yield (
+                        batch.column("tokens").to_pylist(),
+                        batch.column(self.label_column).to_pylist(),
+                        entity_spans.rows(range(start, start + batch.num_rows)),
+                    )
+                    start += batch.num_rows
+
+            batches = dataset_batches()
+        else:
+
+            def extract_batches():
+                for batch_tokens, batch_labels in iter_batches(examples, self.label_column, batch_size):
+                    batch = to_arrow_batch(batch_tokens, batch_labels, self.label_column)
+                    entity_spans = self.extract_entities_batch(batch, update_knowledge_base=False)
+                    yield batch_tokens, batch_labels, entity_spans.to_list()
+
+            batches = extract_batches()
+
+        for batch_tokens, batch_labels, batch_entities in batches:
+            batch = self.replace_entities(
+                batch_tokens,
+                batch_labels,
+                batch_entities,
+                N=N,
+                deduplicate=deduplicate,
+                seed=seed,
+                index_offset=index_offset,
+                deduplicator=deduplicator,
+                exact=exact,
+                max_length=max_length,
+                length_tolerance=length_tolerance,
+                subword_encoder=subword_encoder,
+            )
+            index_offset += len(batch_tokens)
+            yield batch
+
+    def augment_to_disk(
+        self,
+        path: Union[str, os.PathLike],
+        N: int = 4,
+        deduplicate: bool = True,
+        seed: Optional[int] = None,
+        index_offset: int = 0,
+        shard_size: int = 100_000,
+        format: str = "parquet",
+        batch_size: int = 1000,
+        deduplicator: Optional[Deduplicator] = None,
+        exclude_gold: bool = False,
+        exact: bool = False,
+        max_length: Optional[int] = None,
+        length_tolerance: Optional[int] = None,
+    ) -> List[Path]:
+        """Augment straight to disk as Parquet, Arrow or spaCy shards, without materializing the augmented dataset.
+
+        The examples are augmented in batches on the calling thread, while a background thread writes (and for
+        Parquet, compresses) them, so memory usage stays constant regardless of the size of the output. The shards
+        keep the `tokens` and label features, so e.g. `Dataset.from_parquet` restores the label names. With the
+        `"spacy"` format, every shard is a `.spacy` file, i.e. a `DocBin`, with the entities as `doc.ents`.
+
+        Args:
+            path (Union[str, os.PathLike]): The directory to write the shards to.
+            N (int): The number of times that every sentence is reused. Defaults to 4.
+            deduplicate (bool): Whether to skip augmented sentences that were already created from the same sentence.
+                Defaults to True.
+            seed (Optional[int]): See `augment`. Defaults to None, i.e. the global `random` module is used.
+            index_offset (int): See `augment`. Defaults to 0.
+            shard_size (int): The maximum number of rows per shard. Defaults to 100,000.
+            format (str): Either `"parquet"`, `"arrow"` or `"spacy"`. Defaults to `"parquet"`.
+            batch_size (int): The number of gold examples that are augmented at once. Defaults to 1000.
+            deduplicator (Optional[Deduplicator]): See `augment`. Defaults to None.
+            exclude_gold (bool): See `augment`. Defaults to False.
+            exact (bool): See `augment`. Defaults to False.
+            max_length (Optional[int]): See `augment`. Defaults to None.
+            length_tolerance (Optional[int]): See `augment`. Defaults to None.
+
+        Returns:
+            List[Path]: The paths of the written shards, in order.
+        """
+        if format not in ("parquet", "arrow", "spacy"):
+            raise ValueError(f"format must be either 'parquet', 'arrow' or 'spacy', but got {format!r}.")
+        Path(path).mkdir(parents=True, exist_ok=True)
+        schema = self.features.arrow_schema
+        tables = queue.Queue(maxsize=4)
+
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            writer = executor.submit(write_shards, tables, path, schema, shard_size, format)
+
+            def put(table: Optional[pa.Table]) -> bool:
+                """Put a table in the queue, unless the writer has stopped, e.g. because it failed."""
+                # Don't block forever on a full queue if the writer has failed
+                while not writer.done():
+                    try:
+                        tables.put(table, timeout=0.1)
+                        return True
+                    except queue.Full:
+                        pass
+                return False
+
+            try:
+                for batch in self.iter_augmented_batches(
+                    N,
+                    deduplicate,
+                    seed,
+                    index_offset,
+                    batch_size=batch_size,
+                    deduplicator=deduplicator,
+                    exclude_gold=exclude_gold,
+                    exact=exact,
+                    max_length=max_length,
+                    length_tolerance=length_tolerance,
+                ):
+                    if not put(pa.Table.from_pydict(batch, schema=schema)):
+                        break
+            except BaseException:
+                # Stop the writer, without replacing this exception with one of the writer
+                put(None)
+                raise
+            put(None)
+            # Re-raises the exception of the writer, if any
+            return writer.result()
+
+    def augment_on_the_fly(self, probability: float = 1.0) -> Dataset:
+        """Return the dataset with a transform that swaps the entities anew whenever a row is accessed.
+
+        Unlike `augment`, nothing is written: every `__getitem__`, batch access or iteration, e.g. in every epoch,
+        returns a freshly augmented view of the gold rows, with columns other than the tokens and labels untouched.
+        The entity spans are added to the returned dataset as an in-memory `entities` column for the transform.
+
+        Args:
+            probability (float): The probability that an accessed row is augmented, rather than returned as is.
+                Defaults to 1.0.
+
+        Returns:
+            Dataset: The dataset with the transform set.
+        """
+        if self.streaming:
+            raise ValueError("On-the-fly augmentation requires a `datasets.Dataset`, use `augment` for streamed data.")
+        # TODO: Ensure that "entities" doesn't already exist in dataset
+        dataset = self.dataset.add_column("entities", self.entity_spans.to_arrow())
+        return dataset.with_transform(
+            partial(self.transform, probability=probability),
+            columns=["tokens", self.label_column, "entities"],
+            output_all_columns=True,
+        )
+
+    def transform(self, batch: Dict[str, List[Any]], probability: float = 1.0) -> Dict[str, List[Any]]:
+        """Transform for `Dataset.set_transform` that augments every row of the batch once with `probability`."""
+        output = {"tokens": [], self.label_column: []}
+        for tokens, labels, entities in zip(batch["tokens"], batch[self.label_column], batch["entities"]):
+            if random.random() < probability:
+                tokens, labels = self.swap_entities(tokens, labels, entities)
+            output["tokens"].append(tokens)
+            output[self.label_column].append(labels)
+        return output
+
+    def prepare_deduplicator(
+        self,
+        deduplicator: Optional[Deduplicator] = None,
+        exclude_gold: bool = False,
+        examples: Optional[Iterable] = None,
+        batch_size: int = 1000,
+    ) -> Optional[Deduplicator]:
+        """Create a `Deduplicator` if required, and mark the gold examples as seen for `exclude_gold`."""
+        if not exclude_gold:
+            return deduplicator
+        if deduplicator is None:
+            deduplicator = Deduplicator()
+        if examples is None:
+            examples = self.dataset
+        if isinstance(examples, Dataset):
+            for batch in examples.with_format(None).iter(batch_size):
+                deduplicator.add(batch["tokens"], batch[self.label_column])
+        else:
+            for batch_tokens, batch_labels in iter_batches(examples, self.label_column, batch_size):
+                deduplicator.add(batch_tokens, batch_labels)
+        return deduplicator
+
+    def save(self, path: Union[str, os.PathLike]) -> None:
+        """Save the state of the augmenter, i.e. the examples with their entities and the knowledge base, so `load`
+        restores it without extracting the entities again.
+
+        The examples are stored as Arrow shards, each with the entity spans of its rows alongside. Saving again to
+        the directory that the augmenter was last saved to or loaded from only writes the examples that were added
+        with `add_examples` since then, as a new shard, so e.g. daily refreshes take time in proportion to the number
+        of new examples rather than the size of the dataset. Only the knowledge base, which is far smaller than the
+        dataset, is rewritten in full.
+
+        Args:
+            path (Union[str, os.PathLike]): The directory to save the augmenter to.
+        """
+        if self.streaming:
+            raise ValueError("Saving requires a `datasets.Dataset`, as streamed datasets aren't stored.")
+        path = Path(path)
+        path.mkdir(parents=True, exist_ok=True)
+        state_path = path / AUGMENTER_STATE_FILE
+        state = None
+        if state_path.exists():
+            with open(state_path, encoding="utf-8") as f:
+                state = json.load(f)
+
+        if (
+            state is not None
+            and self.saved_state is not None
+            and self.saved_state[0] == path.resolve()
+            and self.saved_state[1] == state["num_examples"] <= len(self.dataset)
+        ):
+            shards = state["shards"]
+            start = state["num_examples"]
+        else:
+            # Replace the shards of whatever was saved here before
+            for shard in state["shards"] if state is not None else []:
+                (path / shard["examples"]).unlink(missing_ok=True)
+                shutil.rmtree(path / shard["entity_spans"], ignore_errors=True)
+            shards = []
+            start = 0
+        if len(self.dataset) > start or not shards:
+            shards.append({"examples": f"data-{len(shards):05d}.arrow", "entity_spans": f"entities-{len(shards):05d}"})
+            with stage("save.examples"):
+                new_examples = self.dataset.select(range(start, len(self.dataset))) if start else self.dataset
+                write_arrow_file(new_examples, path / shards[-1]["examples"])
+                save_directory(
+                    self.entity_spans.slice(start, len(self.dataset)).save, path / shards[-1]["entity_spans"]
+                )
+
+        if isinstance(self.knowledge_base, MemoryMappedKnowledgeBase):
+            # External knowledge bases are only referenced
+            knowledge_base = {
+                "path": str(self.knowledge_base.path.resolve()),
+                "label_map": None
+                if self.knowledge_base.label_map is None
+                else list(self.knowledge_base.label_map.items()),
+            }
+        else:
+            knowledge_base = None
+            with stage("save.knowledge_base"):
+                save_directory(self.knowledge_base.save, path / "knowledge_base")
+
+        state = {
+            "version": AUGMENTER_STATE_VERSION,
+            "labels": self.labels,
+            "label_column": self.label_column,
+            "is_docbin": self.is_docbin,
+            "num_examples": len(self.dataset),
+            "shards": shards,
+            "knowledge_base": knowledge_base,
+        }
+        # The state is written last, so an interrupted save leaves the previous state intact
+        with open(path / f"{AUGMENTER_STATE_FILE}.tmp", "w", encoding="utf-8") as f:
+            json.dump(state, f, indent=2)
+        os.replace(path / f"{AUGMENTER_STATE_FILE}.tmp", state_path)
+        self.saved_state = (path.resolve(), len(self.dataset))
+
+    @classmethod
+    def load(cls, path: Union[str, os.PathLike]) -> "EntitySwapAugmenter":
+        """Load an augmenter that was saved with `save`, e.g. to add the examples of the day with `add_examples`.
+
+        The examples are memory-mapped, so loading takes time in proportion to the size of the knowledge base, which
+        is loaded into memory, rather than the size of the dataset.
+
+        Args:
+            path (Union[str, os.PathLike]): The directory that the augmenter was saved to.
+
+        Returns:
+            EntitySwapAugmenter: The loaded augmenter.
+        """
+        path = Path(path)
+        with open(path / AUGMENTER_STATE_FILE, encoding="utf-8") as f:
+            state = json.load(f)
+        if state["version"] != AUGMENTER_STATE_VERSION:
+            raise ValueError(
+                f"The augmenter was saved with state version {state['version']!r}, but version"
+                f" {AUGMENTER_STATE_VERSION!r} is required. Please create and save the augmenter again."
+            )
+
+        augmenter = cls.__new__(cls)
+        augmenter.dataset_type = Dataset
+        augmenter.is_docbin = state["is_docbin"]
+        augmenter.streaming = False
+        augmenter.labels = state["labels"]
+        augmenter.label_column = state["label_column"]
+        augmenter.label_scheme, augmenter.entity_extractor = LabelScheme.from_labels(augmenter.labels)
+        augmenter.dataset = concatenate_datasets(
+            [Dataset.from_file(str(path / shard["examples"])) for shard in state["shards"]]
+        )
+        augmenter.entity_spans = EntitySpans.concatenate(
+            EntitySpans.load(path / shard["entity_spans"]) for shard in state["shards"]
+        )
+        if state["knowledge_base"] is None:
+            augmenter.knowledge_base = KnowledgeBase.load(path / "knowledge_base")
+        else:
+            label_map = state["knowledge_base"]["label_map"]
+            augmenter.knowledge_base = MemoryMappedKnowledgeBase(
+                state["knowledge_base"]["path"], None if label_map is None else dict(label_map)
+            )
+        augmenter.saved_state = (path.resolve(), len(augmenter.dataset))
+        augmenter.shared_knowledge_base = False
+        return augmenter
+
+    @property
+    def features(self) -> Features:
+        return Features(
+            {
+                "tokens": Sequence(feature=Value(dtype="string")),
+                self.label_column: Sequence(feature=ClassLabel(names=self.labels)),
+            }
+        )
+
+    def extract_entities(self, tokens: List[str], labels: List[int]) -> List[Entity]:
+        """Extract the entities of a single sentence and add them to the knowledge base, with
+        `extract_entities_batch`."""
+        return self.extract_entities_batch(to_arrow_batch([tokens], [labels], self.label_column))[0]
+
+    @profiled("extract_entities_batch")
+    def extract_entities_batch(
+        self, batch: pa.Table, update_knowledge_base: bool = True, knowledge_base: Optional[KnowledgeBase] = None
+    ) -> EntitySpans:
+        """Extract the entities of every row of an Arrow batch, and add them to the knowledge base.
+
+        The entity boundaries of all rows are found at once from the flattened label ids, after which only the
+        tokens of the entities themselves are converted to Python strings for the knowledge base.
 
+        Args:
+            batch (pa.Table): A batch of the dataset, with at least the `tokens` and label columns.
+            update_knowledge_base (bool): Whether to add the entities to the knowledge base. Defaults to True.
+            knowledge_base (Optional[KnowledgeBase]): The knowledge base to add the entities to. Defaults to None,
+                i.e. `self.knowledge_base`.
+
+        Returns:
+            EntitySpans: The entities of every row in the batch.
+        """
+        ner_tags, offsets = flatten_list_array(batch.column(self.label_column))
+        labels, starts, ends, entity_offsets = self.entity_extractor.extract_batch(ner_tags, offsets)
+        count("extract.rows", batch.num_rows)
+        count("extract.entities", len(labels))
+
+        if update_knowledge_base:
+            if knowledge_base is None:
+                knowledge_base = self.knowledge_base
+            # Gather the tokens of all entities with one `take` on the flattened tokens
+            tokens = batch.column("tokens").combine_chunks()
+            positions, length_offsets = entity_token_positions(
+                np.asarray(tokens.offsets, dtype=np.int64), starts, ends, entity_offsets
+            )
+            entity_tokens = tokens.values.take(pa.array(positions)).to_pylist()
+            for label, start, end in zip(labels.tolist(), length_offsets[:-1].tolist(), length_offsets[1:].tolist()):
+                knowledge_base.add(label, entity_tokens[start:end])
+
+        return EntitySpans(labels, starts, ends, entity_offsets)
+
+    def replace_entities_batch(
+        self, batch: pa.Table, indices: List[int], entity_spans: EntitySpans, **kwargs
+    ) -> Dict[str, List[Any]]:
+        """`replace_entities` for an Arrow batch of the dataset, with the entities of its rows from `entity_spans`."""
+        return self.replace_entities(
+            batch.column("tokens").to_pylist(),
+            batch.column(self.label_column).to_pylist(),
+            entity_spans.rows(indices),
+            indices=indices,
+            **kwargs,
+        )
+
+    @profiled("replace_entities")
     def replace_entities(
         self,
         batch_tokens: List[str],
         batch_labels: List[int],
-        batch_entities: List[Entity],
+        batch_entities: List[List[Entity]],
         N: int = 4,
         deduplicate: bool = True,
+        indices: Optional[List[int]] = None,
+        seed: Optional[int] = None,
+        index_offset: int = 0,
+        deduplicator: Optional[Deduplicator] = None,
+        exact: bool = False,
+        max_length: Optional[int] = None,
+        length_tolerance: Optional[int] = None,
+        subword_encoder: Optional[SubwordEncoder] = None,
     ):
         # TODO: Convert labels correctly for IOB, etc.
         batch = {
             "tokens": [],
             self.label_column: [],
         }
+        # The subword ids and labels of the augmented sentences, if any, which are spliced rather than tokenized
+        subwords = {"input_ids": [], "labels": []}
+        if subword_encoder is not None:
+            subword_encoder.add_words(chain.from_iterable(batch_tokens))
+        swapped = None
 
-        for tokens, labels, entities in zip(batch_tokens, batch_labels, batch_entities):
+        if indices is None:
+            indices = range(len(batch_tokens))
+        duplicates = 0
+        for tokens, labels, entities, index in zip(batch_tokens, batch_labels, batch_entities, indices):
+            rng = random if seed is None else random.Random((seed << 64) + index_offset + index)
+            budget = length_budget(len(tokens), max_length, length_tolerance)
+            slack = None if budget is None else budget - len(tokens)
+            if subword_encoder is not None:
+                # The gold sentence is encoded once, and its context is reused by all of its augmented sentences
+                context = subword_encoder.encode(tokens, labels)
+            if exact:
+                for entity_indices in self.sample_combinations(entities, N, rng, slack):
+                    if subword_encoder is not None:
+                        swapped = []
+                    tokens_copy, labels_copy = self.swap_entities(
+                        tokens, labels, entities, rng, entity_indices, swapped=swapped
+                    )
+                    batch["tokens"].append(tokens_copy)
+                    batch[self.label_column].append(labels_copy)
+                    if subword_encoder is not None:
+                        self.splice_subwords(subword_encoder, context, entities, swapped, subwords)
+                continue
             seen_texts = set()
             for _ in range(N):
-                tokens_copy = tokens[::]
-                labels_copy = labels[::]
-                """
-                Two variations exist here:
-                * Using the for-loop we can replace all entities, and
-                * using the random.choice we can replace a random one.
-                """
-                for label, start, end in entities[::-1]:
-                    # if entities:
-                    #     label, start, end = random.choice(entities)
-                    entity_tokens = random.choice(tuple(self.knowledge_base[label]))
-                    tokens_copy[start:end] = entity_tokens
-                    labels_copy[start:end] = self.entity_extractor.reduced_label_id_to_id(label, len(entity_tokens))
+                if subword_encoder is not None:
+                    swapped = []
+                tokens_copy, labels_copy = self.swap_entities(
+                    tokens, labels, entities, rng, max_length=budget, swapped=swapped
+                )
                 assert len(tokens_copy) == len(labels_copy)
                 tokens_copy_str = " ".join(tokens_copy)
                 if tokens_copy_str not in seen_texts:
                     batch["tokens"].append(tokens_copy)
                     batch[self.label_column].append(labels_copy)
+                    if subword_encoder is not None:
+                        self.splice_subwords(subword_encoder, context, entities, swapped, subwords)
                     if deduplicate:
                         seen_texts.add(tokens_copy_str)
-        return batch
+                else:
+                    duplicates += 1
+        count("replace_entities.rows", len(batch_tokens))
+        count("replace_entities.candidates", len(batch["tokens"]) + duplicates)
+        count("replace_entities.duplicates", duplicates)
+
+        if deduplicator is not None:
+            with stage("deduplicator.filter"):
+                keep = deduplicator.filter(batch["tokens"], batch[self.label_column]).tolist()
+            count("deduplicator.examples", len(keep))
+            count("deduplicator.duplicates", len(keep) - sum(keep))
+            batch = {column: list(compress(values, keep)) for column, values in batch.items()}
+            subwords = {column: list(compress(values, keep)) for column, values in subwords.items()}
+        count("replace_entities.outputs", len(batch["tokens"]))
+        return batch if subword_encoder is None else subwords
+
+    def splice_subwords(
+        self,
+        subword_encoder: SubwordEncoder,
+        context: Tuple[List[int], List[int], List[int]],
+        entities: List[Entity],
+        swapped: List[Tuple[int, List[str]]],
+        subwords: Dict[str, List[List[int]]],
+    ) -> None:
+        """Splice the subword ids and labels of an augmented sentence from those of the context in its gold sentence
+        and of the swapped in entities, and append them to `subwords`.
+
+        Args:
+            subword_encoder (SubwordEncoder): The encoder with the subword ids of all words.
+            context (Tuple[List[int], List[int], List[int]]): The gold sentence, encoded with `SubwordEncoder.encode`.
+            entities (List[Entity]): The entities in the gold sentence.
+            swapped (List[Tuple[int, List[str]]]): The swapped entities, from `swap_entities`.
+            subwords (Dict[str, List[List[int]]]): The `input_ids` and `labels` to append to.
+        """
+        context_ids, context_labels, offsets = context
+        input_ids = []
+        labels = []
+        prev_end = 0
+        for entity_index, entity_tokens in swapped:
+            label, start, end = entities[entity_index]
+            input_ids += context_ids[offsets[prev_end] : offsets[start]]
+            labels += context_labels[offsets[prev_end] : offsets[start]]
+            entity_ids, entity_labels, _ = subword_encoder.encode(
+                entity_tokens, self.entity_extractor.reduced_label_id_to_id(label, len(entity_tokens))
+            )
+            input_ids += entity_ids
+            labels += entity_labels
+            prev_end = end
+        input_ids += context_ids[offsets[prev_end] :]
+        labels += context_labels[offsets[prev_end] :]
+        input_ids, labels = subword_encoder.finalize(input_ids, labels)
+        subwords["input_ids"].append(input_ids)
+        subwords["labels"].append(labels)
+
+    def sample_combinations(
+        self, entities: List[Entity], N: int, rng: random.Random = random, slack: Optional[int] = None
+    ) -> List[List[Optional[int]]]:
+        """Draw `N` distinct combinations of knowledge base entities for the entities of a sentence.
+
+        Every combination is a number in a mixed radix system with the knowledge base size of every entity label as
+        digits, so distinct numbers, drawn without replacement, unrank to distinct combinations. If at most `N`
+        combinations exist, all of them are returned in order.
+
+        Args:
+            entities (List[Entity]): The entities in the sentence.
+            N (int): The number of combinations to draw.
+            rng (random.Random): The source of randomness, defaults to the global `random` module.
+            slack (Optional[int]): If set, the number of tokens by which the augmented sentence may grow, which is
+                split evenly over the entities, so only entities that fit their share are considered.
+
+        Returns:
+            List[List[Optional[int]]]: The index into the knowledge base of every entity, for every combination.
+            Entities that are kept as is, e.g. as their label is missing from the knowledge base, have index None.
+        """
+        swappable = [label in self.knowledge_base for label, _, _ in entities]
+        sizes = []
+        for (label, start, end), is_swappable in zip(entities, swappable):
+            if is_swappable:
+                max_entity_length = None if slack is None else end - start + slack // sum(swappable)
+                sizes.append(self.knowledge_base.num_entities(label, max_entity_length))
+            else:
+                sizes.append(0)
+        num_combinations = math.prod(max(size, 1) for size in sizes)
+        if num_combinations <= N:
+            ranks = range(num_combinations)
+        elif num_combinations <= sys.maxsize:
+            ranks = rng.sample(range(num_combinations), N)
+        else:
+            # `range` objects this large have no length, but collisions are all but impossible here
+            ranks = set()
+            while len(ranks) < N:
+                ranks.add(rng.randrange(num_combinations))
+            ranks = sorted(ranks)
+
+        combinations = []
+        for rank in ranks:
+            combination = []
+            for size in sizes:
+                if size == 0:
+                    combination.append(None)
+                    continue
+                rank, index = divmod(rank, size)
+                combination.append(index)
+            combinations.append(combination)
+        return combinations
+
+    def swap_entities(
+        self,
+        tokens: List[str],
+        labels: List[int],
+        entities: List[Entity],
+        rng: random.Random = random,
+        entity_indices: Optional[List[Optional[int]]] = None,
+        max_length: Optional[int] = None,
+        swapped: Optional[List[Tuple[int, List[str]]]] = None,
+    ) -> Tuple[List[str], List[int]]:
+        """Replace every entity with one of the same label sampled from the knowledge base.
+
+        The output is assembled in a single left-to-right pass from the unchanged context between the
+        entities and the sampled entities, so neither the tokens nor the labels are copied up front.
+
+        Args:
+            tokens (List[str]): The tokens of the sentence.
+            labels (List[int]): The label ids of the sentence.
+            entities (List[Entity]): The entities in the sentence, ordered by their start index.
+            rng (random.Random): The source of randomness, defaults to the global `random` module.
+            entity_indices (Optional[List[Optional[int]]]): The index into the knowledge base of the entity to swap
+                in for every entity, or None to keep it, e.g. from `sample_combinations`. Defaults to None, i.e.
+                sample them with `rng`.
+            max_length (Optional[int]): If set, entities are sampled from left to right among those that keep the
+                augmented sentence within this many tokens, and kept as is if none fit. Defaults to None.
+            swapped (Optional[List[Tuple[int, List[str]]]]): If set, the index of every swapped entity and the tokens
+                that are swapped in for it are appended to this list, e.g. to splice subword ids. Defaults to None.
+
+        Returns:
+            Tuple[List[str], List[int]]: The tokens and label ids of the augmented sentence.
+        """
+        new_tokens = []
+        new_labels = []
+        prev_end = 0
+        slack = None if max_length is None else max_length - len(tokens)
+        """
+        Two variations exist here:
+        * Using the for-loop we can replace all entities, and
+        * using the random.choice we can replace a random one.
+        """
+        for entity_index, (label, start, end) in enumerate(entities):
+            # if entities:
+            #     label, start, end = random.choice(entities)
+            if label not in self.knowledge_base:
+                # e.g. a label that is missing from an external knowledge base, keep the entity as is
+                continue
+            if entity_indices is not None:
+                if entity_indices[entity_index] is None:
+                    continue
+                entity_tokens = self.knowledge_base.get(label, entity_indices[entity_index])
+            elif slack is not None:
+                # The entities that fit the remaining budget are a prefix of the length-sorted knowledge base
+                num_candidates = self.knowledge_base.num_entities(label, end - start + slack)
+                if num_candidates == 0:
+                    continue
+                entity_tokens = self.knowledge_base.get(label, rng.randrange(num_candidates))
+                slack -= len(entity_tokens) - (end - start)
+            else:
+                entity_tokens = self.knowledge_base.sample(label, rng)
+            new_tokens += tokens[prev_end:start]
+            new_tokens += entity_tokens
+            new_labels += labels[prev_end:start]
+            new_labels += self.entity_extractor.reduced_label_id_to_id(label, len(entity_tokens))
+            if swapped is not None:
+                swapped.append((entity_index, entity_tokens))
+            prev_end = end
+        new_tokens += tokens[prev_end:]
+        new_labels += labels[prev_end:]
+        return new_tokens, new_labels
+
+
+class KnowledgeBaseSwapAugmenter(EntitySwapAugmenter):
+    """Augmenter that swaps entities with entities of the same label from an external knowledge base, e.g. a large
+    gazetteer built with `build_gazetteer_knowledge_base`, rather than with the entities in the dataset itself.
+
+    The knowledge base is memory-mapped and keyed by label names, i.e. `"PER"` rather than `"B-PER"` for schemed
+    labels. Entities with labels that are missing from the knowledge base are kept as is.
+    """
+
+    def __init__(
+        self,
+        dataset: Union[Dataset, "DocBin", IterableDataset, Iterable],
+        knowledge_base: Union[str, os.PathLike, MemoryMappedKnowledgeBase],
+        labels: Optional[List[str]] = None,
+        label_column: str = "ner_tags",
+        num_proc: Optional[int] = None,
+        load_from_cache_file: Optional[bool] = None,
+    ) -> None:
+        if not isinstance(knowledge_base, MemoryMappedKnowledgeBase):
+            knowledge_base = MemoryMappedKnowledgeBase(knowledge_base)
+        super().__init__(
+            dataset,
+            labels=labels,
+            label_column=label_column,
+            num_proc=num_proc,
+            knowledge_base=knowledge_base,
+            load_from_cache_file=load_from_cache_file,
+        )
+        # The entities are labeled with reduced label ids, e.g. the id of "PER", so map these to the label names
+        self.knowledge_base = knowledge_base.relabel(dict(enumerate(self.entity_extractor.reduced_labels)))
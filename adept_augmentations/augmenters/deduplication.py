@@ -0,0 +1,92 @@
+import math
+from typing import List, Optional
+
+import numpy as np
+
+from adept_augmentations.augmenters.hashing import hash_examples, splitmix64
+
+
+class BloomFilter:
+    """Fixed-size set of 64-bit hashes, with a bounded false positive rate and no false negatives.
+
+    Args:
+        capacity (int): The expected number of hashes that will be added.
+        error_rate (float): The false positive rate once `capacity` hashes have been added.
+    """
+
+    def __init__(self, capacity: int, error_rate: float = 1e-6) -> None:
+        capacity = max(1, capacity)
+        self.num_bits = max(64, math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.num_hashes = max(1, round(self.num_bits / capacity * math.log(2)))
+        self.bits = np.zeros(math.ceil(self.num_bits / 8), dtype=np.uint8)
+
+    def bit_indices(self, hashes: np.ndarray) -> np.ndarray:
+        # Double hashing, i.e. the i-th bit of a hash `h` is `h + i * splitmix64(h)`
+        first = np.asarray(hashes, dtype=np.uint64)
+        second = splitmix64(first) | np.uint64(1)
+        steps = np.arange(self.num_hashes, dtype=np.uint64)
+        return (first[:, None] + steps[None, :] * second[:, None]) % np.uint64(self.num_bits)
+
+    def contains(self, hashes: np.ndarray) -> np.ndarray:
+        indices = self.bit_indices(hashes)
+        masks = np.left_shift(1, indices & np.uint64(7)).astype(np.uint8)
+        return np.all(self.bits[indices >> np.uint64(3)] & masks, axis=1)
+
+    def add(self, hashes: np.ndarray) -> None:
+        indices = self.bit_indices(hashes).ravel()
+        masks = np.left_shift(1, indices & np.uint64(7)).astype(np.uint8)
+        np.bitwise_or.at(self.bits, indices >> np.uint64(3), masks)
+
+
+class HashSet:
+    """Exact set of 64-bit hashes, i.e. 8 bytes of payload per example instead of its tokens."""
+
+    def __init__(self) -> None:
+        self.hashes = set()
+
+    def contains(self, hashes: np.ndarray) -> np.ndarray:
+        return np.fromiter((value in self.hashes for value in hashes.tolist()), dtype=bool, count=len(hashes))
+
+    def add(self, hashes: np.ndarray) -> None:
+        self.hashes.update(hashes.tolist())
+
+
+class Deduplicator:
+    """Drops examples that were seen before, across every batch of an augmentation run.
+
+    Examples are compared by a 64-bit hash of their tokens and label ids, so memory usage does not grow with
+    the length of the examples. When `capacity` is given, the hashes are stored in a Bloom filter of fixed
+    size instead, which may drop a small fraction (`error_rate`) of unique examples as well.
+
+    Args:
+        capacity (Optional[int], optional): The expected number of unique examples, to use a Bloom filter.
+            Defaults to None, i.e. store the exact hashes.
+        error_rate (float, optional): The false positive rate of the Bloom filter. Defaults to 1e-6.
+    """
+
+    def __init__(self, capacity: Optional[int] = None, error_rate: float = 1e-6) -> None:
+        self.seen = HashSet() if capacity is None else BloomFilter(capacity, error_rate)
+
+    def add(self, batch_tokens: List[List[str]], batch_labels: List[List[int]]) -> None:
+        """Mark examples as seen, e.g. the gold examples, without filtering them."""
+        if batch_tokens:
+            self.seen.add(hash_examples(batch_tokens, batch_labels))
+
+    def filter(self, batch_tokens: List[List[str]], batch_labels: List[List[int]]) -> np.ndarray:
+        """Compute which examples are new, i.e. neither seen before nor earlier in this batch, and mark them seen.
+
+        Args:
+            batch_tokens (List[List[str]]): The tokens of every example.
+            batch_labels (List[List[int]]): The label ids of every example.
+
+        Returns:
+            np.ndarray: A boolean mask of the examples to keep.
+        """
+        if not batch_tokens:
+            return np.zeros(0, dtype=bool)
+        hashes = hash_examples(batch_tokens, batch_labels)
+        keep = np.zeros(len(hashes), dtype=bool)
+        keep[np.unique(hashes, return_index=True)[1]] = True
+        keep &= ~self.seen.contains(hashes)
+        self.seen.add(hashes[keep])
+        return keep
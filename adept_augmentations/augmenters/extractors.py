@@ -1,10 +1,56 @@
 from abc import ABC, abstractmethod
 from collections import defaultdict
-from typing import Any, Dict, Iterator, List, Set, Tuple
+from enum import Enum, auto
+from functools import cached_property
+from typing import Any, Dict, Iterator, List, Set, Tuple, Union
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
 
 from adept_augmentations.augmenters.constants import Entity
 
 
+def flatten_list_array(array: Union[pa.ListArray, pa.ChunkedArray]) -> Tuple[np.ndarray, np.ndarray]:
+    """Convert an Arrow array of lists into its flat values and zero-based row offsets.
+
+    Args:
+        array (Union[pa.ListArray, pa.ChunkedArray]): e.g. the `ner_tags` column of an Arrow batch.
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray]: The flat values, and the `num_rows + 1` offsets such that row `i`
+        consists of `values[offsets[i] : offsets[i + 1]]`.
+    """
+    if isinstance(array, pa.ChunkedArray):
+        array = array.combine_chunks() if array.num_chunks else pa.array([], type=array.type)
+    offsets = np.asarray(array.offsets, dtype=np.int64)
+    values = pc.list_flatten(array).to_numpy(zero_copy_only=False)
+    return values, offsets - offsets[0]
+
+
+def entity_token_positions(
+    token_offsets: np.ndarray, starts: np.ndarray, ends: np.ndarray, entity_offsets: np.ndarray
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Locate the tokens of all entities of a batch in its flattened tokens, e.g. to gather them with one `take`.
+
+    Args:
+        token_offsets (np.ndarray): The `num_rows + 1` offsets of the rows into the flattened tokens.
+        starts (np.ndarray): The start index of every entity, relative to the start of its row.
+        ends (np.ndarray): The end index of every entity, relative to the start of its row.
+        entity_offsets (np.ndarray): The `num_rows + 1` offsets of the rows into the entities.
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray]: The positions of the tokens of all entities in the flattened tokens,
+        concatenated, and the `num_entities + 1` offsets of the entities into these positions.
+    """
+    rows = np.repeat(np.arange(len(entity_offsets) - 1), np.diff(entity_offsets))
+    lengths = (ends - starts).astype(np.int64)
+    length_offsets = np.zeros(len(lengths) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=length_offsets[1:])
+    positions = np.arange(length_offsets[-1]) + np.repeat(token_offsets[rows] + starts - length_offsets[:-1], lengths)
+    return positions, length_offsets
+
+
 class EntityExtractor(ABC):
     """Class to convert NER training data into a common format used in the SpanMarkerModel.
 
@@ -29,6 +75,38 @@ class EntityExtractor(ABC):
     def reduced_label_id_to_id(self, reduced_id: int, length: int) -> List[int]:
         pass
 
+    @abstractmethod
+    def extract_batch(
+        self, ner_tags: np.ndarray, offsets: np.ndarray
+    ) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+        """Vectorized equivalent of `__call__` over a whole batch of flattened label ids.
+
+        Args:
+            ner_tags (np.ndarray): The label ids of all rows in the batch, concatenated.
+            offsets (np.ndarray): The `num_rows + 1` offsets of the rows into `ner_tags`.
+
+        Returns:
+            Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]: The `int32` reduced label ids, start
+            indices and end indices of all entities, with the indices relative to the start of their row,
+            and the `num_rows + 1` offsets of the rows into these entity arrays.
+        """
+        pass
+
+    @staticmethod
+    def group_entities(
+        labels: np.ndarray, begins: np.ndarray, ends: np.ndarray, offsets: np.ndarray
+    ) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+        # Map the absolute entity positions back onto their rows
+        rows = np.searchsorted(offsets, begins, side="right") - 1
+        entity_offsets = np.zeros(len(offsets), dtype=np.int64)
+        np.cumsum(np.bincount(rows, minlength=len(offsets) - 1), out=entity_offsets[1:])
+        return (
+            labels.astype(np.int32),
+            (begins - offsets[rows]).astype(np.int32),
+            (ends - offsets[rows]).astype(np.int32),
+            entity_offsets,
+        )
+
 
 class EntityExtractorScheme(EntityExtractor):
     def __init__(self, labels: List[str]) -> None:
@@ -42,6 +120,33 @@ class EntityExtractorScheme(EntityExtractor):
             _id: self.reduced_labels.index(label[2:] if label != "O" else label)
             for _id, label in enumerate(self.labels)
         }
+        self.id2reduced_id_array = np.array([self.id2reduced_id[_id] for _id in range(len(self.labels))])
+
+    @cached_property
+    def start_mask(self) -> np.ndarray:
+        mask = np.zeros(len(self.labels), dtype=bool)
+        mask[list(self.start_ids)] = True
+        return mask
+
+    @cached_property
+    def end_mask(self) -> np.ndarray:
+        mask = np.zeros(len(self.labels), dtype=bool)
+        mask[list(self.end_ids)] = True
+        return mask
+
+    @cached_property
+    def tag_table(self) -> np.ndarray:
+        """Label ids of the tags that make up the entities of every reduced label.
+
+        Row `reduced_id` holds the ids of the `[begin, inside, last, unit]` tags of that reduced label, e.g. of
+        `B-ORG`, `I-ORG`, `E-ORG` and `S-ORG` for BIOES, with -1 for tags that are missing from the labels.
+        """
+        label2id = {label: _id for _id, label in enumerate(self.labels)}
+        table = np.full((len(self.reduced_labels), 4), -1, dtype=np.int64)
+        for reduced_id, label in enumerate(self.reduced_labels[1:], start=1):
+            for column, tag in enumerate(self.tags):
+                table[reduced_id, column] = label2id.get(f"{tag}-{label}", -1)
+        return table
 
     def __call__(self, ner_tags: List[int]) -> Iterator[Entity]:
         """Assumes a correct IOB or IOB2 annotation scheme"""
@@ -60,68 +165,81 @@ class EntityExtractorScheme(EntityExtractor):
                 start_idx = idx
 
         if start_idx is not None:
-            yield (reduced_label_id, start_idx, idx)
+            yield (reduced_label_id, start_idx, len(ner_tags))
+
+    def reduced_label_id_to_id(self, reduced_id: int, length: int) -> List[int]:
+        # e.g. [3, 4, 5] for ["B-ORG", "I-ORG", "E-ORG"], or [3, 4, 4] for ["B-ORG", "I-ORG", "I-ORG"] with IOB2
+        begin, inside, last, unit = self.tag_table[reduced_id].tolist()
+        if length == 1:
+            label_ids = [unit]
+        else:
+            label_ids = [begin] + [inside] * (length - 2) + [last]
+        if -1 in label_ids:
+            raise ValueError(
+                f"The labels lack a tag for an entity of label {self.reduced_labels[reduced_id]!r} with length"
+                f" {length}."
+            )
+        return label_ids
+
+    def extract_batch(
+        self, ner_tags: np.ndarray, offsets: np.ndarray
+    ) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+        nonempty = offsets[1:] > offsets[:-1]
+        row_starts = offsets[:-1][nonempty]
+        row_ends = offsets[1:][nonempty]
+
+        is_start = self.start_mask[ner_tags]
+        is_end = self.end_mask[ner_tags]
+        # Every start or end tag determines whether we're inside an entity after that token, while the
+        # remaining tags (e.g. `I-ORG` in BIOES) keep that state. Forward fill the position of the last
+        # deciding tag within every row, where the first token of a row always decides.
+        deciding = is_start | is_end
+        deciding[row_starts] = True
+        positions = np.where(deciding, np.arange(len(ner_tags)), 0)
+        np.maximum.accumulate(positions, out=positions)
+        inside = is_start[positions]
+        inside_before = np.roll(inside, 1)
+        inside_before[row_starts] = False
+
+        begins = np.flatnonzero(is_start & (is_end | ~inside_before))
+        ends = np.sort(np.concatenate([np.flatnonzero(inside_before & is_end), row_ends[inside[row_ends - 1]]]))
+        return self.group_entities(self.id2reduced_id_array[ner_tags[begins]], begins, ends, offsets)
 
 
 class EntityExtractorIOB(EntityExtractorScheme):
+    tags = "BIIB"
+
     def __init__(self, labels: List[str]) -> None:
         super().__init__(labels)
         # Support for IOB2 and IOB, respectively:
         self.start_ids = self.label_ids_by_tag["B"] | self.label_ids_by_tag["I"]
         self.end_ids = self.label_ids_by_tag["B"] | self.label_ids_by_tag["O"]
 
-    def reduced_label_id_to_id(self, reduced_id: int, length: int) -> List[int]:
-        # e.g. "ORG"
-        label = self.reduced_labels[reduced_id]
-        # e.g. ["B-ORG", "I-ORG", "I-ORG"]
-        labels = [f"B-{label}"] + [f"I-{label}"] * (length - 1)
-        # e.g. [3, 4, 4]
-        label_ids = [self.labels.index(label_string) for label_string in labels]
-        return label_ids
-
 
 class EntityExtractorBIOES(EntityExtractorScheme):
+    tags = "BIES"
+
     def __init__(self, labels: List[str]) -> None:
         super().__init__(labels)
         self.start_ids = self.label_ids_by_tag["B"] | self.label_ids_by_tag["S"]
         self.end_ids = self.label_ids_by_tag["B"] | self.label_ids_by_tag["O"] | self.label_ids_by_tag["S"]
 
-    def reduced_label_id_to_id(self, reduced_id: int, length: int) -> List[int]:
-        # e.g. "ORG"
-        label = self.reduced_labels[reduced_id]
-        if length == 1:
-            labels = [f"S-{label}"]
-        else:
-            # e.g. ["B-ORG", "I-ORG", "E-ORG"]
-            labels = [f"B-{label}"] + [f"I-{label}"] * (length - 2) + [f"E-{label}"]
-        # e.g. [3, 4, 5]
-        label_ids = [self.labels.index(label_string) for label_string in labels]
-        return label_ids
-
 
 class EntityExtractorBILOU(EntityExtractorScheme):
+    tags = "BILU"
+
     def __init__(self, labels: List[str]) -> None:
         super().__init__(labels)
         self.start_ids = self.label_ids_by_tag["B"] | self.label_ids_by_tag["U"]
         self.end_ids = self.label_ids_by_tag["B"] | self.label_ids_by_tag["O"] | self.label_ids_by_tag["U"]
 
-    def reduced_label_id_to_id(self, reduced_id: int, length: int) -> List[int]:
-        # e.g. "ORG"
-        label = self.reduced_labels[reduced_id]
-        if length == 1:
-            labels = [f"U-{label}"]
-        else:
-            # e.g. ["B-ORG", "I-ORG", "L-ORG"]
-            labels = [f"B-{label}"] + [f"I-{label}"] * (length - 2) + [f"L-{label}"]
-        # e.g. [3, 4, 5]
-        label_ids = [self.labels.index(label_string) for label_string in labels]
-        return label_ids
-
 
 class EntityExtractorNoScheme(EntityExtractor):
     def __init__(self, labels: List[str]) -> None:
         super().__init__(labels)
         self.outside_id = labels.index("O")
+        # Without a scheme, the reduced label ids are simply the label ids
+        self.reduced_labels = labels
 
     def __call__(self, ner_tags: List[int]) -> Iterator[Entity]:
         start_idx = None
@@ -138,7 +256,69 @@ class EntityExtractorNoScheme(EntityExtractor):
                 start_idx = idx
 
         if start_idx is not None:
-            yield (entity_label_id, start_idx, idx)
+            yield (entity_label_id, start_idx, len(ner_tags))
 
     def reduced_label_id_to_id(self, reduced_id: int, length: int) -> List[int]:
         return [reduced_id] * length
+
+    def extract_batch(
+        self, ner_tags: np.ndarray, offsets: np.ndarray
+    ) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+        is_entity = ner_tags != self.outside_id
+        # An entity starts wherever the label changes to a non-outside label, and ends wherever it changes after
+        changed_before = np.ones(len(ner_tags), dtype=bool)
+        changed_before[1:] = ner_tags[1:] != ner_tags[:-1]
+        changed_after = np.roll(changed_before, -1)
+        changed_before[offsets[:-1][offsets[:-1] < len(ner_tags)]] = True
+        changed_after[offsets[1:][offsets[1:] > 0] - 1] = True
+
+        begins = np.flatnonzero(is_entity & changed_before)
+        ends = np.flatnonzero(is_entity & changed_after) + 1
+        return self.group_entities(ner_tags[begins], begins, ends, offsets)
+
+
+class LabelScheme(Enum):
+    NONE = auto()
+    IOB2 = auto()  # Works for IOB, too
+    BIOES = auto()
+    BILOU = auto()
+
+    @staticmethod
+    def are_labels_schemed(labels) -> bool:
+        """True if all labels are strings matching one of the two following rules:
+
+        * `label == "O"`
+        * `label[0] in "BIESLU"` and `label[1] == "-"`, e.g. in `"I-LOC"`
+
+        We ensure that the first index is in `"BIELSU"` because of these definitions:
+        * `"B"` for `"begin"`
+        * `"I"` for `"in"`
+        * `"E"` for `"end"`
+        * `"L"` for `"last"`
+        * `"S"` for `"singular"`
+        * `"U"` for `"unit"`
+
+        Args:
+            id2label (Dict[int, str]): Dictionary of label ids to label strings.
+
+        Returns:
+            bool: True if it seems like a labeling scheme is used.
+        """
+        return all(label == "O" or (len(label) > 2 and label[0] in "BIELSU" and label[1] == "-") for label in labels)
+
+    def get_scheme_tags(labels) -> Set[str]:
+        return set(label[0] for label in labels)
+
+    @classmethod
+    def from_labels(cls, labels: List[str]):
+        if not cls.are_labels_schemed(labels):
+            return cls.NONE, EntityExtractorNoScheme(labels)
+
+        tags = cls.get_scheme_tags(labels)
+        if tags == set("IOB"):
+            return cls.IOB2, EntityExtractorIOB(labels)
+        if tags == set("BIOES"):
+            return cls.BIOES, EntityExtractorBIOES(labels)
+        if tags == set("BILOU"):
+            return cls.BILOU, EntityExtractorBILOU(labels)
+        raise NotImplementedError(f"The detected labeling scheme with tags {tags!r} has not been implemented.")
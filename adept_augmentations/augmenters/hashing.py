@@ -0,0 +1,85 @@
+from hashlib import blake2b
+from itertools import chain
+from typing import Dict, Iterable, List
+
+import numpy as np
+
+
+def splitmix64(values: np.ndarray) -> np.ndarray:
+    """Vectorized SplitMix64 finalizer, which maps `uint64` values to well-mixed 64-bit hashes.
+
+    Args:
+        values (np.ndarray): The values to hash, converted to `uint64`.
+
+    Returns:
+        np.ndarray: The `uint64` hashes, with the same shape as `values`.
+    """
+    values = np.asarray(values).astype(np.uint64) + np.uint64(0x9E3779B97F4A7C15)
+    values = (values ^ (values >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+    values = (values ^ (values >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+    return values ^ (values >> np.uint64(31))
+
+
+def hash_sequences(values: np.ndarray, offsets: np.ndarray) -> np.ndarray:
+    """Hash every sequence `values[offsets[i] : offsets[i + 1]]` to a 64-bit hash, in one vectorized pass.
+
+    Every value is hashed together with its position in the sequence, after which the hashes of a sequence
+    are summed, so two sequences only share a hash if they are equal, up to a negligible collision rate.
+
+    Args:
+        values (np.ndarray): The integer values of all sequences, concatenated.
+        offsets (np.ndarray): The `num_sequences + 1` offsets of the sequences into `values`.
+
+    Returns:
+        np.ndarray: The `uint64` hash of every sequence.
+    """
+    lengths = np.diff(offsets)
+    positions = np.arange(len(values), dtype=np.uint64) - np.repeat(offsets[:-1], lengths).astype(np.uint64)
+    mixed = splitmix64(splitmix64(values) ^ positions)
+    # `np.add.reduceat` requires valid indices and returns the element itself for empty sequences
+    hashes = np.zeros(len(lengths), dtype=np.uint64)
+    nonempty = lengths > 0
+    if len(values):
+        hashes[nonempty] = np.add.reduceat(mixed, offsets[:-1][nonempty])
+    return splitmix64(hashes ^ lengths.astype(np.uint64))
+
+
+def hash_strings(data: np.ndarray, offsets: np.ndarray) -> np.ndarray:
+    """Hash every string of an Arrow string array from its buffers, without converting them to Python strings.
+
+    Args:
+        data (np.ndarray): The UTF-8 bytes of all strings, concatenated.
+        offsets (np.ndarray): The `num_strings + 1` offsets of the strings into `data`.
+
+    Returns:
+        np.ndarray: The `uint64` hash of every string, which only differs from `hash_tokens` in value.
+    """
+    offsets = np.asarray(offsets, dtype=np.int64)
+    return hash_sequences(np.asarray(data[offsets[0] : offsets[-1]], dtype=np.uint8), offsets - offsets[0])
+
+
+def hash_tokens(tokens: Iterable[str]) -> Dict[str, int]:
+    """Map every unique token to a 64-bit hash that, unlike `hash`, is stable across processes and runs."""
+    return {
+        token: int.from_bytes(blake2b(token.encode("utf-8"), digest_size=8).digest(), "little")
+        for token in set(tokens)
+    }
+
+
+def hash_examples(batch_tokens: List[List[str]], batch_labels: List[List[int]]) -> np.ndarray:
+    """Hash every example, i.e. its tokens together with its label ids, to a 64-bit hash.
+
+    Args:
+        batch_tokens (List[List[str]]): The tokens of every example.
+        batch_labels (List[List[int]]): The label ids of every example.
+
+    Returns:
+        np.ndarray: The `uint64` hash of every example.
+    """
+    flat_tokens = list(chain.from_iterable(batch_tokens))
+    token_hashes = hash_tokens(flat_tokens)
+    values = np.fromiter((token_hashes[token] for token in flat_tokens), dtype=np.uint64, count=len(flat_tokens))
+    labels = np.fromiter(chain.from_iterable(batch_labels), dtype=np.int64, count=len(flat_tokens))
+    offsets = np.zeros(len(batch_tokens) + 1, dtype=np.int64)
+    np.cumsum([len(tokens) for tokens in batch_tokens], out=offsets[1:])
+    return hash_sequences(values ^ splitmix64(labels), offsets)
@@ -0,0 +1,568 @@
+import json
+import os
+import random
+from array import array
+from collections import defaultdict
+from itertools import chain
+from pathlib import Path
+from typing import (
+    Callable,
+    Dict,
+    Hashable,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Sequence,
+    Tuple,
+    Union,
+)
+
+import numpy as np
+
+from adept_augmentations.augmenters.hashing import hash_sequences, splitmix64
+
+
+def save_knowledge_base_arrays(
+    path: Union[str, os.PathLike],
+    vocab: Sequence[str],
+    labels: Sequence[Hashable],
+    label_offsets: np.ndarray,
+    entity_offsets: np.ndarray,
+    token_ids: np.ndarray,
+) -> None:
+    """Save a knowledge base as a directory of `.npy` files that can be memory-mapped.
+
+    Besides the UTF-8 encoded vocabulary, the directory holds the token ids of all entities of all labels in one
+    `token_ids` array, with `entity_offsets` marking where every entity starts in `token_ids`, and with
+    `label_offsets` marking where the entities of every label in `labels.json` start in `entity_offsets`. The
+    entities of every label must be sorted by their number of tokens.
+
+    Args:
+        path (Union[str, os.PathLike]): The directory to save the knowledge base to.
+        vocab (Sequence[str]): The tokens, indexed by token id.
+        labels (Sequence[Hashable]): The labels, e.g. reduced label ids or label names, which must be JSON
+            serializable.
+        label_offsets (np.ndarray): The `len(labels) + 1` offsets of the labels into `entity_offsets`.
+        entity_offsets (np.ndarray): The `num_entities + 1` offsets of the entities into `token_ids`.
+        token_ids (np.ndarray): The token ids of all entities, concatenated.
+    """
+    path = Path(path)
+    path.mkdir(parents=True, exist_ok=True)
+    vocab = [token.encode("utf-8") for token in vocab]
+    vocab_offsets = np.zeros(len(vocab) + 1, dtype=np.int64)
+    np.cumsum([len(token) for token in vocab], out=vocab_offsets[1:])
+    np.save(path / "vocab_data.npy", np.frombuffer(b"".join(vocab), dtype=np.uint8))
+    np.save(path / "vocab_offsets.npy", vocab_offsets)
+    with open(path / "labels.json", "w", encoding="utf-8") as f:
+        json.dump(list(labels), f)
+    np.save(path / "label_offsets.npy", np.asarray(label_offsets, dtype=np.int64))
+    np.save(path / "entity_offsets.npy", np.asarray(entity_offsets, dtype=np.int64))
+    np.save(path / "token_ids.npy", np.asarray(token_ids, dtype=np.int32))
+
+
+def count_lengths(lengths: np.ndarray) -> np.ndarray:
+    """Index the sorted entity `lengths` of a label, such that `counts[n]` is the number of entities of at most `n`
+    tokens.
+    """
+    lengths = np.asarray(lengths, dtype=np.int64)
+    if np.any(lengths[1:] < lengths[:-1]):
+        raise ValueError(
+            "The entities are not sorted by length, e.g. as the knowledge base was saved by an older version."
+        )
+    return np.searchsorted(lengths, np.arange(lengths[-1] + 1 if len(lengths) else 1), side="right")
+
+
+def entities_to_arrays(entities: Sequence[Tuple[int, ...]]) -> Tuple[np.ndarray, np.ndarray]:
+    """Concatenate the token ids of `entities`, and return them with the `len(entities) + 1` offsets of the
+    entities into them."""
+    lengths = np.fromiter(map(len, entities), dtype=np.int64, count=len(entities))
+    offsets = np.zeros(len(entities) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=offsets[1:])
+    return np.fromiter(chain.from_iterable(entities), dtype=np.int32, count=offsets[-1]), offsets
+
+
+def lookup_length_count(counts: np.ndarray, max_length: int) -> int:
+    if max_length < 0:
+        return 0
+    return int(counts[min(max_length, len(counts) - 1)])
+
+
+class KnowledgeBase:
+    """Compact store of the unique entities per (reduced) label id.
+
+    Tokens are interned to integer ids, and the entities of each label are stored as one flat `int32`
+    array of token ids plus an `int64` array of offsets, i.e. entity `i` of `label` consists of the token
+    ids `token_ids[label][offsets[label][i] : offsets[label][i + 1]]`. Entities are gathered with `add`
+    and compiled into these arrays once by `build`, after which `sample` runs in constant time regardless
+    of the number of entities per label.
+
+    The entities of every label are sorted by length, so the entities of at most `max_length` tokens are
+    the first `length_counts[label][max_length]` entities, and can be sampled in constant time as well.
+    """
+
+    def __init__(self) -> None:
+        self.vocab: List[str] = []
+        self.token_to_id: Dict[str, int] = {}
+        self.token_ids: Dict[int, np.ndarray] = {}
+        self.offsets: Dict[int, np.ndarray] = {}
+        self.length_counts: Dict[int, np.ndarray] = {}
+        # Entities that have been added, but not yet compiled into arrays by `build`
+        self._pending: Dict[int, Dict[Tuple[int, ...], None]] = defaultdict(dict)
+
+    def intern(self, token: str) -> int:
+        token_id = self.token_to_id.get(token)
+        if token_id is None:
+            token_id = len(self.vocab)
+            self.token_to_id[token] = token_id
+            self.vocab.append(token)
+        return token_id
+
+    def add(self, label: int, tokens: Sequence[str]) -> None:
+        """Add an entity to the knowledge base, unless it is empty or already known for this label.
+
+        Args:
+            label (int): The reduced label id of the entity.
+            tokens (Sequence[str]): The tokens of the entity.
+        """
+        if not tokens:
+            return
+        self.pending_entities(label)[tuple(self.intern(token) for token in tokens)] = None
+
+    def update(self, other: "KnowledgeBase") -> "KnowledgeBase":
+        """Add all entities from another knowledge base to this one.
+
+        Args:
+            other (KnowledgeBase): The knowledge base to add the entities from.
+
+        Returns:
+            KnowledgeBase: This knowledge base, which still has to be built.
+        """
+        # Translate the token ids from the vocabulary of `other` to that of this knowledge base
+        translation = [self.intern(token) for token in other.vocab]
+        for label in set(other.offsets) | set(other._pending):
+            pending = self.pending_entities(label)
+            other_entities = chain(
+                other.iter_entity_ids(label) if label in other.offsets else (), other._pending.get(label, ())
+            )
+            for entity in other_entities:
+                pending[tuple(translation[token_id] for token_id in entity)] = None
+        return self
+
+    def copy(self) -> "KnowledgeBase":
+        """Return a copy that can be extended without changing this knowledge base.
+
+        The arrays of the built labels are shared rather than copied, as `build` replaces them instead of changing
+        them in place.
+        """
+        copied = KnowledgeBase()
+        copied.vocab = self.vocab.copy()
+        copied.token_to_id = self.token_to_id.copy()
+        copied.token_ids = self.token_ids.copy()
+        copied.offsets = self.offsets.copy()
+        copied.length_counts = self.length_counts.copy()
+        for label, entities in self._pending.items():
+            copied._pending[label] = entities.copy()
+        return copied
+
+    @classmethod
+    def merge(cls, knowledge_bases: Iterable["KnowledgeBase"]) -> "KnowledgeBase":
+        """Merge e.g. the partial knowledge bases of several workers into one built knowledge base.
+
+        As `build` sorts the entities, the result is the same regardless of the order of `knowledge_bases`.
+        """
+        merged = cls()
+        for knowledge_base in knowledge_bases:
+            merged.update(knowledge_base)
+        return merged.build()
+
+    def save(self, path: Union[str, os.PathLike]) -> None:
+        """Save the (built) knowledge base in the format of `save_knowledge_base_arrays`.
+
+        Args:
+            path (Union[str, os.PathLike]): The directory to save the knowledge base to.
+        """
+        labels = self.labels
+        label_offsets = np.zeros(len(labels) + 1, dtype=np.int64)
+        np.cumsum([self.num_entities(label) for label in labels], out=label_offsets[1:])
+        token_offsets = np.cumsum([0] + [len(self.token_ids[label]) for label in labels])
+        entity_offsets = np.concatenate(
+            [self.offsets[label][:-1] + token_offset for label, token_offset in zip(labels, token_offsets)]
+            + [token_offsets[-1:]]
+        )
+        token_ids = np.concatenate([self.token_ids[label] for label in labels] + [np.zeros(0, dtype=np.int32)])
+        save_knowledge_base_arrays(path, self.vocab, labels, label_offsets, entity_offsets, token_ids)
+
+    @classmethod
+    def load(cls, path: Union[str, os.PathLike]) -> "KnowledgeBase":
+        """Load a knowledge base that was saved with `save` fully into memory, e.g. to extend it.
+
+        Use `MemoryMappedKnowledgeBase` to only read from it instead.
+
+        Args:
+            path (Union[str, os.PathLike]): The directory that the knowledge base was saved to.
+
+        Returns:
+            KnowledgeBase: The loaded, built knowledge base.
+        """
+        path = Path(path)
+        knowledge_base = cls()
+        knowledge_base.vocab = list(MemoryMappedVocab(path))
+        knowledge_base.token_to_id = {token: token_id for token_id, token in enumerate(knowledge_base.vocab)}
+
+        with open(path / "labels.json", encoding="utf-8") as f:
+            labels = json.load(f)
+        label_offsets = np.load(path / "label_offsets.npy")
+        entity_offsets = np.load(path / "entity_offsets.npy")
+        token_ids = np.load(path / "token_ids.npy")
+        for label, start, end in zip(labels, label_offsets, label_offsets[1:]):
+            offsets = entity_offsets[start : end + 1]
+            knowledge_base.token_ids[label] = token_ids[offsets[0] : offsets[-1]]
+            knowledge_base.offsets[label] = offsets - offsets[0]
+            knowledge_base.length_counts[label] = count_lengths(np.diff(offsets))
+        return knowledge_base
+
+    def pending_entities(self, label: int) -> Dict[Tuple[int, ...], None]:
+        return self._pending[label]
+
+    def entity_sort_key(self, entity: Sequence[int]) -> Tuple[int, List[str]]:
+        return len(entity), [self.vocab[token_id] for token_id in entity]
+
+    def build(self) -> "KnowledgeBase":
+        """Compile all pending entities into the flat token id and offset arrays.
+
+        Entities are sorted by their length and then by their tokens, so the resulting arrays do not depend
+        on the order in which the entities were added. Entities that are added to a label that was built before are
+        merged into its arrays, so only the new entities are sorted.
+        """
+        for label, entities in self._pending.items():
+            entities = sorted(entities, key=self.entity_sort_key)
+            if label in self.offsets:
+                self.insert_entities(label, entities)
+            else:
+                self.token_ids[label], self.offsets[label] = entities_to_arrays(entities)
+            self.length_counts[label] = count_lengths(np.diff(self.offsets[label]))
+        self._pending.clear()
+        return self
+
+    def insert_entities(self, label: int, entities: List[Tuple[int, ...]]) -> None:
+        """Insert sorted entities into the arrays of a built label, skipping the entities that it already has."""
+        token_ids = self.token_ids[label]
+        offsets = self.offsets[label]
+        length_counts = self.length_counts[label]
+        positions = []
+        new_entities = []
+        for entity in entities:
+            # Every new entity goes after all existing entities that are shorter, so only the existing entities of
+            # the same length have to be searched
+            key = self.entity_sort_key(entity)
+            low = lookup_length_count(length_counts, len(entity) - 1)
+            end = high = lookup_length_count(length_counts, len(entity))
+            while low < high:
+                middle = (low + high) // 2
+                if self.entity_sort_key(token_ids[offsets[middle] : offsets[middle + 1]].tolist()) < key:
+                    low = middle + 1
+                else:
+                    high = middle
+            if low < end and tuple(token_ids[offsets[low] : offsets[low + 1]].tolist()) == entity:
+                continue
+            positions.append(low)
+            new_entities.append(entity)
+        if not new_entities:
+            return
+
+        segments = []
+        previous = 0
+        for position, entity in zip(positions, new_entities):
+            segments.append(token_ids[offsets[previous] : offsets[position]])
+            segments.append(np.array(entity, dtype=np.int32))
+            previous = position
+        segments.append(token_ids[offsets[previous] :])
+        lengths = np.insert(np.diff(offsets), positions, [len(entity) for entity in new_entities])
+        self.token_ids[label] = np.concatenate(segments)
+        self.offsets[label] = np.zeros(len(lengths) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=self.offsets[label][1:])
+
+    @property
+    def labels(self) -> List[int]:
+        if self._pending:
+            self.build()
+        return sorted(self.offsets)
+
+    def num_entities(self, label: int, max_length: Optional[int] = None) -> int:
+        """Return the number of entities of `label`, or only of those with at most `max_length` tokens."""
+        if self._pending:
+            self.build()
+        if label not in self.offsets:
+            return 0
+        if max_length is None:
+            return len(self.offsets[label]) - 1
+        return lookup_length_count(self.length_counts[label], max_length)
+
+    def __len__(self) -> int:
+        return sum(self.num_entities(label) for label in self.labels)
+
+    def __contains__(self, label: int) -> bool:
+        return label in self.offsets or label in self._pending
+
+    def iter_entity_ids(self, label: int) -> Iterator[Tuple[int, ...]]:
+        token_ids = self.token_ids[label].tolist()
+        offsets = self.offsets[label].tolist()
+        for start, end in zip(offsets, offsets[1:]):
+            yield tuple(token_ids[start:end])
+
+    def get(self, label: int, index: int) -> List[str]:
+        """Return the tokens of the `index`-th entity of `label`."""
+        if self._pending:
+            self.build()
+        offsets = self.offsets[label]
+        vocab = self.vocab
+        return [vocab[token_id] for token_id in self.token_ids[label][offsets[index] : offsets[index + 1]].tolist()]
+
+    def sample(self, label: int, rng: random.Random = random, max_length: Optional[int] = None) -> List[str]:
+        """Return the tokens of a uniformly sampled entity of `label`.
+
+        Args:
+            label (int): The reduced label id to sample an entity for.
+            rng (random.Random): The source of randomness, defaults to the global `random` module.
+            max_length (Optional[int]): If set, only sample from the entities with at most this many tokens.
+
+        Returns:
+            List[str]: The tokens of the sampled entity.
+        """
+        return self.get(label, rng.randrange(self.num_entities(label, max_length)))
+
+
+class MemoryMappedVocab(Sequence):
+    """Read-only vocabulary that decodes the tokens of a saved knowledge base on access from memory-mapped arrays."""
+
+    def __init__(self, path: Union[str, os.PathLike]) -> None:
+        self.data = np.load(Path(path) / "vocab_data.npy", mmap_mode="r")
+        self.offsets = np.load(Path(path) / "vocab_offsets.npy", mmap_mode="r")
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def __getitem__(self, token_id: int) -> str:
+        return self.data[self.offsets[token_id] : self.offsets[token_id + 1]].tobytes().decode("utf-8")
+
+    def __iter__(self) -> Iterator[str]:
+        data = self.data.tobytes()
+        offsets = self.offsets.tolist()
+        for start, end in zip(offsets, offsets[1:]):
+            yield data[start:end].decode("utf-8")
+
+
+class MemoryMappedKnowledgeBase:
+    """Read-only, memory-mapped view of a knowledge base saved by `KnowledgeBase.save` or built by
+    `build_gazetteer_knowledge_base`.
+
+    Opening takes constant time regardless of the size of the knowledge base, as only the labels are read eagerly,
+    and worker processes share the pages of the mapped files. Pickling only stores the path, so every process maps
+    the files itself rather than receiving a copy.
+    """
+
+    def __init__(self, path: Union[str, os.PathLike], label_map: Optional[Dict[Hashable, Hashable]] = None) -> None:
+        self.path = Path(path)
+        self.label_map = label_map
+        self.vocab = MemoryMappedVocab(self.path)
+        self.token_ids = np.load(self.path / "token_ids.npy", mmap_mode="r")
+        self.entity_offsets = np.load(self.path / "entity_offsets.npy", mmap_mode="r")
+
+        with open(self.path / "labels.json", encoding="utf-8") as f:
+            labels = json.load(f)
+        label_offsets = np.load(self.path / "label_offsets.npy").tolist()
+        # Maps every label to the range of its entities in `entity_offsets`
+        self.ranges = {label: (start, end) for label, start, end in zip(labels, label_offsets, label_offsets[1:])}
+        if label_map is not None:
+            self.ranges = {label: self.ranges[stored] for label, stored in label_map.items() if stored in self.ranges}
+        self.length_counts: Dict[Hashable, np.ndarray] = {}
+
+    def relabel(self, label_map: Dict[Hashable, Hashable]) -> "MemoryMappedKnowledgeBase":
+        """Return a view of this knowledge base with other labels, e.g. to map reduced label ids to label names.
+
+        Args:
+            label_map (Dict[Hashable, Hashable]): Mapping of the new labels to the labels stored in the knowledge
+                base. Labels that are not stored in the knowledge base are ignored.
+
+        Returns:
+            MemoryMappedKnowledgeBase: The relabeled knowledge base, which maps the same files.
+        """
+        return MemoryMappedKnowledgeBase(self.path, label_map)
+
+    def __getstate__(self) -> Dict:
+        return {"path": self.path, "label_map": self.label_map}
+
+    def __setstate__(self, state: Dict) -> None:
+        self.__init__(state["path"], state["label_map"])
+
+    def build(self) -> "MemoryMappedKnowledgeBase":
+        return self
+
+    @property
+    def labels(self) -> List[Hashable]:
+        return list(self.ranges)
+
+    def num_entities(self, label: Hashable, max_length: Optional[int] = None) -> int:
+        """Return the number of entities of `label`, or only of those with at most `max_length` tokens."""
+        start, end = self.ranges.get(label, (0, 0))
+        if max_length is None or start == end:
+            return end - start
+        if label not in self.length_counts:
+            # Only read the offsets of a label once it is sampled with a length budget
+            self.length_counts[label] = count_lengths(np.diff(self.entity_offsets[start : end + 1]))
+        return lookup_length_count(self.length_counts[label], max_length)
+
+    def __len__(self) -> int:
+        return len(self.entity_offsets) - 1
+
+    def __contains__(self, label: Hashable) -> bool:
+        return label in self.ranges
+
+    def get(self, label: Hashable, index: int) -> List[str]:
+        """Return the tokens of the `index`-th entity of `label`."""
+        entity = self.ranges[label][0] + index
+        start, end = self.entity_offsets[entity : entity + 2].tolist()
+        vocab = self.vocab
+        return [vocab[token_id] for token_id in self.token_ids[start:end].tolist()]
+
+    def sample(self, label: Hashable, rng: random.Random = random, max_length: Optional[int] = None) -> List[str]:
+        """Return the tokens of a uniformly sampled entity of `label`.
+
+        Args:
+            label (Hashable): The label to sample an entity for.
+            rng (random.Random): The source of randomness, defaults to the global `random` module.
+            max_length (Optional[int]): If set, only sample from the entities with at most this many tokens.
+
+        Returns:
+            List[str]: The tokens of the sampled entity.
+        """
+        return self.get(label, rng.randrange(self.num_entities(label, max_length)))
+
+
+def iter_gazetteer(
+    path: Union[str, os.PathLike], tokenize: Callable[[str], List[str]]
+) -> Iterator[Tuple[str, List[str]]]:
+    """Yield the `(label, tokens)` pairs of a gazetteer file.
+
+    Files with a `.jsonl` or `.json` suffix hold one JSON object per line, with a `"label"`, and either pre-tokenized
+    `"tokens"` or a `"text"` to tokenize. Any other file is read as TSV, with a label and an entity text per line.
+    """
+    path = Path(path)
+    with open(path, encoding="utf-8") as f:
+        if path.suffix in (".jsonl", ".json"):
+            for line in f:
+                if line.strip():
+                    entry = json.loads(line)
+                    yield entry["label"], entry["tokens"] if "tokens" in entry else tokenize(entry["text"])
+        else:
+            for line in f:
+                label, _, text = line.rstrip("\n").partition("\t")
+                yield label, tokenize(text)
+
+
+def first_occurrences(
+    hashes: np.ndarray, labels: np.ndarray, token_ids: np.ndarray, offsets: np.ndarray
+) -> np.ndarray:
+    """Find the first occurrence of every distinct (label, tokens) pair from their hashes.
+
+    Entities with equal hashes are only discarded after comparing their labels and tokens with the first entity of
+    the same hash, so hash collisions never drop a distinct entity. The few entities that do collide are then
+    deduplicated exactly in Python.
+
+    Args:
+        hashes (np.ndarray): The hash of every entity.
+        labels (np.ndarray): The label id of every entity.
+        token_ids (np.ndarray): The token ids of all entities, concatenated.
+        offsets (np.ndarray): The `num_entities + 1` offsets of the entities into `token_ids`.
+
+    Returns:
+        np.ndarray: The sorted indices of the first occurrence of every distinct entity.
+    """
+    order = np.argsort(hashes, kind="stable")
+    sorted_hashes = hashes[order]
+    is_group_start = np.ones(len(order), dtype=bool)
+    is_group_start[1:] = sorted_hashes[1:] != sorted_hashes[:-1]
+    group_starts = np.maximum.accumulate(np.where(is_group_start, np.arange(len(order)), 0))
+    # Compare every later entity of a hash with the first one, which stable sorting keeps in file order
+    candidates = order[~is_group_start]
+    firsts = order[group_starts[~is_group_start]]
+    lengths = np.diff(offsets)
+    equal = (labels[candidates] == labels[firsts]) & (lengths[candidates] == lengths[firsts])
+    compared, compared_lengths = np.flatnonzero(equal), lengths[candidates[equal]]
+    token_offsets = np.zeros(len(compared) + 1, dtype=np.int64)
+    np.cumsum(compared_lengths, out=token_offsets[1:])
+    positions = np.arange(token_offsets[-1]) - np.repeat(token_offsets[:-1], compared_lengths)
+    mismatches = np.bincount(
+        np.repeat(np.arange(len(compared)), compared_lengths),
+        weights=token_ids[np.repeat(offsets[candidates[compared]], compared_lengths) + positions]
+        != token_ids[np.repeat(offsets[firsts[compared]], compared_lengths) + positions],
+        minlength=len(compared),
+    )
+    equal[compared] = mismatches == 0
+
+    keep = np.ones(len(hashes), dtype=bool)
+    keep[candidates[equal]] = False
+    # Colliding entities that differ from the first entity of their hash may still equal each other
+    seen = set()
+    for index in candidates[~equal].tolist():
+        key = (int(labels[index]), token_ids[offsets[index] : offsets[index + 1]].tobytes())
+        keep[index] = key not in seen
+        seen.add(key)
+    return np.flatnonzero(keep)
+
+
+def build_gazetteer_knowledge_base(
+    gazetteers: Iterable[Union[str, os.PathLike]],
+    path: Union[str, os.PathLike],
+    tokenize: Callable[[str], List[str]] = str.split,
+) -> MemoryMappedKnowledgeBase:
+    """Build a knowledge base from TSV or JSONL gazetteers, and open it memory-mapped.
+
+    The entities are stored compactly while reading, after which duplicates are removed in one vectorized pass using
+    64-bit hashes of the (label, tokens) pairs, so building scales to tens of millions of entities per label. Entities
+    with equal hashes are compared before discarding any, so hash collisions never drop a distinct entity.
+
+    Args:
+        gazetteers (Iterable[Union[str, os.PathLike]]): The gazetteer files, see `iter_gazetteer` for their format.
+        path (Union[str, os.PathLike]): The directory to save the knowledge base to.
+        tokenize (Callable[[str], List[str]]): Splits entity texts into tokens, e.g. to match the tokenization of the
+            dataset to augment. Defaults to splitting on whitespace.
+
+    Returns:
+        MemoryMappedKnowledgeBase: The built knowledge base, with the label names from the gazetteers as labels.
+    """
+    token_to_id = {}
+    label_to_id = {}
+    token_ids = array("i")
+    lengths = array("q")
+    entity_labels = array("q")
+    for gazetteer in gazetteers:
+        for label, tokens in iter_gazetteer(gazetteer, tokenize):
+            if tokens:
+                entity_labels.append(label_to_id.setdefault(label, len(label_to_id)))
+                lengths.append(len(tokens))
+                token_ids.extend(token_to_id.setdefault(token, len(token_to_id)) for token in tokens)
+
+    token_ids = np.frombuffer(token_ids, dtype=np.int32)
+    lengths = np.frombuffer(lengths, dtype=np.int64)
+    entity_labels = np.frombuffer(entity_labels, dtype=np.int64)
+    offsets = np.zeros(len(lengths) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=offsets[1:])
+
+    # Keep the first occurrence of every (label, tokens) pair, grouped by label, sorted by length and otherwise in
+    # file order
+    hashes = hash_sequences(token_ids, offsets) ^ splitmix64(entity_labels)
+    first_indices = first_occurrences(hashes, entity_labels, token_ids, offsets)
+    entities = first_indices[np.lexsort((lengths[first_indices], entity_labels[first_indices]))]
+
+    entity_lengths = lengths[entities]
+    entity_offsets = np.zeros(len(entities) + 1, dtype=np.int64)
+    np.cumsum(entity_lengths, out=entity_offsets[1:])
+    positions = np.arange(entity_offsets[-1]) + np.repeat(offsets[entities] - entity_offsets[:-1], entity_lengths)
+    label_offsets = np.zeros(len(label_to_id) + 1, dtype=np.int64)
+    np.cumsum(np.bincount(entity_labels[entities], minlength=len(label_to_id)), out=label_offsets[1:])
+    save_knowledge_base_arrays(
+        path, list(token_to_id), list(label_to_id), label_offsets, entity_offsets, token_ids[positions]
+    )
+    return MemoryMappedKnowledgeBase(path)
@@ -0,0 +1,241 @@
+from typing import TYPE_CHECKING, List, Optional, Tuple, Union
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+from datasets import ClassLabel, Dataset, Features, IterableDataset, Sequence, Value
+from datasets.fingerprint import generate_random_fingerprint
+
+from adept_augmentations.augmenters.extractors import (
+    LabelScheme,
+    entity_token_positions,
+    flatten_list_array,
+)
+from adept_augmentations.profilers import count, profiled
+from adept_augmentations.utils import (
+    convert_dataset_to_docbin,
+    convert_docbin_to_dataset,
+    is_docbin,
+)
+
+if TYPE_CHECKING:
+    from spacy.tokens import DocBin
+
+
+def window_boundaries(
+    offsets: np.ndarray, starts: np.ndarray, ends: np.ndarray, entity_offsets: np.ndarray, max_length: int
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Split every row of a batch into consecutive windows of at most `max_length` tokens that never split an entity.
+
+    Every window ends at the last position within `max_length` tokens that is not inside an entity. The windows of
+    all rows are found together, with one vectorized step per window of the longest row. An entity that is longer
+    than `max_length` itself gets a window of its own, and empty rows get no windows.
+
+    Args:
+        offsets (np.ndarray): The `num_rows + 1` offsets of the rows into the flattened tokens.
+        starts (np.ndarray): The start index of every entity, relative to the start of its row.
+        ends (np.ndarray): The end index of every entity, relative to the start of its row.
+        entity_offsets (np.ndarray): The `num_rows + 1` offsets of the rows into the entities.
+        max_length (int): The maximum number of tokens per window.
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray]: The start and end positions of all windows in the flattened tokens, in order.
+    """
+    offsets = np.asarray(offsets, dtype=np.int64)
+    num_tokens = int(offsets[-1])
+    rows = np.repeat(np.arange(len(offsets) - 1), np.diff(entity_offsets))
+    entity_starts = offsets[rows] + starts
+    entity_ends = offsets[rows] + ends
+    # Cutting in front of position `t` splits an entity if `start < t < end`
+    depth = (
+        np.bincount(entity_starts + 1, minlength=num_tokens + 1)[: num_tokens + 1]
+        - np.bincount(entity_ends, minlength=num_tokens + 1)[: num_tokens + 1]
+    )
+    cuts = np.flatnonzero(np.cumsum(depth) <= 0)
+
+    positions = offsets[:-1].copy()
+    row_ends = offsets[1:]
+    window_starts = []
+    window_ends = []
+    active = np.flatnonzero(positions < row_ends)
+    while len(active):
+        start = positions[active]
+        end = cuts[np.searchsorted(cuts, np.minimum(start + max_length, row_ends[active]), side="right") - 1]
+        # Every row end is a cut, so an entity that doesn't fit ends at the next cut
+        too_long = end <= start
+        end[too_long] = cuts[np.searchsorted(cuts, start[too_long], side="right")]
+        window_starts.append(start)
+        window_ends.append(end)
+        positions[active] = end
+        active = active[end < row_ends[active]]
+
+    window_starts = np.concatenate(window_starts) if window_starts else np.zeros(0, dtype=np.int64)
+    window_ends = np.concatenate(window_ends) if window_ends else np.zeros(0, dtype=np.int64)
+    order = np.argsort(window_starts, kind="stable")
+    return window_starts[order], window_ends[order]
+
+
+class SentenceCropAugmenter:
+    """Augmenter that crops every sentence, e.g. of a long document, into consecutive windows of at most
+    `max_length` tokens, so a model gets short and dense training sequences rather than truncated or heavily padded
+    ones.
+
+    Windows never split an entity, and the label ids of every window are written anew from its entities in the
+    tagging scheme of the labels. The dataset can also be the output of e.g. `EntitySwapAugmenter.augment`:
+
+        augmented_dataset = SentenceCropAugmenter(EntitySwapAugmenter(dataset).augment(N=4)).augment(max_length=128)
+    """
+
+    def __init__(
+        self,
+        dataset: Union[Dataset, "DocBin", IterableDataset],
+        labels: Optional[List[str]] = None,
+        label_column: str = "ner_tags",
+    ) -> None:
+        self.is_docbin = is_docbin(dataset)
+        if self.is_docbin:
+            dataset = convert_docbin_to_dataset(dataset, labels)
+        elif not isinstance(dataset, (Dataset, IterableDataset)):
+            raise TypeError(
+                "dataset must be either a `datasets.Dataset`, a `spacy.tokens.DocBin` or a `datasets.IterableDataset`."
+            )
+
+        if labels is None:
+            if dataset.features is None:
+                raise ValueError("`labels` must be provided if the dataset has no features to infer them from.")
+            labels = dataset.features[label_column].feature.names
+        self.dataset = dataset
+        self.labels = labels
+        self.label_column = label_column
+        self.outside_id = labels.index("O")
+        self.label_scheme, self.entity_extractor = LabelScheme.from_labels(labels)
+
+    @property
+    def features(self) -> Features:
+        return Features(
+            {
+                "tokens": Sequence(feature=Value(dtype="string")),
+                self.label_column: Sequence(feature=ClassLabel(names=self.labels)),
+            }
+        )
+
+    def augment(self, max_length: int, num_proc: Optional[int] = None) -> Union[Dataset, "DocBin", IterableDataset]:
+        """Crop every sentence into consecutive windows of at most `max_length` tokens.
+
+        Args:
+            max_length (int): The maximum number of tokens per window. Only entities that are longer than this
+                themselves get a longer window, of just that entity.
+            num_proc (Optional[int]): The number of processes to crop with. Defaults to None, i.e. no
+                multiprocessing.
+
+        Returns:
+            Union[Dataset, DocBin, IterableDataset]: The windows, with only the tokens and label ids, as a dataset of
+            the same type as the dataset the augmenter was created with. `IterableDataset`s are cropped lazily, and
+            `num_proc` is ignored for them.
+        """
+        if max_length < 1:
+            raise ValueError(f"max_length must be at least 1, but got {max_length}.")
+        columns = ["tokens", self.label_column]
+        if isinstance(self.dataset, IterableDataset):
+            # Unlike for `Dataset.map`, the columns are removed from the output, so only remove the other columns
+            return self.dataset.map(
+                self.crop_python_batch,
+                batched=True,
+                remove_columns=[column for column in self.dataset.column_names or [] if column not in columns],
+                features=self.features,
+                fn_kwargs={"max_length": max_length},
+            )
+
+        cropped_dataset = (
+            self.dataset.select_columns(columns)
+            .with_format("arrow")
+            .map(
+                self.crop_batch,
+                batched=True,
+                remove_columns=columns,
+                features=self.features,
+                load_from_cache_file=False,
+                new_fingerprint=generate_random_fingerprint(),
+                fn_kwargs={"max_length": max_length},
+                num_proc=num_proc,
+            )
+            .with_format(self.dataset.format["type"])
+        )
+        if self.is_docbin:
+            return convert_dataset_to_docbin(cropped_dataset, self.label_column)
+        return cropped_dataset
+
+    @profiled("crop_batch")
+    def crop_batch(self, batch: pa.Table, max_length: int) -> pa.Table:
+        """Crop every row of an Arrow batch into windows of at most `max_length` tokens that never split an entity.
+
+        Args:
+            batch (pa.Table): A batch of the dataset, with at least the `tokens` and label columns.
+            max_length (int): The maximum number of tokens per window.
+
+        Returns:
+            pa.Table: The tokens and label ids of all windows.
+        """
+        ner_tags, offsets = flatten_list_array(batch.column(self.label_column))
+        labels, starts, ends, entity_offsets = self.entity_extractor.extract_batch(ner_tags, offsets)
+        window_starts, window_ends = window_boundaries(offsets, starts, ends, entity_offsets, max_length)
+        count("crop.rows", batch.num_rows)
+        count("crop.windows", len(window_starts))
+
+        # As no entity is split, the windows keep the label ids of the rows with the entities written anew
+        ner_tags = self.scheme_label_ids(len(ner_tags), offsets, labels, starts, ends, entity_offsets)
+        window_offsets = np.zeros(len(window_starts) + 1, dtype=np.int64)
+        np.cumsum(window_ends - window_starts, out=window_offsets[1:])
+        positions = np.arange(window_offsets[-1]) + np.repeat(
+            window_starts - window_offsets[:-1], window_ends - window_starts
+        )
+        tokens = pc.list_flatten(batch.column("tokens").combine_chunks())
+        window_offsets = pa.array(window_offsets, type=pa.int32())
+        return pa.table(
+            {
+                "tokens": pa.ListArray.from_arrays(window_offsets, tokens.take(pa.array(positions))),
+                self.label_column: pa.ListArray.from_arrays(window_offsets, pa.array(ner_tags[positions])),
+            }
+        )
+
+    def crop_python_batch(self, batch: dict, max_length: int) -> dict:
+        """`crop_batch` for the Python batches of `IterableDataset.map`."""
+        table = pa.table(
+            {
+                "tokens": pa.array(batch["tokens"], type=pa.list_(pa.string())),
+                self.label_column: pa.array(batch[self.label_column], type=pa.list_(pa.int64())),
+            }
+        )
+        return self.crop_batch(table, max_length).to_pydict()
+
+    def scheme_label_ids(
+        self,
+        num_tokens: int,
+        offsets: np.ndarray,
+        labels: np.ndarray,
+        starts: np.ndarray,
+        ends: np.ndarray,
+        entity_offsets: np.ndarray,
+    ) -> np.ndarray:
+        """Write the label ids of the flattened tokens of a batch from its entities, with `reduced_label_id_to_id`.
+
+        Tokens outside of the entities get the `"O"` label id. The label ids are computed once for every combination
+        of reduced label id and entity length in the batch.
+
+        Returns:
+            np.ndarray: The label id of every token in the batch.
+        """
+        ner_tags = np.full(num_tokens, self.outside_id, dtype=np.int64)
+        positions, length_offsets = entity_token_positions(offsets, starts, ends, entity_offsets)
+        lengths = np.diff(length_offsets)
+        keys = labels.astype(np.int64) * (int(lengths.max(initial=0)) + 1) + lengths
+        order = np.argsort(keys, kind="stable")
+        _, group_starts = np.unique(keys[order], return_index=True)
+        for group_start, group_end in zip(group_starts.tolist(), [*group_starts[1:].tolist(), len(order)]):
+            entities = order[group_start:group_end]
+            label, length = int(labels[entities[0]]), int(lengths[entities[0]])
+            if length == 0:
+                continue
+            token_positions = positions[length_offsets[entities][:, None] + np.arange(length)]
+            ner_tags[token_positions] = self.entity_extractor.reduced_label_id_to_id(label, length)
+        return ner_tags
@@ -0,0 +1,135 @@
+import os
+import random
+from functools import partial
+from pathlib import Path
+from typing import Callable, Iterable, Iterator, List, Union
+
+import numpy as np
+from spacy.attrs import ENT_IOB, ENT_TYPE, ORTH
+from spacy.language import Language
+from spacy.strings import get_string_id
+from spacy.tokens import Doc, DocBin, Span
+from spacy.training import Example
+from spacy.training.corpus import walk_corpus
+from spacy.util import registry
+
+from adept_augmentations.augmenters.knowledge_base import KnowledgeBase
+
+# The `ENT_IOB` values that spaCy stores, i.e. missing, inside, outside and begin
+IOB_INSIDE = 1
+IOB_BEGIN = 3
+
+
+def build_docbin_knowledge_base(paths: Iterable[Union[str, os.PathLike]]) -> KnowledgeBase:
+    """Build a knowledge base with the entity label names as labels from `.spacy` files.
+
+    The entities are read from the token attribute arrays and the string table of every `DocBin`, without creating
+    `Doc` objects.
+
+    Args:
+        paths (Iterable[Union[str, os.PathLike]]): The `.spacy` files, or directories with `.spacy` files.
+
+    Returns:
+        KnowledgeBase: The built knowledge base.
+    """
+    knowledge_base = KnowledgeBase()
+    for path in paths:
+        for file_path in walk_corpus(path, ".spacy"):
+            doc_bin = DocBin().from_disk(file_path)
+            if ENT_IOB not in doc_bin.attrs or ENT_TYPE not in doc_bin.attrs or not doc_bin.tokens:
+                continue
+            strings = {get_string_id(string): string for string in doc_bin.strings}
+            flat = np.concatenate(doc_bin.tokens)
+            iob = flat[:, doc_bin.attrs.index(ENT_IOB)]
+            # An entity begins at a "B" and runs until the first token that is not an "I", which is never the first
+            # token of the next doc
+            starts = np.flatnonzero(iob == IOB_BEGIN)
+            breaks = np.append(np.flatnonzero(iob != IOB_INSIDE), len(iob))
+            ends = breaks[np.searchsorted(breaks, starts, side="right")]
+            orths = flat[:, doc_bin.attrs.index(ORTH)].tolist()
+            ent_types = flat[starts, doc_bin.attrs.index(ENT_TYPE)].tolist()
+            for ent_type, start, end in zip(ent_types, starts.tolist(), ends.tolist()):
+                knowledge_base.add(strings[ent_type], [strings[orth] for orth in orths[start:end]])
+    return knowledge_base.build()
+
+
+def swap_doc_entities(doc: Doc, knowledge_base: KnowledgeBase, rng: random.Random = random) -> Doc:
+    """Create a copy of a doc with every entity replaced by one of the same label from the knowledge base.
+
+    Only the words, whitespace and entities are kept. Entities with labels that are missing from the knowledge base,
+    as well as tokens with missing entity annotations, are kept as is.
+
+    Args:
+        doc (Doc): The doc with the (gold) entities.
+        knowledge_base (KnowledgeBase): The knowledge base, with the entity label names as labels.
+        rng (random.Random): The source of randomness, defaults to the global `random` module.
+
+    Returns:
+        Doc: The augmented doc.
+    """
+    words: List[str] = []
+    spaces: List[bool] = []
+    entities = []
+    missing = []
+
+    def add_context(start: int, end: int) -> None:
+        for token in doc[start:end]:
+            if token.ent_iob == 0:
+                missing.append(len(words))
+            words.append(token.text)
+            spaces.append(bool(token.whitespace_))
+
+    prev_end = 0
+    for ent in doc.ents:
+        add_context(prev_end, ent.start)
+        if ent.label_ in knowledge_base:
+            entity_tokens = knowledge_base.sample(ent.label_, rng)
+        else:
+            entity_tokens = [token.text for token in ent]
+        entities.append((ent.label_, len(words), len(words) + len(entity_tokens)))
+        words += entity_tokens
+        spaces += [True] * (len(entity_tokens) - 1) + [bool(ent[-1].whitespace_)]
+        prev_end = ent.end
+    add_context(prev_end, len(doc))
+
+    augmented_doc = Doc(doc.vocab, words=words, spaces=spaces)
+    augmented_doc.set_ents(
+        [Span(augmented_doc, start, end, label=label) for label, start, end in entities],
+        missing=[augmented_doc[index : index + 1] for index in missing],
+        default="outside",
+    )
+    return augmented_doc
+
+
+def entity_swap_augmenter(
+    nlp: Language, example: Example, *, knowledge_base: KnowledgeBase, level: float
+) -> Iterator[Example]:
+    if random.random() >= level or not example.reference.ents:
+        yield example
+    else:
+        reference = swap_doc_entities(example.reference, knowledge_base)
+        yield Example(nlp.make_doc(reference.text), reference)
+
+
+@registry.augmenters("adept_augmentations.EntitySwapAugmenter.v1")
+def create_entity_swap_augmenter(
+    corpus: Union[str, Path], level: float = 1.0
+) -> Callable[[Language, Example], Iterator[Example]]:
+    """Create a data augmentation callback that swaps the entities of examples while a spaCy corpus is read.
+
+    The knowledge base is built once from the `.spacy` files of `corpus`, e.g. the training corpus, after which
+    every epoch draws new swaps, so no augmented corpus is written to disk. E.g. in `config.cfg`:
+
+        [corpora.train.augmenter]
+        @augmenters = "adept_augmentations.EntitySwapAugmenter.v1"
+        corpus = ${paths.train}
+        level = 0.5
+
+    Args:
+        corpus (Union[str, Path]): A `.spacy` file, or a directory with `.spacy` files, to take the entities from.
+        level (float): The percentage of examples that will be augmented. Defaults to 1.0.
+
+    Returns:
+        Callable[[Language, Example], Iterator[Example]]: The augmenter.
+    """
+    return partial(entity_swap_augmenter, knowledge_base=build_docbin_knowledge_base([corpus]), level=level)
@@ -0,0 +1,125 @@
+import os
+from pathlib import Path
+from typing import Iterable, List, Union
+
+import numpy as np
+import pyarrow as pa
+
+from adept_augmentations.augmenters.constants import Entity
+
+
+class EntitySpans:
+    """The entities of every row of a dataset, stored next to the dataset rather than as an extra column of it.
+
+    The entities of all rows are kept in flat `int32` arrays of their (reduced) label ids, start and end indices,
+    and the entities of row `i` are those at `offsets[i] : offsets[i + 1]`. This takes 12 bytes per entity and
+    8 bytes per row, and the dataset itself is never rewritten.
+
+    Args:
+        labels (np.ndarray): The reduced label id of every entity.
+        starts (np.ndarray): The word start index of every entity.
+        ends (np.ndarray): The word end index of every entity.
+        offsets (np.ndarray): The `num_rows + 1` offsets of the rows into the entity arrays.
+    """
+
+    def __init__(self, labels: np.ndarray, starts: np.ndarray, ends: np.ndarray, offsets: np.ndarray) -> None:
+        self.labels = np.asarray(labels, dtype=np.int32)
+        self.starts = np.asarray(starts, dtype=np.int32)
+        self.ends = np.asarray(ends, dtype=np.int32)
+        self.offsets = np.asarray(offsets, dtype=np.int64)
+
+    @classmethod
+    def empty(cls) -> "EntitySpans":
+        return cls([], [], [], [0])
+
+    @classmethod
+    def concatenate(cls, entity_spans: Iterable["EntitySpans"]) -> "EntitySpans":
+        """Concatenate the entities of consecutive (batches of) rows.
+
+        Args:
+            entity_spans (Iterable[EntitySpans]): The entities of every batch of rows, in order.
+
+        Returns:
+            EntitySpans: The entities of all rows.
+        """
+        entity_spans = list(entity_spans)
+        if not entity_spans:
+            return cls.empty()
+        if len(entity_spans) == 1:
+            return entity_spans[0]
+        offsets = [np.zeros(1, dtype=np.int64)]
+        num_entities = 0
+        for spans in entity_spans:
+            offsets.append(spans.offsets[1:] - spans.offsets[0] + num_entities)
+            num_entities += spans.num_entities
+        return cls(
+            np.concatenate([spans.labels[spans.offsets[0] : spans.offsets[-1]] for spans in entity_spans]),
+            np.concatenate([spans.starts[spans.offsets[0] : spans.offsets[-1]] for spans in entity_spans]),
+            np.concatenate([spans.ends[spans.offsets[0] : spans.offsets[-1]] for spans in entity_spans]),
+            np.concatenate(offsets),
+        )
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    @property
+    def num_entities(self) -> int:
+        return int(self.offsets[-1] - self.offsets[0])
+
+    def __getitem__(self, index: int) -> List[Entity]:
+        return self.rows([index])[0]
+
+    def slice(self, start: int, stop: int) -> "EntitySpans":
+        """Return the entities of rows `start` up to `stop`, as views of these arrays."""
+        return EntitySpans(self.labels, self.starts, self.ends, self.offsets[start : stop + 1])
+
+    def rows(self, indices: Iterable[int]) -> List[List[Entity]]:
+        """Gather the entities of the given rows, e.g. of the rows in a batch of `Dataset.map(..., with_indices=True)`.
+
+        Args:
+            indices (Iterable[int]): The indices of the rows.
+
+        Returns:
+            List[List[Entity]]: The entities of every row, ordered by their start index.
+        """
+        indices = np.fromiter(indices, dtype=np.int64)
+        row_starts = self.offsets[indices]
+        lengths = self.offsets[indices + 1] - row_starts
+        row_offsets = np.zeros(len(indices) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=row_offsets[1:])
+        positions = np.arange(row_offsets[-1], dtype=np.int64) + np.repeat(row_starts - row_offsets[:-1], lengths)
+        entities = list(
+            zip(self.labels[positions].tolist(), self.starts[positions].tolist(), self.ends[positions].tolist())
+        )
+        return [entities[start:end] for start, end in zip(row_offsets[:-1].tolist(), row_offsets[1:].tolist())]
+
+    def to_list(self) -> List[List[Entity]]:
+        return self.rows(range(len(self)))
+
+    def to_arrow(self) -> pa.ListArray:
+        """Convert to an Arrow array with a list of `[label, start, end]` lists per row, e.g. to add as a column."""
+        start, end = self.offsets[0], self.offsets[-1]
+        entities = np.stack([self.labels[start:end], self.starts[start:end], self.ends[start:end]], axis=1)
+        return pa.ListArray.from_arrays(
+            pa.array(self.offsets - start, type=pa.int32()), pa.FixedSizeListArray.from_arrays(entities.ravel(), 3)
+        ).cast(pa.list_(pa.list_(pa.int32())))
+
+    def save(self, path: Union[str, os.PathLike]) -> None:
+        """Save the entities as `.npy` arrays in the directory `path`, which `load` memory-maps."""
+        path = Path(path)
+        path.mkdir(parents=True, exist_ok=True)
+        start, end = self.offsets[0], self.offsets[-1]
+        np.save(path / "labels.npy", self.labels[start:end])
+        np.save(path / "starts.npy", self.starts[start:end])
+        np.save(path / "ends.npy", self.ends[start:end])
+        np.save(path / "offsets.npy", self.offsets - start)
+
+    @classmethod
+    def load(cls, path: Union[str, os.PathLike]) -> "EntitySpans":
+        path = Path(path)
+        return cls(
+            np.load(path / "labels.npy", mmap_mode="r"),
+            np.load(path / "starts.npy", mmap_mode="r"),
+            np.load(path / "ends.npy", mmap_mode="r"),
+            np.load(path / "offsets.npy", mmap_mode="r"),
+        )
@@ -0,0 +1,135 @@
+import os
+from pathlib import Path
+from typing import TYPE_CHECKING, Any, Dict, Iterable, List, Tuple, Union
+
+from datasets import Features, Sequence, Value
+
+from adept_augmentations.profilers import count, profiled
+
+# `tokenizers` is an optional dependency, which is only imported once a `SubwordEncoder` is created
+if TYPE_CHECKING:
+    from tokenizers import Tokenizer
+
+
+def load_tokenizer(tokenizer: Union[str, os.PathLike, "Tokenizer", Any]) -> "Tokenizer":
+    """Load a `tokenizers.Tokenizer` from local files, without downloading anything.
+
+    Args:
+        tokenizer (Union[str, os.PathLike, Tokenizer, Any]): A `tokenizer.json` file or a directory with one, e.g.
+            saved with `save_pretrained`, a `tokenizers.Tokenizer`, or a fast `transformers` tokenizer.
+
+    Returns:
+        Tokenizer: A copy of the tokenizer, without truncation or padding.
+    """
+    try:
+        from tokenizers import Tokenizer
+    except ImportError as error:
+        raise ImportError(
+            "Subword ids require the `tokenizers` package, install it with `pip install tokenizers`."
+        ) from error
+
+    if isinstance(tokenizer, (str, os.PathLike)):
+        path = Path(tokenizer)
+        tokenizer = Tokenizer.from_file(str(path / "tokenizer.json" if path.is_dir() else path))
+    else:
+        # e.g. the Rust tokenizer behind a `transformers.PreTrainedTokenizerFast`
+        tokenizer = Tokenizer.from_str(getattr(tokenizer, "backend_tokenizer", tokenizer).to_str())
+    # Every word is encoded on its own, and the rows are only complete after splicing
+    tokenizer.no_truncation()
+    tokenizer.no_padding()
+    return tokenizer
+
+
+class SubwordEncoder:
+    """Encodes sentences of words into subword ids with labels aligned to them, for `EntitySwapAugmenter.augment`.
+
+    Every unique word is tokenized only once, after which sentences are assembled from the cached subword ids of
+    their words. This requires a tokenizer that tokenizes every word independently of its context when given
+    pre-tokenized input, such as WordPiece tokenizers or byte-level BPE tokenizers with `add_prefix_space=True`.
+
+    Args:
+        tokenizer (Union[str, os.PathLike, Tokenizer, Any]): See `load_tokenizer`.
+        add_special_tokens (bool): Whether to add the special tokens of the tokenizer, e.g. `[CLS]` and `[SEP]`, to
+            every sentence. Defaults to True.
+        label_all_subwords (bool): Whether every subword of a word gets the label id of the word, rather than only
+            the first subword. Defaults to False.
+        ignore_index (int): The label id of special tokens and, unless `label_all_subwords`, of all but the first
+            subword of every word. Defaults to -100, which PyTorch losses ignore.
+    """
+
+    def __init__(
+        self,
+        tokenizer: Union[str, os.PathLike, "Tokenizer", Any],
+        add_special_tokens: bool = True,
+        label_all_subwords: bool = False,
+        ignore_index: int = -100,
+    ) -> None:
+        self.tokenizer = load_tokenizer(tokenizer)
+        self.label_all_subwords = label_all_subwords
+        self.ignore_index = ignore_index
+        self.cache: Dict[str, List[int]] = {}
+
+        self.prefix_ids: List[int] = []
+        self.suffix_ids: List[int] = []
+        if add_special_tokens:
+            # The special tokens are those without a word around a single word, e.g. `[CLS] word [SEP]`
+            encoding = self.tokenizer.encode(["a"], is_pretokenized=True, add_special_tokens=True)
+            word_positions = [index for index, word_id in enumerate(encoding.word_ids) if word_id is not None]
+            self.prefix_ids = encoding.ids[: word_positions[0]]
+            self.suffix_ids = encoding.ids[word_positions[-1] + 1 :]
+
+    @property
+    def features(self) -> Features:
+        return Features(
+            {"input_ids": Sequence(feature=Value(dtype="int32")), "labels": Sequence(Value(dtype="int64"))}
+        )
+
+    @profiled("subwords.add_words")
+    def add_words(self, words: Iterable[str]) -> None:
+        """Tokenize the words that aren't cached yet, all at once.
+
+        Args:
+            words (Iterable[str]): The words, e.g. the vocabulary of a knowledge base or the tokens of a batch.
+        """
+        new_words = list(dict.fromkeys(word for word in words if word not in self.cache))
+        if not new_words:
+            return
+        count("subwords.words", len(new_words))
+        encodings = self.tokenizer.encode_batch(
+            [[word] for word in new_words], is_pretokenized=True, add_special_tokens=False
+        )
+        for word, encoding in zip(new_words, encodings):
+            self.cache[word] = encoding.ids
+
+    def encode(self, words: List[str], label_ids: List[int]) -> Tuple[List[int], List[int], List[int]]:
+        """Assemble the subword ids of a sentence from the cached subword ids of its words, without special tokens.
+
+        Args:
+            words (List[str]): The words of the sentence, which are tokenized first unless they are cached.
+            label_ids (List[int]): The label id of every word.
+
+        Returns:
+            Tuple[List[int], List[int], List[int]]: The subword ids, the label id of every subword, and the
+            `len(words) + 1` offsets of the words into the subwords, so a span of words is a slice of the subwords.
+        """
+        if not all(word in self.cache for word in words):
+            self.add_words(words)
+        input_ids = []
+        labels = []
+        offsets = [0]
+        for word, label_id in zip(words, label_ids):
+            word_ids = self.cache[word]
+            input_ids += word_ids
+            if word_ids:
+                labels.append(label_id)
+                labels += [label_id if self.label_all_subwords else self.ignore_index] * (len(word_ids) - 1)
+            offsets.append(len(input_ids))
+        return input_ids, labels, offsets
+
+    def finalize(self, input_ids: List[int], labels: List[int]) -> Tuple[List[int], List[int]]:
+        """Add the special tokens around the subword ids and labels of a sentence."""
+        ignored = [self.ignore_index]
+        return (
+            self.prefix_ids + input_ids + self.suffix_ids,
+            ignored * len(self.prefix_ids) + labels + ignored * len(self.suffix_ids),
+        )
@@ -0,0 +1,3 @@
+from .profiler import Profiler, count, get_profiler, profile, profiled, record, stage
+
+__all__ = ["Profiler", "count", "get_profiler", "profile", "profiled", "record", "stage"]
@@ -0,0 +1,168 @@
+import json
+import os
+import time
+import tracemalloc
+from collections import defaultdict
+from contextlib import contextmanager, nullcontext
+from functools import wraps
+from typing import Any, Callable, ContextManager, Dict, Iterator, List, Optional, Union
+
+# The profiler that hooks report to, if any. Checking this global is all the hooks do while profiling is disabled
+_active_profiler: Optional["Profiler"] = None
+_disabled_stage = nullcontext()
+
+
+class Profiler:
+    """Collects per-stage wall time, counters and gauges, and optionally peak memory, for one run.
+
+    Stages are timed around the hot paths of the library, e.g. `"extract"` or `"replace_entities"`, while counters
+    track e.g. the number of rows, entities and duplicates. Only the calling process is profiled, so work done in
+    worker processes with `num_proc > 1` is only reflected by the wall time of the stage that started them.
+
+    Args:
+        track_memory (bool): Whether to track the peak memory of every stage with `tracemalloc`, which slows down
+            allocations considerably. Defaults to False.
+    """
+
+    def __init__(self, track_memory: bool = False) -> None:
+        self.track_memory = track_memory
+        self.stages: Dict[str, Dict[str, float]] = defaultdict(lambda: {"calls": 0, "seconds": 0.0})
+        self.counters: Dict[str, int] = defaultdict(int)
+        self.gauges: Dict[str, Any] = {}
+        self.peak_memory: Optional[int] = None
+        # The peak memory of the running stages so far, as `tracemalloc` only tracks a single peak
+        self._memory_stack: List[int] = []
+        self._started_tracemalloc = False
+
+    def start(self) -> None:
+        if self.track_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._started_tracemalloc = True
+
+    def stop(self) -> None:
+        if self.track_memory and tracemalloc.is_tracing():
+            self.peak_memory = max(self.peak_memory or 0, tracemalloc.get_traced_memory()[1])
+            if self._started_tracemalloc:
+                tracemalloc.stop()
+                self._started_tracemalloc = False
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        """Time a stage, and with `track_memory`, record its peak memory. Stages may be nested."""
+        # Per-stage peaks require `tracemalloc.reset_peak`, i.e. Python 3.9 or later
+        track_memory = self.track_memory and tracemalloc.is_tracing() and hasattr(tracemalloc, "reset_peak")
+        if track_memory:
+            if self._memory_stack:
+                self._memory_stack[-1] = max(self._memory_stack[-1], tracemalloc.get_traced_memory()[1])
+            self._memory_stack.append(0)
+            tracemalloc.reset_peak()
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            stats = self.stages[name]
+            stats["calls"] += 1
+            stats["seconds"] += time.perf_counter() - start
+            if track_memory:
+                peak = max(self._memory_stack.pop(), tracemalloc.get_traced_memory()[1])
+                stats["peak_memory"] = max(stats.get("peak_memory", 0), peak)
+                if self._memory_stack:
+                    self._memory_stack[-1] = max(self._memory_stack[-1], peak)
+
+    def count(self, name: str, value: int = 1) -> None:
+        self.counters[name] += value
+
+    def record(self, name: str, value: Any) -> None:
+        self.gauges[name] = value
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Export the metrics, including the hit rates of both deduplication modes, as a JSON serializable dict."""
+        counters = dict(self.counters)
+        rates = {}
+        if counters.get("replace_entities.candidates"):
+            rates["deduplicate"] = (
+                counters.get("replace_entities.duplicates", 0) / counters["replace_entities.candidates"]
+            )
+        if counters.get("deduplicator.examples"):
+            rates["deduplicator"] = counters.get("deduplicator.duplicates", 0) / counters["deduplicator.examples"]
+        return {
+            "stages": {name: dict(stats) for name, stats in self.stages.items()},
+            "counters": counters,
+            "rates": rates,
+            "gauges": dict(self.gauges),
+            "peak_memory": self.peak_memory,
+        }
+
+    def to_json(self, path: Optional[Union[str, os.PathLike]] = None) -> str:
+        """Export the metrics as JSON, and write them to `path` if given."""
+        output = json.dumps(self.to_dict(), indent=2, default=str)
+        if path is not None:
+            with open(path, "w", encoding="utf-8") as f:
+                f.write(output)
+        return output
+
+
+@contextmanager
+def profile(track_memory: bool = False) -> Iterator[Profiler]:
+    """Profile everything that runs inside the context, e.g.:
+
+        with profile() as profiler:
+            augmented_dataset = EntitySwapAugmenter(dataset).augment(N=4)
+        print(profiler.to_json())
+
+    Args:
+        track_memory (bool): See `Profiler`. Defaults to False.
+
+    Yields:
+        Profiler: The profiler, which holds the metrics once the context exits.
+    """
+    global _active_profiler
+    previous_profiler = _active_profiler
+    profiler = Profiler(track_memory=track_memory)
+    _active_profiler = profiler
+    profiler.start()
+    try:
+        yield profiler
+    finally:
+        profiler.stop()
+        _active_profiler = previous_profiler
+
+
+def get_profiler() -> Optional[Profiler]:
+    """Return the active profiler, or None, e.g. to only compute a metric while profiling."""
+    return _active_profiler
+
+
+def stage(name: str) -> ContextManager[None]:
+    """Time a stage with the active profiler, or do nothing if profiling is disabled."""
+    if _active_profiler is None:
+        return _disabled_stage
+    return _active_profiler.stage(name)
+
+
+def count(name: str, value: int = 1) -> None:
+    """Increment a counter of the active profiler, if any."""
+    if _active_profiler is not None:
+        _active_profiler.count(name, value)
+
+
+def record(name: str, value: Any) -> None:
+    """Set a gauge of the active profiler, if any."""
+    if _active_profiler is not None:
+        _active_profiler.record(name, value)
+
+
+def profiled(name: str) -> Callable[[Callable], Callable]:
+    """Decorate a function, so every call is timed as stage `name` while profiling."""
+
+    def decorator(function: Callable) -> Callable:
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            if _active_profiler is None:
+                return function(*args, **kwargs)
+            with _active_profiler.stage(name):
+                return function(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
@@ -0,0 +1,136 @@
+import random
+from typing import TYPE_CHECKING, Dict, List, Tuple
+
+from datasets import ClassLabel, Dataset, Features, Sequence, Value
+
+if TYPE_CHECKING:
+    from spacy.tokens import DocBin
+
+# The tags of the begin, inside, last and unit tokens of an entity per labeling scheme, "none" uses the label itself
+SCHEME_TAGS = {
+    "IOB2": "BIIB",
+    "BIOES": "BIES",
+    "BILOU": "BILU",
+}
+SCHEMES = (*SCHEME_TAGS, "none")
+
+
+def generate_labels(num_labels: int = 4, scheme: str = "IOB2") -> List[str]:
+    """Return the label names of a synthetic corpus, e.g. `["O", "B-LABEL0", "I-LABEL0", ...]` for IOB2.
+
+    Args:
+        num_labels (int): The number of entity labels. Defaults to 4.
+        scheme (str): One of `"IOB2"`, `"BIOES"`, `"BILOU"` or `"none"`, i.e. no scheme. Defaults to `"IOB2"`.
+
+    Returns:
+        List[str]: The label names, starting with `"O"`.
+    """
+    if scheme not in SCHEMES:
+        raise ValueError(f"scheme must be one of {SCHEMES}, but got {scheme!r}.")
+    names = [f"LABEL{label}" for label in range(num_labels)]
+    if scheme == "none":
+        return ["O"] + names
+    return ["O"] + [f"{tag}-{name}" for name in names for tag in sorted(set(SCHEME_TAGS[scheme]), key="BIELSU".index)]
+
+
+def tag_entity(name: str, length: int, scheme: str) -> List[str]:
+    if scheme == "none":
+        return [name] * length
+    begin, inside, last, unit = SCHEME_TAGS[scheme]
+    if length == 1:
+        return [f"{unit}-{name}"]
+    return [f"{begin}-{name}"] + [f"{inside}-{name}"] * (length - 2) + [f"{last}-{name}"]
+
+
+def generate_examples(
+    num_sentences: int = 1000,
+    sentence_length: Tuple[int, int] = (5, 30),
+    entity_density: float = 0.1,
+    num_labels: int = 4,
+    kb_cardinality: int = 100,
+    max_entity_length: int = 3,
+    scheme: str = "IOB2",
+    vocab_size: int = 10_000,
+    seed: int = 0,
+) -> Dict[str, List]:
+    """Generate the tokens and label ids of a synthetic NER corpus.
+
+    Every token position starts an entity with probability `entity_density`, in which case one of the
+    `kb_cardinality` entities of a uniformly drawn label is inserted, and otherwise one of `vocab_size`
+    context words.
+
+    Args:
+        num_sentences (int): The number of sentences. Defaults to 1000.
+        sentence_length (Tuple[int, int]): The minimum and maximum number of tokens per sentence, although the last
+            entity of a sentence may exceed the maximum. Defaults to (5, 30).
+        entity_density (float): The probability that a token position starts an entity. Defaults to 0.1.
+        num_labels (int): The number of entity labels. Defaults to 4.
+        kb_cardinality (int): The number of unique entities per label. Defaults to 100.
+        max_entity_length (int): The maximum number of tokens per entity. Defaults to 3.
+        scheme (str): One of `"IOB2"`, `"BIOES"`, `"BILOU"` or `"none"`. Defaults to `"IOB2"`.
+        vocab_size (int): The number of unique context words. Defaults to 10,000.
+        seed (int): The seed of the generator, so the same arguments generate the same corpus. Defaults to 0.
+
+    Returns:
+        Dict[str, List]: The `"tokens"` and `"ner_tags"` of every sentence.
+    """
+    rng = random.Random(seed)
+    labels = generate_labels(num_labels, scheme)
+    label2id = {label: label_id for label_id, label in enumerate(labels)}
+    # e.g. ["Ent2x17a", "Ent2x17b"] is entity 17 of label 2
+    entities = [
+        [
+            [f"Ent{label}x{index}{chr(ord('a') + position)}" for position in range(rng.randint(1, max_entity_length))]
+            for index in range(kb_cardinality)
+        ]
+        for label in range(num_labels)
+    ]
+    entity_tags = [
+        {
+            length: [label2id[tag] for tag in tag_entity(f"LABEL{label}", length, scheme)]
+            for length in range(1, max_entity_length + 1)
+        }
+        for label in range(num_labels)
+    ]
+
+    examples = {"tokens": [], "ner_tags": []}
+    for _ in range(num_sentences):
+        length = rng.randint(*sentence_length)
+        tokens = []
+        ner_tags = []
+        while len(tokens) < length:
+            if num_labels and rng.random() < entity_density:
+                label = rng.randrange(num_labels)
+                entity = entities[label][rng.randrange(kb_cardinality)]
+                tokens += entity
+                ner_tags += entity_tags[label][len(entity)]
+            else:
+                tokens.append(f"w{rng.randrange(vocab_size)}")
+                ner_tags.append(0)
+        examples["tokens"].append(tokens)
+        examples["ner_tags"].append(ner_tags)
+    return examples
+
+
+def generate_dataset(num_labels: int = 4, scheme: str = "IOB2", **kwargs) -> Dataset:
+    """Generate a synthetic NER corpus as a `Dataset`, see `generate_examples` for the arguments."""
+    features = Features(
+        {
+            "tokens": Sequence(feature=Value(dtype="string")),
+            "ner_tags": Sequence(feature=ClassLabel(names=generate_labels(num_labels, scheme))),
+        }
+    )
+    return Dataset.from_dict(
+        generate_examples(num_labels=num_labels, scheme=scheme, **kwargs),
+        features=features,
+    )
+
+
+def generate_docbin(num_labels: int = 4, scheme: str = "IOB2", **kwargs) -> "DocBin":
+    """Generate a synthetic NER corpus as a spaCy `DocBin`, see `generate_examples` for the arguments.
+
+    The entities of the docs carry the label names without scheme prefixes, e.g. `"LABEL0"`.
+    """
+    from adept_augmentations.utils import convert_dataset_to_docbin
+
+    return convert_dataset_to_docbin(generate_dataset(num_labels=num_labels, scheme=scheme, **kwargs))
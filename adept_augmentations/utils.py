@@ -1,88 +1,325 @@
-from datasets import ClassLabel, Dataset, Features, Sequence, Value
-from spacy.tokens import Doc, DocBin
-from spacy.vocab import Vocab
+import os
+import queue
+import sys
+from pathlib import Path
+from typing import TYPE_CHECKING, Any, List, Optional, Union
 
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+from datasets import ClassLabel, Dataset, DatasetInfo, Features, Sequence, Value
+from datasets.fingerprint import generate_random_fingerprint
 
-def convert_docbin_to_dataset(doc_bin: DocBin, labels=None) -> Dataset:
+from adept_augmentations.augmenters.extractors import (
+    EntityExtractor,
+    LabelScheme,
+    flatten_list_array,
+)
+from adept_augmentations.profilers import count, profiled
+
+# spaCy is only imported by the functions that handle `DocBin`s, so working with datasets alone doesn't import it
+if TYPE_CHECKING:
+    from spacy.tokens import Doc, DocBin
+    from spacy.vocab import Vocab
+
+
+def is_docbin(obj: Any) -> bool:
+    """Check whether `obj` is a spaCy `DocBin` without importing spaCy, as no `DocBin` exists before it is imported."""
+    spacy_tokens = sys.modules.get("spacy.tokens")
+    return spacy_tokens is not None and isinstance(obj, spacy_tokens.DocBin)
+
+
+@profiled("convert_docbin_to_dataset")
+def convert_docbin_to_dataset(
+    doc_bin: "DocBin",
+    labels=None,
+    batch_size: int = 1000,
+    cache_file_name: Optional[Union[str, os.PathLike]] = None,
+) -> Dataset:
     """
     This function converts a spaCy DocBin object into a dataset, with optional labels.
 
+    The token attribute arrays and the string table that the DocBin stores are read directly, in one pass and
+    batch by batch, so no `Doc` objects are created and only one batch of Python strings is alive at a time.
+
     Args:
       doc_bin (DocBin): The `doc_bin` parameter is a `DocBin` object, which is a container for storing
     spaCy `Doc` objects in a binary format. This is often used for efficient serialization and
     deserialization of large amounts of text data.
       labels: The `labels` parameter is an optional argument that can be passed to the function
     `convert_docbin_to_dataset()`. It is used to specify the labels for the data in the `DocBin` object.
-    If `labels` is not provided, the function will assume that the labels are already present
+    If `labels` is not provided, the entity labels are discovered in order of first occurrence.
+      batch_size (int): The number of docs that are converted at once. Defaults to 1000.
+      cache_file_name (Optional[Union[str, os.PathLike]]): If set, the batches are written to this Arrow file,
+    which the dataset is memory-mapped from, rather than kept in memory. Defaults to None.
     """
-    vocab = Vocab()
+    from spacy.attrs import ENT_TYPE, ORTH
+    from spacy.strings import get_string_id
 
-    unique_labels = set()
-    if labels is None:
-        docs = doc_bin.get_docs(vocab)
-        for doc in docs:
-            for ent in doc.ents:
-                unique_labels.add(ent.label_)
-        labels = list(unique_labels)
+    orth_column = doc_bin.attrs.index(ORTH)
+    # e.g. a DocBin that was created without entity attributes
+    ent_type_column = doc_bin.attrs.index(ENT_TYPE) if ENT_TYPE in doc_bin.attrs else None
+    strings = {get_string_id(string): string for string in doc_bin.strings}
 
-    labels = ["O"] + list(labels)
+    discover_labels = labels is None
+    labels = ["O"] + list(labels or [])
     label2id = {label: i for i, label in enumerate(labels)}
-    features = {
-        "tokens": Sequence(feature=Value(dtype="string")),
-        "ner_tags": Sequence(feature=ClassLabel(names=labels)),
-    }
+    # Maps the hashes of the entity types to label ids, with the empty string, i.e. no entity, as "O"
+    hash2id = {0: 0}
+    schema = pa.schema([("tokens", pa.list_(pa.string())), ("ner_tags", pa.list_(pa.int64()))])
 
-    datasets_dict = {"tokens": [], "ner_tags": []}
-    for doc in doc_bin.get_docs(vocab):
-        datasets_dict["tokens"].append([token.text for token in doc])
-        datasets_dict["ner_tags"].append([label2id.get(token.ent_type_, "O") for token in doc])
+    def convert_batch(arrays: List[np.ndarray]) -> pa.Table:
+        count("convert_docbin_to_dataset.rows", len(arrays))
+        offsets = np.zeros(len(arrays) + 1, dtype=np.int32)
+        np.cumsum([len(array) for array in arrays], out=offsets[1:])
+        flat = np.concatenate(arrays) if arrays else np.zeros((0, len(doc_bin.attrs)), dtype=np.uint64)
 
-    converted_dataset = Dataset.from_dict(mapping=datasets_dict, features=Features(features))
+        # Only the unique strings of the batch are looked up, and gathered into the column with one `take`
+        orths, orth_indices = np.unique(flat[:, orth_column], return_inverse=True)
+        tokens = pa.array([strings[orth] for orth in orths.tolist()], type=pa.string()).take(orth_indices)
 
-    return converted_dataset
+        if ent_type_column is None:
+            ner_tags = np.zeros(len(flat), dtype=np.int64)
+        else:
+            ent_types, first_indices, ent_type_indices = np.unique(
+                flat[:, ent_type_column], return_index=True, return_inverse=True
+            )
+            for ent_type in ent_types[np.argsort(first_indices)].tolist():
+                if ent_type not in hash2id:
+                    label = strings[ent_type]
+                    if discover_labels and label not in label2id:
+                        label2id[label] = len(labels)
+                        labels.append(label)
+                    hash2id[ent_type] = label2id.get(label, 0)
+            ner_tags = np.array([hash2id[ent_type] for ent_type in ent_types.tolist()], dtype=np.int64)
+            ner_tags = ner_tags[ent_type_indices]
 
+        return pa.Table.from_arrays(
+            [pa.ListArray.from_arrays(offsets, tokens), pa.ListArray.from_arrays(offsets, ner_tags)], schema=schema
+        )
 
-def convert_dataset_to_docbin(dataset: Dataset) -> DocBin:
-    vocab = Vocab()
-    label_list = dataset.features["ner_tags"].feature.names
-    id2label = {i: label for i, label in enumerate(label_list)}
-
-    def get_doc_from_entry(tokens: list, ner_tags: list) -> Doc:
-        """
-        This function takes in a list of tokens and named entity recognition tags, and returns a spaCy
-        Doc object with BILUO labels for the entity types.
-
-        Args:
-          tokens (list): a list of strings representing the words in a sentence
-          ner_tags (list): The `ner_tags` parameter is a list of named entity recognition tags assigned
-        to each token in the `tokens` list. These tags indicate whether a token is part of a named
-        entity and, if so, what type of entity it is (e.g. person, organization, location, etc.).
-
-        Returns:
-          a spaCy `Doc` object with the input tokens and named entity recognition (NER) tags converted
-        to BILUO labels. The function also removes any entities with the label "O" (which means they
-        were not recognized as named entities).
-        """
-
-        # Define the BILUO labels for the entity types
-        biluo_labels = []
-        prev_label = None
-        for label in ner_tags:
-            if label != "O":
-                label = id2label[label]
-                if prev_label != label:
-                    biluo_labels.append("B-" + str(label))
-                else:
-                    biluo_labels.append("I-" + str(label))
-            else:
-                biluo_labels.append(None)
-            prev_label = label
-        doc = Doc(vocab, words=tokens, ents=biluo_labels)
-        doc.ents = [ent for ent in doc.ents if ent.label_ != "O"]
-        return doc
+    batches = (
+        convert_batch(doc_bin.tokens[start : start + batch_size])
+        for start in range(0, len(doc_bin.tokens), batch_size)
+    )
+    if cache_file_name is not None:
+        with pa.ipc.new_stream(str(cache_file_name), schema) as writer:
+            for batch in batches:
+                writer.write_table(batch)
+    else:
+        table = pa.concat_tables([schema.empty_table(), *batches])
 
-    doc_bin = DocBin()
-    for entry in dataset:
-        doc_bin.add(get_doc_from_entry(entry["tokens"], entry["ner_tags"]))
+    # New labels are only ever appended, so the label ids of earlier batches stay valid
+    features = Features(
+        {
+            "tokens": Sequence(feature=Value(dtype="string")),
+            "ner_tags": Sequence(feature=ClassLabel(names=labels)),
+        }
+    )
+    if cache_file_name is not None:
+        return Dataset.from_file(str(cache_file_name), info=DatasetInfo(features=features))
+    return Dataset(table, info=DatasetInfo(features=features))
+
+
+def convert_batch_to_docs(
+    batch: pa.Table, vocab: "Vocab", entity_extractor: EntityExtractor, label_column: str = "ner_tags"
+) -> List["Doc"]:
+    """Create a spaCy `Doc` for every row of an Arrow batch, with the entities found by `entity_extractor`.
+
+    Args:
+        batch (pa.Table): A batch with `tokens` and `label_column` columns.
+        vocab (Vocab): The vocabulary of the docs.
+        entity_extractor (EntityExtractor): The extractor for the labels of `label_column`.
+        label_column (str): The column with the label ids. Defaults to "ner_tags".
+
+    Returns:
+        List[Doc]: The docs, with the reduced labels, e.g. `"PER"` rather than `"B-PER"`, as entity labels.
+    """
+    from spacy.tokens import Doc, Span
+
+    ner_tags, offsets = flatten_list_array(batch.column(label_column))
+    labels, starts, ends, entity_offsets = entity_extractor.extract_batch(ner_tags, offsets)
+    entity_labels = [entity_extractor.reduced_labels[label] for label in labels.tolist()]
+    starts = starts.tolist()
+    ends = ends.tolist()
+    entity_offsets = entity_offsets.tolist()
+
+    docs = []
+    for row, tokens in enumerate(batch.column("tokens").to_pylist()):
+        doc = Doc(vocab, words=tokens)
+        doc.ents = [
+            Span(doc, starts[entity], ends[entity], entity_labels[entity])
+            for entity in range(entity_offsets[row], entity_offsets[row + 1])
+        ]
+        docs.append(doc)
+    return docs
+
+
+@profiled("convert_dataset_to_docbin")
+def convert_dataset_to_docbin(dataset: Dataset, label_column: str = "ner_tags", batch_size: int = 1000) -> "DocBin":
+    """Convert a dataset into a single in-memory spaCy DocBin, see `write_docbin_shards` for large datasets.
+
+    Args:
+        dataset (Dataset): The dataset, with `tokens` and `label_column` columns.
+        label_column (str): The column with the label ids. Defaults to "ner_tags".
+        batch_size (int): The number of rows that are converted at once. Defaults to 1000.
 
+    Returns:
+        DocBin: The docs of all rows.
+    """
+    from spacy.tokens import DocBin
+    from spacy.vocab import Vocab
+
+    vocab = Vocab()
+    _, entity_extractor = LabelScheme.from_labels(dataset.features[label_column].feature.names)
+    doc_bin = DocBin()
+    for batch in dataset.with_format("arrow").iter(batch_size):
+        count("convert_dataset_to_docbin.rows", batch.num_rows)
+        for doc in convert_batch_to_docs(batch, vocab, entity_extractor, label_column):
+            doc_bin.add(doc)
     return doc_bin
+
+
+@profiled("write_docbin_shards")
+def write_docbin_shards(
+    dataset: Dataset,
+    path: Union[str, os.PathLike],
+    label_column: str = "ner_tags",
+    shard_size: int = 10_000,
+    num_proc: Optional[int] = None,
+) -> List[Path]:
+    """Convert a dataset into `.spacy` files of at most `shard_size` docs each, using `num_proc` processes.
+
+    Every shard is built and written by the process that converts it, so memory usage is bounded by the shard
+    size rather than by the size of the dataset.
+
+    Args:
+        dataset (Dataset): The dataset, with `tokens` and `label_column` columns.
+        path (Union[str, os.PathLike]): The directory to write the shards to.
+        label_column (str): The column with the label ids. Defaults to "ner_tags".
+        shard_size (int): The maximum number of docs per shard. Defaults to 10,000.
+        num_proc (Optional[int]): The number of processes to convert with. Defaults to None, i.e. no
+            multiprocessing.
+
+    Returns:
+        List[Path]: The paths of the written shards, in dataset order. The file names hold the index of the
+        first row of the shard, so they sort in the same order.
+    """
+    Path(path).mkdir(parents=True, exist_ok=True)
+    _, entity_extractor = LabelScheme.from_labels(dataset.features[label_column].feature.names)
+
+    def write_shard(batch: pa.Table, indices: List[int]) -> pa.Table:
+        from spacy.tokens import DocBin
+        from spacy.vocab import Vocab
+
+        shard_path = Path(path) / f"data-{indices[0]:012d}.spacy"
+        DocBin(docs=convert_batch_to_docs(batch, Vocab(), entity_extractor, label_column)).to_disk(shard_path)
+        return pa.table({"path": [str(shard_path)]})
+
+    shards = dataset.with_format("arrow").map(
+        write_shard,
+        batched=True,
+        batch_size=shard_size,
+        with_indices=True,
+        remove_columns=dataset.column_names,
+        load_from_cache_file=False,
+        new_fingerprint=generate_random_fingerprint(),
+        num_proc=num_proc,
+    )
+    count("write_docbin_shards.rows", len(dataset))
+    return [Path(shard_path) for shard_path in shards.with_format(None)["path"]]
+
+
+class DocBinWriter:
+    """Writer for `write_shards` that converts Arrow tables with `tokens` and label columns into a `.spacy` file."""
+
+    def __init__(self, path: Union[str, os.PathLike], schema: pa.Schema) -> None:
+        from spacy.tokens import DocBin
+        from spacy.vocab import Vocab
+
+        self.path = path
+        features = Features.from_arrow_schema(schema)
+        self.label_column = next(column for column in features if column != "tokens")
+        _, self.entity_extractor = LabelScheme.from_labels(features[self.label_column].feature.names)
+        self.vocab = Vocab()
+        self.doc_bin = DocBin()
+
+    def write_table(self, table: pa.Table) -> None:
+        for doc in convert_batch_to_docs(table, self.vocab, self.entity_extractor, self.label_column):
+            self.doc_bin.add(doc)
+
+    def close(self) -> None:
+        self.doc_bin.to_disk(self.path)
+
+
+def write_arrow_file(dataset: Dataset, path: Union[str, os.PathLike], batch_size: int = 10_000) -> Path:
+    """Write a dataset to one file in the Arrow streaming format used by `datasets`, which `Dataset.from_file`
+    memory-maps with the features of the dataset.
+
+    Args:
+        dataset (Dataset): The dataset to write.
+        path (Union[str, os.PathLike]): The file to write to.
+        batch_size (int): The number of rows that are written at once. Defaults to 10,000.
+
+    Returns:
+        Path: The path of the written file.
+    """
+    schema = dataset.features.arrow_schema
+    with pa.ipc.new_stream(str(path), schema) as writer:
+        for batch in dataset.with_format("arrow").iter(batch_size):
+            writer.write_table(batch.cast(schema))
+    return Path(path)
+
+
+def write_shards(
+    tables: queue.Queue, path: Union[str, os.PathLike], schema: pa.Schema, shard_size: int, file_format: str
+) -> List[Path]:
+    """Write the tables from a queue into Parquet or Arrow shards of at most `shard_size` rows each.
+
+    Meant to run on a writer thread: the tables are consumed until `None` is received, so only the
+    tables in the queue and the open shard's buffers are held in memory, regardless of the output size.
+
+    Args:
+        tables (queue.Queue): The queue of `pa.Table` instances to write, terminated by `None`.
+        path (Union[str, os.PathLike]): The directory to write the shards to.
+        schema (pa.Schema): The schema of the tables, e.g. from `Features.arrow_schema`, so the
+            features are restored when loading the shards with `datasets`.
+        shard_size (int): The maximum number of rows per shard.
+        file_format (str): Either `"parquet"`, `"arrow"`, i.e. the Arrow streaming format used by
+            `datasets`, or `"spacy"`, i.e. a `DocBin`.
+
+    Returns:
+        List[Path]: The paths of the written shards, of which there is at least one.
+    """
+    paths = []
+    writer = None
+    rows_in_shard = 0
+
+    def open_shard():
+        paths.append(Path(path) / f"data-{len(paths):05d}.{file_format}")
+        if file_format == "parquet":
+            return pq.ParquetWriter(paths[-1], schema)
+        if file_format == "spacy":
+            return DocBinWriter(paths[-1], schema)
+        return pa.ipc.new_stream(str(paths[-1]), schema)
+
+    try:
+        while (table := tables.get()) is not None:
+            offset = 0
+            while offset < table.num_rows:
+                if writer is None:
+                    writer = open_shard()
+                    rows_in_shard = 0
+                chunk = table.slice(offset, shard_size - rows_in_shard)
+                writer.write_table(chunk)
+                offset += chunk.num_rows
+                rows_in_shard += chunk.num_rows
+                if rows_in_shard >= shard_size:
+                    writer.close()
+                    writer = None
+        if not paths:
+            writer = open_shard()
+    finally:
+        if writer is not None:
+            writer.close()
+    return paths
@@ -0,0 +1,181 @@
+"""Benchmark the augmenter and the converters on synthetic corpora, fully offline.
+
+Every benchmark is run once to measure its throughput, and once more with `tracemalloc` to measure its peak memory,
+as tracing slows down allocations. The import time of the package is measured in fresh interpreters, along with the
+heavy dependencies that every import pulls in. The results are printed, and written as JSON to compare releases, e.g.:
+
+    python benchmarks/run_benchmarks.py --sentences 10000 --output benchmarks-0.1.json
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+from typing import Any, Callable, Dict, List
+
+from adept_augmentations import Deduplicator, EntitySwapAugmenter, SentenceCropAugmenter
+from adept_augmentations.synthetic import SCHEMES, generate_dataset
+from adept_augmentations.utils import (
+    convert_dataset_to_docbin,
+    convert_docbin_to_dataset,
+)
+
+IMPORT_STATEMENTS = (
+    "import adept_augmentations",
+    "from adept_augmentations import EntitySwapAugmenter",
+    "from adept_augmentations.augmenters.spacy_augmenter import create_entity_swap_augmenter",
+)
+# Runs in a fresh interpreter, so the import time includes that of every module the statement pulls in
+IMPORT_SCRIPT = """
+import json, sys, time
+start = time.perf_counter()
+{statement}
+seconds = time.perf_counter() - start
+print(json.dumps({{"seconds": seconds, "modules": [name for name in ("datasets", "spacy") if name in sys.modules]}}))
+"""
+
+
+def measure_import(statement: str, repeats: int = 3) -> Dict[str, Any]:
+    """Measure the fastest of `repeats` imports in fresh interpreters, as the first one may have to warm up caches."""
+    # Resolve the package in the subprocesses exactly like in this one
+    env = {**os.environ, "PYTHONPATH": os.pathsep.join(path for path in sys.path if path)}
+    runs = []
+    for _ in range(repeats):
+        output = subprocess.run(
+            [sys.executable, "-c", IMPORT_SCRIPT.format(statement=statement)],
+            capture_output=True,
+            check=True,
+            text=True,
+            env=env,
+        ).stdout
+        runs.append(json.loads(output.strip().splitlines()[-1]))
+    result = {
+        "name": f"import/{statement}",
+        "seconds": min(run["seconds"] for run in runs),
+        "modules": runs[0]["modules"],
+    }
+    print(
+        f"{result['name']:<40} {result['seconds'] * 1000:>12,.1f} ms    imports {', '.join(result['modules']) or '-'}"
+    )
+    return result
+
+
+def measure(name: str, function: Callable[[], Any], num_rows: int, track_memory: bool = True) -> Dict[str, Any]:
+    start = time.perf_counter()
+    function()
+    seconds = time.perf_counter() - start
+    result = {"name": name, "rows": num_rows, "seconds": seconds, "rows_per_second": num_rows / max(seconds, 1e-9)}
+    if track_memory:
+        tracemalloc.start()
+        try:
+            function()
+            result["peak_memory"] = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+    print(
+        f"{name:<40} {result['rows_per_second']:>12,.0f} rows/s"
+        + (f" {result['peak_memory'] / 2**20:>10.1f} MiB" if track_memory else "")
+    )
+    return result
+
+
+def run_benchmarks(
+    num_sentences: int,
+    Ns: List[int],
+    schemes: List[str],
+    track_memory: bool = True,
+    import_repeats: int = 3,
+    **corpus_kwargs,
+) -> Dict[str, Any]:
+    imports = [measure_import(statement, import_repeats) for statement in IMPORT_STATEMENTS]
+    results = []
+    for scheme in schemes:
+        dataset = generate_dataset(num_sentences=num_sentences, scheme=scheme, **corpus_kwargs)
+        # Don't reuse the cached extraction of the previous run
+        results.append(
+            measure(
+                f"{scheme}/construction",
+                lambda: EntitySwapAugmenter(dataset, load_from_cache_file=False),
+                num_sentences,
+                track_memory,
+            )
+        )
+        augmenter = EntitySwapAugmenter(dataset, load_from_cache_file=False)
+        for N in Ns:
+            results.append(
+                measure(f"{scheme}/augment/N={N}", lambda: augmenter.augment(N=N, seed=0), num_sentences, track_memory)
+            )
+            results.append(
+                measure(
+                    f"{scheme}/augment/N={N}/deduplicator",
+                    lambda: augmenter.augment(N=N, seed=0, deduplicator=Deduplicator()),
+                    num_sentences,
+                    track_memory,
+                )
+            )
+        cropper = SentenceCropAugmenter(dataset)
+        results.append(
+            measure(f"{scheme}/crop/max_length=8", lambda: cropper.augment(max_length=8), num_sentences, track_memory)
+        )
+        results.append(
+            measure(
+                f"{scheme}/convert_dataset_to_docbin",
+                lambda: convert_dataset_to_docbin(dataset),
+                num_sentences,
+                track_memory,
+            )
+        )
+        doc_bin = convert_dataset_to_docbin(dataset)
+        results.append(
+            measure(
+                f"{scheme}/convert_docbin_to_dataset",
+                lambda: convert_docbin_to_dataset(doc_bin),
+                num_sentences,
+                track_memory,
+            )
+        )
+    return {
+        "python": platform.python_version(),
+        "sentences": num_sentences,
+        "corpus": corpus_kwargs,
+        "imports": imports,
+        "results": results,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sentences", type=int, default=10_000, help="The number of sentences per corpus.")
+    parser.add_argument("--N", type=int, nargs="+", default=[1, 4, 16], help="The values of N to augment with.")
+    parser.add_argument("--schemes", nargs="+", default=list(SCHEMES), choices=SCHEMES)
+    parser.add_argument("--num-labels", type=int, default=4)
+    parser.add_argument("--kb-cardinality", type=int, default=1000, help="The number of unique entities per label.")
+    parser.add_argument("--entity-density", type=float, default=0.1)
+    parser.add_argument("--min-length", type=int, default=5, help="The minimum number of tokens per sentence.")
+    parser.add_argument("--max-length", type=int, default=30, help="The maximum number of tokens per sentence.")
+    parser.add_argument("--no-memory", action="store_true", help="Skip measuring the peak memory.")
+    parser.add_argument("--import-repeats", type=int, default=3, help="The number of times to measure every import.")
+    parser.add_argument("--output", help="The JSON file to write the results to.")
+    args = parser.parse_args()
+
+    report = run_benchmarks(
+        args.sentences,
+        args.N,
+        args.schemes,
+        track_memory=not args.no_memory,
+        import_repeats=args.import_repeats,
+        num_labels=args.num_labels,
+        kb_cardinality=args.kb_cardinality,
+        entity_density=args.entity_density,
+        sentence_length=(args.min_length, args.max_length),
+    )
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
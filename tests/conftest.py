@@ -3,7 +3,7 @@ from typing import List
 import datasets
 import pytest
 import spacy
-from datasets import ClassLabel, Dataset, Sequence, load_dataset
+from datasets import ClassLabel, Dataset, Features, Sequence, Value, load_dataset
 from spacy.tokens import DocBin
 from spacy.training import iob_to_biluo
 
@@ -21,6 +21,38 @@ def conll03_tiny() -> Dataset:
     return load_dataset("conll2003", split="train[:100]")
 
 
+@pytest.fixture(scope="session")
+def iob_offline_tiny() -> Dataset:
+    # an IOB2 dataset that does not need to be downloaded
+    features = Features(
+        {
+            "tokens": Sequence(feature=Value(dtype="string")),
+            "ner_tags": Sequence(feature=ClassLabel(names=CONLL_LABELS)),
+        }
+    )
+    return Dataset.from_dict(
+        {
+            "tokens": [
+                ["EU", "rejects", "German", "call", "to", "boycott", "British", "lamb", "."],
+                ["Peter", "Blackburn"],
+                ["BRUSSELS", "1996-08-22"],
+                ["The", "European", "Commission", "said", "on", "Thursday", "."],
+                ["Germany", "'s", "representative", "to", "the", "European", "Union", "Werner", "Zwingmann"],
+                ["It", "rained", "."],
+            ],
+            "ner_tags": [
+                [3, 0, 7, 0, 0, 0, 7, 0, 0],
+                [1, 2],
+                [5, 0],
+                [0, 3, 4, 0, 0, 0, 0],
+                [5, 0, 0, 0, 0, 3, 4, 1, 2],
+                [0, 0, 0],
+            ],
+        },
+        features=features,
+    )
+
+
 @pytest.fixture(scope="session")
 def bilou_conll03_tiny(conll03_tiny: Dataset) -> Dataset:
     def iob_to_bilou(iob_label_ids: List[int]) -> List[int]:
@@ -0,0 +1,72 @@
+import json
+
+import pytest
+
+from adept_augmentations import Analyzer, EntitySwapAugmenter
+from adept_augmentations.analyzers.analyzer import expected_unique_draws
+from adept_augmentations.synthetic import SCHEMES, generate_dataset
+
+
+def test_analyzer(iob_offline_tiny) -> None:
+    for batch_size in (1, 4, 1000):
+        analyzer = Analyzer(iob_offline_tiny, batch_size=batch_size)
+        assert analyzer.num_rows == 6
+        assert analyzer.num_tokens == sum(len(tokens) for tokens in iob_offline_tiny["tokens"])
+        labels = {analyzer.reduced_labels[label]: label for label in analyzer.entity_labels}
+        assert sorted(labels) == ["LOC", "MISC", "ORG", "PER"]
+        assert {label: analyzer.num_entities(label_id) for label, label_id in labels.items()} == {
+            "LOC": 2,
+            "MISC": 2,
+            "ORG": 3,
+            "PER": 2,
+        }
+        assert {label: analyzer.num_unique_entities(label_id) for label, label_id in labels.items()} == {
+            "LOC": 2,
+            "MISC": 2,
+            "ORG": 3,
+            "PER": 2,
+        }
+        # e.g. the first row has one ORG and two MISC entities
+        assert analyzer.num_combinations() == {1: 1, 2: 2, 3: 1, 12: 2}
+
+    report = analyzer.to_dict(Ns=(1, 4))
+    assert json.loads(json.dumps(report))
+    assert report["rows_without_entities"] == 1
+    assert report["labels"]["ORG"]["entity_lengths"] == [0, 1, 2]
+    assert report["combinations"] == {"min": 1, "median": 2, "max": 12}
+    assert report["expected_unique_augmentations"][1] == 1.0
+
+
+def test_analyzer_knowledge_base(iob_offline_tiny) -> None:
+    analyzer = Analyzer(iob_offline_tiny)
+    knowledge_base = EntitySwapAugmenter(iob_offline_tiny).knowledge_base
+    assert Analyzer(iob_offline_tiny, knowledge_base=knowledge_base).to_dict() == analyzer.to_dict()
+
+    # Streamed examples, with labels that are missing from the knowledge base, are only kept as is
+    examples = zip(iob_offline_tiny["tokens"], iob_offline_tiny["ner_tags"])
+    knowledge_base = EntitySwapAugmenter(iob_offline_tiny.select([1, 4])).knowledge_base
+    analyzer = Analyzer(examples, labels=analyzer.labels, knowledge_base=knowledge_base)
+    assert analyzer.num_combinations() == {1: 4, 2: 2}
+
+
+@pytest.mark.parametrize("scheme", SCHEMES)
+def test_analyzer_schemes(scheme: str) -> None:
+    dataset = generate_dataset(num_sentences=500, num_labels=3, kb_cardinality=20, scheme=scheme)
+    analyzer = Analyzer(dataset, batch_size=128)
+    augmenter = EntitySwapAugmenter(dataset)
+    assert [analyzer.num_unique_entities(label) for label in augmenter.knowledge_base.labels] == [
+        augmenter.knowledge_base.num_entities(label) for label in augmenter.knowledge_base.labels
+    ]
+    assert sum(analyzer.num_entities(label) for label in analyzer.entity_labels) == (
+        augmenter.entity_spans.num_entities
+    )
+    # The expected number of unique augmentations per row is close to the actual number
+    num_augmented = sum(len(augmenter.augment(N=4, seed=seed)) for seed in range(4)) / 4
+    assert analyzer.expected_unique_augmentations(4) == pytest.approx(num_augmented / len(dataset), rel=0.05)
+
+
+def test_expected_unique_draws() -> None:
+    assert expected_unique_draws(1, 10) == 1.0
+    assert expected_unique_draws(2, 1) == pytest.approx(1.0)
+    assert expected_unique_draws(2, 2) == pytest.approx(1.5)
+    assert expected_unique_draws(10**40, 16) == pytest.approx(16)
@@ -1,8 +1,26 @@
+import math
+import threading
 from typing import List, Optional
 
+import datasets
 import pytest
+from datasets import (
+    ClassLabel,
+    Dataset,
+    IterableDataset,
+    Sequence,
+    concatenate_datasets,
+)
 
-from adept_augmentations import EntitySwapAugmenter
+from adept_augmentations import (
+    Deduplicator,
+    EntitySwapAugmenter,
+    KnowledgeBaseSwapAugmenter,
+)
+from adept_augmentations.augmenters.knowledge_base import (
+    KnowledgeBase,
+    build_gazetteer_knowledge_base,
+)
 from tests.constants import (
     BILOU_CONLL_LABELS,
     CONLL_LABELS,
@@ -37,3 +55,382 @@ def test_augmenter_zero(conll03_tiny) -> None:
     augmenter = EntitySwapAugmenter(conll03_tiny, labels=CONLL_LABELS)
     augmented_ds = augmenter.augment(N=0, deduplicate=False)
     assert len(augmented_ds) == 0
+
+
+def test_augmenter_num_proc(iob_offline_tiny) -> None:
+    augmenter = EntitySwapAugmenter(iob_offline_tiny)
+    multi_proc_augmenter = EntitySwapAugmenter(iob_offline_tiny, num_proc=2)
+    assert multi_proc_augmenter.entity_spans.to_list() == augmenter.entity_spans.to_list()
+    for label in augmenter.knowledge_base.labels:
+        num_entities = augmenter.knowledge_base.num_entities(label)
+        assert multi_proc_augmenter.knowledge_base.num_entities(label) == num_entities
+        for index in range(num_entities):
+            assert multi_proc_augmenter.knowledge_base.get(label, index) == augmenter.knowledge_base.get(label, index)
+
+    augmented_ds = multi_proc_augmenter.augment(N=3, deduplicate=False, num_proc=2)
+    assert len(augmented_ds) == len(iob_offline_tiny) * 3
+
+
+class PickleRecordingAugmenter(EntitySwapAugmenter):
+    pickled_attributes: List[set] = []
+
+    def __getstate__(self) -> dict:
+        self.pickled_attributes.append(set(self.__dict__))
+        return self.__dict__
+
+
+def test_augmenter_num_proc_pickling(iob_offline_tiny) -> None:
+    # The workers extracting the entities don't receive a copy of the dataset or of a knowledge base
+    augmenter = PickleRecordingAugmenter(iob_offline_tiny, num_proc=2, load_from_cache_file=False)
+    assert len(augmenter.pickled_attributes) == 2
+    for attributes in augmenter.pickled_attributes:
+        assert not attributes & {"dataset", "entity_spans", "knowledge_base"}
+
+    # Extracting a shard returns a new knowledge base rather than replacing that of the augmenter
+    knowledge_base = augmenter.knowledge_base
+    entity_spans, shard_knowledge_base = augmenter.extract_shard(iob_offline_tiny)
+    assert augmenter.knowledge_base is knowledge_base
+    assert shard_knowledge_base is not knowledge_base
+    assert entity_spans.to_list() == augmenter.entity_spans.to_list()
+
+
+def test_augmenter_shard_and_merge(iob_offline_tiny, tmp_path) -> None:
+    expected = EntitySwapAugmenter(iob_offline_tiny).augment(N=3, seed=12)
+
+    # Build and save a partial knowledge base per shard, e.g. on separate nodes
+    num_shards = 3
+    shards = [iob_offline_tiny.shard(num_shards, index, contiguous=True) for index in range(num_shards)]
+    for index, shard in enumerate(shards):
+        EntitySwapAugmenter(shard).knowledge_base.save(tmp_path / f"kb-{index}")
+    knowledge_base = KnowledgeBase.merge(KnowledgeBase.load(tmp_path / f"kb-{index}") for index in range(num_shards))
+
+    augmented_shards = []
+    index_offset = 0
+    for shard in shards:
+        augmenter = EntitySwapAugmenter(shard, knowledge_base=knowledge_base)
+        augmented_shards.append(augmenter.augment(N=3, seed=12, index_offset=index_offset))
+        index_offset += len(shard)
+    augmented_ds = concatenate_datasets(augmented_shards)
+    assert augmented_ds["tokens"] == expected["tokens"]
+    assert augmented_ds["ner_tags"] == expected["ner_tags"]
+
+
+def test_augmenter_streaming(iob_offline_tiny) -> None:
+    iterable_dataset = iob_offline_tiny.to_iterable_dataset()
+    augmenter = EntitySwapAugmenter(iterable_dataset)
+    assert augmenter.streaming
+    expected = EntitySwapAugmenter(iob_offline_tiny).augment(N=3, seed=5)
+
+    augmented_ds = augmenter.augment(N=3, seed=5)
+    assert isinstance(augmented_ds, IterableDataset)
+    assert augmented_ds.features == expected.features
+    assert [example["tokens"] for example in augmented_ds] == expected["tokens"]
+
+    # A generator can only be iterated over once, so the examples to augment are passed separately
+    def pairs():
+        yield from zip(iob_offline_tiny["tokens"], iob_offline_tiny["ner_tags"])
+
+    augmenter = EntitySwapAugmenter(pairs(), labels=CONLL_LABELS)
+    with pytest.raises(ValueError):
+        next(augmenter.augment_iter(N=3))
+    with pytest.raises(ValueError, match="augment_iter"):
+        augmenter.augment(N=3)
+    augmented_examples = list(augmenter.augment_iter(N=3, seed=5, examples=pairs()))
+    assert [example["ner_tags"] for example in augmented_examples] == expected["ner_tags"]
+
+    # Other iterables are neither pickled nor hashed, which e.g. an open file or a database cursor can't be
+    augmenter = EntitySwapAugmenter(UnpicklablePairs(iob_offline_tiny), labels=CONLL_LABELS)
+    augmented_ds = augmenter.augment(N=3, seed=5)
+    assert [example["tokens"] for example in augmented_ds] == expected["tokens"]
+
+
+class UnpicklablePairs:
+    def __init__(self, dataset: Dataset) -> None:
+        self.dataset = dataset
+
+    def __iter__(self):
+        return zip(self.dataset["tokens"], self.dataset["ner_tags"])
+
+    def __reduce__(self):
+        raise TypeError("cannot pickle 'UnpicklablePairs' object")
+
+
+def test_augmenter_on_the_fly(iob_offline_tiny) -> None:
+    augmenter = EntitySwapAugmenter(iob_offline_tiny.add_column("id", list(range(len(iob_offline_tiny)))))
+    dataset = augmenter.augment_on_the_fly()
+    assert len(dataset) == len(iob_offline_tiny)
+    assert set(dataset.column_names) == {"tokens", "ner_tags", "entities", "id"}
+    row = dataset[0]
+    assert set(row) == {"tokens", "ner_tags", "id"}
+    assert len(row["tokens"]) == len(row["ner_tags"])
+    # Rows without entities are never changed
+    assert dataset[5]["tokens"] == iob_offline_tiny[5]["tokens"]
+    # Every access swaps the entities anew
+    assert len({tuple(dataset[4]["tokens"]) for _ in range(50)}) > 1
+
+    dataset = augmenter.augment_on_the_fly(probability=0.0)
+    assert dataset[:]["tokens"] == iob_offline_tiny["tokens"]
+
+
+@pytest.mark.parametrize("capacity", (None, 1000))
+def test_augmenter_global_deduplication(iob_offline_tiny, capacity: Optional[int]) -> None:
+    augmenter = EntitySwapAugmenter(iob_offline_tiny)
+    gold = set(zip(map(tuple, iob_offline_tiny["tokens"]), map(tuple, iob_offline_tiny["ner_tags"])))
+    deduplicator = Deduplicator(capacity=capacity)
+    augmented_ds = augmenter.augment(N=20, seed=3, deduplicator=deduplicator, exclude_gold=True)
+    augmented = list(zip(map(tuple, augmented_ds["tokens"]), map(tuple, augmented_ds["ner_tags"])))
+    assert len(augmented) == len(set(augmented))
+    assert not gold & set(augmented)
+    # A rerun with the same deduplicator only creates sentences that were not created before
+    assert len(augmenter.augment(N=20, seed=3, deduplicator=deduplicator)) == 0
+
+    # Row 5 has no entities, so it is only ever reproduced as is
+    assert ["It", "rained", "."] in augmenter.augment(N=1, seed=3)["tokens"]
+    streamed = list(augmenter.augment_iter(N=20, seed=3, exclude_gold=True))
+    assert [example["tokens"] for example in streamed] == augmenter.augment(N=20, seed=3, exclude_gold=True)["tokens"]
+
+    with pytest.raises(ValueError):
+        augmenter.augment(N=2, num_proc=2, exclude_gold=True)
+
+
+@pytest.mark.parametrize("N", (1, 3, 1000))
+def test_augmenter_exact(iob_offline_tiny, N: int) -> None:
+    augmenter = EntitySwapAugmenter(iob_offline_tiny)
+    knowledge_base = augmenter.knowledge_base
+    expected_sizes = [
+        min(N, math.prod(knowledge_base.num_entities(label) for label, _, _ in entities))
+        for entities in augmenter.entity_spans.to_list()
+    ]
+    augmented_ds = augmenter.augment(N=N, seed=11, exact=True)
+    assert len(augmented_ds) == sum(expected_sizes)
+    augmented = list(zip(map(tuple, augmented_ds["tokens"]), map(tuple, augmented_ds["ner_tags"])))
+    start = 0
+    for size in expected_sizes:
+        assert len(set(augmented[start : start + size])) == size
+        start += size
+    assert augmented_ds["tokens"] == augmenter.augment(N=N, seed=11, exact=True)["tokens"]
+
+
+@pytest.mark.parametrize("exact", (False, True))
+@pytest.mark.parametrize("length_tolerance", (0, 1))
+def test_augmenter_length_budget(iob_offline_tiny, exact: bool, length_tolerance: int) -> None:
+    augmenter = EntitySwapAugmenter(iob_offline_tiny)
+    for row, entities in zip(augmenter.dataset, augmenter.entity_spans.to_list()):
+        batch = augmenter.replace_entities(
+            [row["tokens"]],
+            [row["ner_tags"]],
+            [entities],
+            N=20,
+            seed=0,
+            exact=exact,
+            length_tolerance=length_tolerance,
+        )
+        assert all(len(tokens) <= len(row["tokens"]) + length_tolerance for tokens in batch["tokens"])
+        assert all(len(tokens) == len(ner_tags) for tokens, ner_tags in zip(batch["tokens"], batch["ner_tags"]))
+        if entities:
+            # Entities that fit the budget are still swapped
+            assert len(batch["tokens"]) > 1
+
+    # The tightest of `max_length` and `length_tolerance` applies, and entities that can't fit are kept as is
+    row = augmenter.dataset[1]
+    batch = augmenter.replace_entities(
+        [row["tokens"]],
+        [row["ner_tags"]],
+        [augmenter.entity_spans[1]],
+        N=20,
+        exact=exact,
+        max_length=1,
+        length_tolerance=length_tolerance,
+    )
+    assert batch["tokens"] == [["Peter", "Blackburn"]]
+
+
+def test_extract_entities(iob_offline_tiny) -> None:
+    augmenter = EntitySwapAugmenter(iob_offline_tiny)
+    row = iob_offline_tiny[1]
+    assert augmenter.extract_entities(row["tokens"], row["ner_tags"]) == augmenter.entity_spans[1]
+    num_entities = len(augmenter.knowledge_base)
+    augmenter.extract_entities(["Grace", "Hopper"], [1, 2])
+    augmenter.knowledge_base.build()
+    assert len(augmenter.knowledge_base) == num_entities + 1
+
+
+def test_replace_entities_positional_arguments(iob_offline_tiny) -> None:
+    # `N` and `deduplicate` keep their original positions
+    augmenter = EntitySwapAugmenter(iob_offline_tiny)
+    row = augmenter.dataset[0]
+    batch = augmenter.replace_entities([row["tokens"]], [row["ner_tags"]], [augmenter.entity_spans[0]], 8, False)
+    assert len(batch["tokens"]) == 8
+
+
+@pytest.mark.parametrize("file_format", ("parquet", "arrow"))
+def test_augmenter_to_disk(iob_offline_tiny, tmp_path, file_format: str) -> None:
+    augmenter = EntitySwapAugmenter(iob_offline_tiny)
+    expected = augmenter.augment(N=3, seed=7)
+    paths = augmenter.augment_to_disk(tmp_path, N=3, seed=7, shard_size=4, format=file_format, batch_size=2)
+    assert len(paths) == -(-len(expected) // 4)
+
+    if file_format == "parquet":
+        augmented_ds = Dataset.from_parquet([str(path) for path in paths])
+    else:
+        augmented_ds = concatenate_datasets([Dataset.from_file(str(path)) for path in paths])
+    assert augmented_ds.features == expected.features
+    assert augmented_ds["tokens"] == expected["tokens"]
+    assert augmented_ds["ner_tags"] == expected["ner_tags"]
+
+
+def test_augmenter_to_disk_errors(iob_offline_tiny, tmp_path, monkeypatch: pytest.MonkeyPatch) -> None:
+    augmenter = EntitySwapAugmenter(iob_offline_tiny)
+    producer_failed = threading.Event()
+
+    def write_shards(*args, **kwargs):
+        # Fail only after the producer has filled the queue and failed itself
+        producer_failed.wait(timeout=10)
+        raise OSError("The writer failed.")
+
+    def iter_augmented_batches(*args, **kwargs):
+        for _ in range(4):
+            yield {"tokens": [["EU"]], "ner_tags": [[3]]}
+        producer_failed.set()
+        raise RuntimeError("The producer failed.")
+
+    monkeypatch.setattr("adept_augmentations.augmenters.augmenter.write_shards", write_shards)
+    monkeypatch.setattr(augmenter, "iter_augmented_batches", iter_augmented_batches)
+    # The exception of the producer isn't replaced by that of the writer
+    with pytest.raises(RuntimeError, match="producer"):
+        augmenter.augment_to_disk(tmp_path)
+
+    # Without an exception of the producer, that of the writer is raised
+    producer_failed.set()
+    monkeypatch.setattr(augmenter, "iter_augmented_batches", lambda *args, **kwargs: iter([]))
+    with pytest.raises(OSError, match="writer"):
+        augmenter.augment_to_disk(tmp_path)
+
+
+def test_augmenter_cache(iob_offline_tiny, tmp_path, monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(datasets.config, "HF_DATASETS_CACHE", str(tmp_path))
+    # In-memory datasets are only cached when opted in, as nothing cleans up the global cache
+    EntitySwapAugmenter(iob_offline_tiny)
+    assert not list(tmp_path.glob("adept_augmentations/*"))
+    augmenter = EntitySwapAugmenter(iob_offline_tiny, load_from_cache_file=True)
+    assert len(list(tmp_path.glob("adept_augmentations/entities-*"))) == 1
+    assert len(list(tmp_path.glob("adept_augmentations/knowledge_base-*"))) == 1
+
+    # The second augmenter must not extract any entities
+    def extract_entities_batch(*args, **kwargs):
+        raise AssertionError("The entities should have been loaded from the cache.")
+
+    with monkeypatch.context() as patch:
+        patch.setattr(EntitySwapAugmenter, "extract_entities_batch", extract_entities_batch)
+        cached_augmenter = EntitySwapAugmenter(iob_offline_tiny, load_from_cache_file=True)
+    assert cached_augmenter.entity_spans.to_list() == augmenter.entity_spans.to_list()
+    assert cached_augmenter.knowledge_base.labels == augmenter.knowledge_base.labels
+    for label in augmenter.knowledge_base.labels:
+        assert (
+            cached_augmenter.knowledge_base.token_ids[label].tolist()
+            == augmenter.knowledge_base.token_ids[label].tolist()
+        )
+
+    # Other data or other labels invalidate the cache
+    EntitySwapAugmenter(iob_offline_tiny.select(range(3)), load_from_cache_file=True)
+    EntitySwapAugmenter(
+        iob_offline_tiny, labels=[label.replace("PER", "PERSON") for label in CONLL_LABELS], load_from_cache_file=True
+    )
+    assert len(list(tmp_path.glob("adept_augmentations/knowledge_base-*"))) == 3
+
+    # Datasets stored in cache files are cached next to them by default, whenever caching is enabled
+    iob_offline_tiny.save_to_disk(str(tmp_path / "saved"))
+    monkeypatch.setattr("adept_augmentations.augmenters.augmenter.is_caching_enabled", lambda: True)
+    EntitySwapAugmenter(datasets.load_from_disk(str(tmp_path / "saved")))
+    assert len(list((tmp_path / "saved").glob("knowledge_base-*"))) == 1
+
+
+def test_augmenter_add_examples(iob_offline_tiny) -> None:
+    augmenter = EntitySwapAugmenter(iob_offline_tiny.select(range(3)))
+    full_augmenter = EntitySwapAugmenter(iob_offline_tiny)
+
+    new_examples = augmenter.add_examples(iob_offline_tiny.select(range(3, 6)))
+    assert new_examples["tokens"] == iob_offline_tiny["tokens"][3:]
+    assert augmenter.dataset["tokens"] == iob_offline_tiny["tokens"]
+    assert augmenter.entity_spans.to_list() == full_augmenter.entity_spans.to_list()
+    for label in full_augmenter.knowledge_base.labels:
+        assert (
+            augmenter.knowledge_base.token_ids[label].tolist()
+            == full_augmenter.knowledge_base.token_ids[label].tolist()
+        )
+
+    # Augmenting only the new examples gives the tail of augmenting all examples
+    expected = full_augmenter.augment(N=3, seed=5)
+    assert augmenter.augment(N=3, seed=5)["tokens"] == expected["tokens"]
+    augmented_ds = augmenter.augment(N=3, seed=5, examples=new_examples, index_offset=3)
+    assert augmented_ds["tokens"] == expected["tokens"][-len(augmented_ds) :]
+    # Examples from elsewhere work as well
+    augmented_ds = augmenter.augment(N=3, seed=5, examples=iob_offline_tiny.select(range(3, 6)), index_offset=3)
+    assert augmented_ds["tokens"] == expected["tokens"][-len(augmented_ds) :]
+
+    with pytest.raises(ValueError):
+        augmenter.add_examples(iob_offline_tiny.cast_column("ner_tags", Sequence(ClassLabel(names=["O", "B-PER"]))))
+
+
+def test_augmenter_add_examples_shared_knowledge_base(iob_offline_tiny) -> None:
+    # Adding examples to one augmenter doesn't change the knowledge base that it shares with another augmenter
+    knowledge_base = EntitySwapAugmenter(iob_offline_tiny.select(range(3))).knowledge_base
+    num_entities = {label: knowledge_base.num_entities(label) for label in knowledge_base.labels}
+    augmenter = EntitySwapAugmenter(iob_offline_tiny.select(range(3)), knowledge_base=knowledge_base)
+    other_augmenter = EntitySwapAugmenter(iob_offline_tiny.select(range(3)), knowledge_base=knowledge_base)
+    expected = other_augmenter.augment(N=3, seed=5)["tokens"]
+
+    augmenter.add_examples(iob_offline_tiny.select(range(3, 6)))
+    assert augmenter.knowledge_base is not knowledge_base
+    assert len(augmenter.knowledge_base) > len(knowledge_base)
+    assert {label: knowledge_base.num_entities(label) for label in knowledge_base.labels} == num_entities
+    assert other_augmenter.augment(N=3, seed=5)["tokens"] == expected
+    # Only the shared knowledge base is copied, and only once
+    copied_knowledge_base = augmenter.knowledge_base
+    augmenter.add_examples(iob_offline_tiny.select(range(3)))
+    assert augmenter.knowledge_base is copied_knowledge_base
+
+
+def test_augmenter_save_load(iob_offline_tiny, tmp_path) -> None:
+    augmenter = EntitySwapAugmenter(iob_offline_tiny.select(range(3)))
+    augmenter.save(tmp_path)
+    loaded_augmenter = EntitySwapAugmenter.load(tmp_path)
+    assert loaded_augmenter.entity_spans.to_list() == augmenter.entity_spans.to_list()
+    assert loaded_augmenter.augment(N=3, seed=5)["tokens"] == augmenter.augment(N=3, seed=5)["tokens"]
+
+    # Saving again only writes the new examples
+    loaded_augmenter.add_examples(iob_offline_tiny.select(range(3, 6)))
+    loaded_augmenter.save(tmp_path)
+    loaded_augmenter.save(tmp_path)
+    assert sorted(path.name for path in tmp_path.glob("data-*.arrow")) == ["data-00000.arrow", "data-00001.arrow"]
+    reloaded_augmenter = EntitySwapAugmenter.load(tmp_path)
+    full_augmenter = EntitySwapAugmenter(iob_offline_tiny)
+    assert reloaded_augmenter.dataset["tokens"] == iob_offline_tiny["tokens"]
+    assert reloaded_augmenter.augment(N=3, seed=5)["tokens"] == full_augmenter.augment(N=3, seed=5)["tokens"]
+
+    # Saving another augmenter to the same directory replaces the saved augmenter
+    augmenter.save(tmp_path)
+    assert sorted(path.name for path in tmp_path.glob("data-*.arrow")) == ["data-00000.arrow"]
+    assert len(EntitySwapAugmenter.load(tmp_path).dataset) == 3
+
+
+def test_knowledge_base_swap_augmenter(iob_offline_tiny, tmp_path) -> None:
+    (tmp_path / "gazetteer.tsv").write_text("PER\tAda Lovelace\nPER\tAlan Turing\nLOC\tNew York City\n")
+    build_gazetteer_knowledge_base([tmp_path / "gazetteer.tsv"], tmp_path / "kb")
+    augmenter = KnowledgeBaseSwapAugmenter(iob_offline_tiny, tmp_path / "kb")
+    augmented_ds = augmenter.augment(N=2, deduplicate=False, num_proc=2)
+    assert len(augmented_ds) == len(iob_offline_tiny) * 2
+
+    augmented_tokens = augmented_ds["tokens"]
+    # "Peter Blackburn" is a person, and thus always swapped
+    assert augmented_tokens[2] in (["Ada", "Lovelace"], ["Alan", "Turing"])
+    # "BRUSSELS" is a location, while "1996-08-22" is not an entity
+    assert augmented_tokens[4] == ["New", "York", "City", "1996-08-22"]
+    # The gazetteer has no organisations or miscellaneous entities, so those are kept
+    assert augmented_tokens[0] == iob_offline_tiny[0]["tokens"]
+
+    # The external knowledge base is referenced rather than copied when saving
+    augmenter.save(tmp_path / "augmenter")
+    assert not (tmp_path / "augmenter" / "knowledge_base").exists()
+    loaded_augmenter = KnowledgeBaseSwapAugmenter.load(tmp_path / "augmenter")
+    assert loaded_augmenter.augment(N=2, seed=3)["tokens"] == augmenter.augment(N=2, seed=3)["tokens"]
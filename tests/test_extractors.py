@@ -0,0 +1,56 @@
+import random
+
+import pyarrow as pa
+import pytest
+
+from adept_augmentations import EntitySwapAugmenter
+from adept_augmentations.augmenters.augmenter import LabelScheme
+from adept_augmentations.augmenters.extractors import flatten_list_array
+from tests.constants import (
+    BILOU_CONLL_LABELS,
+    CONLL_LABELS,
+    FABNER_LABELS,
+    FEWNERD_COARSE_LABELS,
+)
+
+
+@pytest.mark.parametrize("labels", (CONLL_LABELS, BILOU_CONLL_LABELS, FABNER_LABELS, FEWNERD_COARSE_LABELS))
+def test_extract_batch_matches_call(labels) -> None:
+    _, entity_extractor = LabelScheme.from_labels(labels)
+    rng = random.Random(42)
+    # Random, and thus often invalid, label sequences of varying lengths, including empty rows
+    rows = [
+        [rng.randrange(len(labels)) if rng.random() < 0.5 else 0 for _ in range(rng.randrange(8))] for _ in range(500)
+    ]
+    # Slice to ensure that non-zero Arrow offsets are handled
+    ner_tags, offsets = flatten_list_array(pa.array(rows).slice(3))
+    entity_labels, starts, ends, entity_offsets = entity_extractor.extract_batch(ner_tags, offsets)
+    for row_idx, row in enumerate(rows[3:]):
+        row_slice = slice(entity_offsets[row_idx], entity_offsets[row_idx + 1])
+        entities = list(zip(entity_labels[row_slice].tolist(), starts[row_slice].tolist(), ends[row_slice].tolist()))
+        assert entities == list(entity_extractor(row))
+
+
+@pytest.mark.parametrize("labels", (CONLL_LABELS, BILOU_CONLL_LABELS, FABNER_LABELS, FEWNERD_COARSE_LABELS))
+def test_reduced_label_id_to_id_roundtrip(labels) -> None:
+    _, entity_extractor = LabelScheme.from_labels(labels)
+    for length in range(1, 4):
+        label_ids = entity_extractor.reduced_label_id_to_id(1, length)
+        assert list(entity_extractor(label_ids)) == [(1, 0, length)]
+
+
+def test_extract_entities_batch(iob_offline_tiny) -> None:
+    dataset = iob_offline_tiny.select([4, 1, 0])
+    augmenter = EntitySwapAugmenter(dataset)
+    reduced_labels = augmenter.entity_extractor.reduced_labels
+    assert augmenter.entity_spans.to_list()[:2] == [
+        [
+            (reduced_labels.index("LOC"), 0, 1),
+            (reduced_labels.index("ORG"), 5, 7),
+            (reduced_labels.index("PER"), 7, 9),
+        ],
+        [(reduced_labels.index("PER"), 0, 2)],
+    ]
+    # The dataset itself is left untouched
+    assert augmenter.dataset is dataset
+    assert augmenter.dataset.format["type"] is None
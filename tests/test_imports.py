@@ -0,0 +1,42 @@
+import json
+import subprocess
+import sys
+
+import pytest
+
+# Runs the import in a fresh interpreter, and reports which heavy dependencies were imported along the way
+IMPORT_SCRIPT = """
+import json, sys
+{statement}
+print(json.dumps([name for name in ("datasets", "spacy") if name in sys.modules]))
+"""
+
+
+def imported_modules(statement: str) -> list:
+    output = subprocess.run(
+        [sys.executable, "-c", IMPORT_SCRIPT.format(statement=statement)], capture_output=True, check=True, text=True
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+@pytest.mark.parametrize(
+    "statement, expected_modules",
+    (
+        ("import adept_augmentations", []),
+        ("from adept_augmentations import Deduplicator", []),
+        ("from adept_augmentations import EntitySwapAugmenter", ["datasets"]),
+        ("from adept_augmentations.augmenters.spacy_augmenter import create_entity_swap_augmenter", ["spacy"]),
+    ),
+)
+def test_lazy_imports(statement: str, expected_modules: list) -> None:
+    # Only the heavy dependencies that are needed are imported, which is what keeps the import fast
+    assert imported_modules(statement) == expected_modules
+
+
+def test_lazy_attributes() -> None:
+    import adept_augmentations
+
+    assert "EntitySwapAugmenter" in dir(adept_augmentations)
+    assert adept_augmentations.EntitySwapAugmenter is adept_augmentations.augmenters.EntitySwapAugmenter
+    with pytest.raises(AttributeError):
+        adept_augmentations.DoesNotExist
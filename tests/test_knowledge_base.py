@@ -0,0 +1,222 @@
+import json
+import pickle
+import random
+
+import numpy as np
+
+from adept_augmentations import EntitySwapAugmenter
+from adept_augmentations.augmenters import knowledge_base as knowledge_base_module
+from adept_augmentations.augmenters.knowledge_base import (
+    KnowledgeBase,
+    MemoryMappedKnowledgeBase,
+    build_gazetteer_knowledge_base,
+    first_occurrences,
+)
+
+
+def test_knowledge_base_deduplicates_and_interns() -> None:
+    knowledge_base = KnowledgeBase()
+    knowledge_base.add(1, ["New", "York"])
+    knowledge_base.add(1, ["York"])
+    knowledge_base.add(1, ["New", "York"])
+    knowledge_base.add(2, ["York"])
+    knowledge_base.add(2, [])
+    knowledge_base.build()
+
+    assert knowledge_base.labels == [1, 2]
+    assert knowledge_base.num_entities(1) == 2
+    assert len(knowledge_base) == 3
+    assert knowledge_base.vocab == ["New", "York"]
+    # Entities are sorted by length first
+    assert knowledge_base.token_ids[1].tolist() == [1, 0, 1]
+    assert knowledge_base.offsets[1].tolist() == [0, 1, 3]
+    assert knowledge_base.get(1, 1) == ["New", "York"]
+    assert knowledge_base.sample(2, random.Random(0)) == ["York"]
+
+
+def test_knowledge_base_order_independent() -> None:
+    entities = [["b"], ["a", "c"], ["a"], ["c", "a"]]
+    forward = KnowledgeBase()
+    backward = KnowledgeBase()
+    for entity in entities:
+        forward.add(0, entity)
+    for entity in entities[::-1]:
+        backward.add(0, entity)
+    forward.build()
+    backward.build()
+    assert [forward.get(0, i) for i in range(4)] == [backward.get(0, i) for i in range(4)]
+
+    # Adding to a compiled label still deduplicates
+    forward.add(0, ["b"])
+    forward.add(0, ["d"])
+    assert forward.num_entities(0) == 5
+
+
+def test_knowledge_base_incremental_build() -> None:
+    rng = random.Random(0)
+    entities = [(rng.randrange(3), [f"t{rng.randrange(50)}" for _ in range(rng.randint(1, 3))]) for _ in range(500)]
+    # Build after every 37 entities, so new entities are inserted into the built labels, including known ones
+    incremental = KnowledgeBase()
+    full = KnowledgeBase()
+    for index, (label, tokens) in enumerate(entities + entities[:100]):
+        incremental.add(label, tokens)
+        full.add(label, tokens)
+        if index % 37 == 0:
+            incremental.build()
+    incremental.build()
+    full.build()
+    assert incremental.labels == full.labels
+    for label in full.labels:
+        assert [incremental.get(label, index) for index in range(incremental.num_entities(label))] == [
+            full.get(label, index) for index in range(full.num_entities(label))
+        ]
+        assert incremental.length_counts[label].tolist() == full.length_counts[label].tolist()
+
+
+def test_knowledge_base_merge() -> None:
+    first = KnowledgeBase()
+    first.add(0, ["a", "b"])
+    first.add(1, ["c"])
+    second = KnowledgeBase()
+    second.add(1, ["d"])
+    second.add(1, ["c"])
+    second.add(0, ["b"])
+    second.build()
+
+    merged = KnowledgeBase.merge([second, first])
+    assert [merged.get(0, i) for i in range(merged.num_entities(0))] == [["b"], ["a", "b"]]
+    assert [merged.get(1, i) for i in range(merged.num_entities(1))] == [["c"], ["d"]]
+
+
+def test_augmenter_knowledge_base(iob_offline_tiny) -> None:
+    augmenter = EntitySwapAugmenter(iob_offline_tiny)
+    reduced_labels = augmenter.entity_extractor.reduced_labels
+    org = reduced_labels.index("ORG")
+    knowledge_base = augmenter.knowledge_base
+    assert {tuple(knowledge_base.get(org, i)) for i in range(knowledge_base.num_entities(org))} == {
+        ("EU",),
+        ("European", "Commission"),
+        ("European", "Union"),
+    }
+    augmented_ds = augmenter.augment(N=3, deduplicate=False)
+    assert len(augmented_ds) == len(iob_offline_tiny) * 3
+    for tokens, ner_tags in zip(augmented_ds["tokens"], augmented_ds["ner_tags"]):
+        assert len(tokens) == len(ner_tags)
+
+
+def test_knowledge_base_save_load(tmp_path) -> None:
+    knowledge_base = KnowledgeBase()
+    knowledge_base.add(3, ["Zürich"])
+    knowledge_base.add(1, ["New", "York"])
+    knowledge_base.add(1, ["Paris"])
+    knowledge_base.save(tmp_path / "kb")
+
+    loaded = KnowledgeBase.load(tmp_path / "kb")
+    assert loaded.labels == [1, 3]
+    assert [loaded.get(1, i) for i in range(loaded.num_entities(1))] == [["Paris"], ["New", "York"]]
+    assert loaded.get(3, 0) == ["Zürich"]
+    loaded.add(3, ["Zürich"])
+    assert loaded.num_entities(3) == 1
+
+
+def test_gazetteer_knowledge_base(tmp_path) -> None:
+    (tmp_path / "people.tsv").write_text("PER\tAda Lovelace\nPER\tAlan Turing\nPER\tAda Lovelace\nLOC\tParis\n")
+    with open(tmp_path / "places.jsonl", "w") as f:
+        f.write(json.dumps({"label": "LOC", "tokens": ["New", "York"]}) + "\n")
+        f.write(json.dumps({"label": "LOC", "text": "Paris"}) + "\n")
+        f.write(json.dumps({"label": "PER", "text": "Alan"}) + "\n")
+
+    knowledge_base = build_gazetteer_knowledge_base(
+        [tmp_path / "people.tsv", tmp_path / "places.jsonl"], tmp_path / "kb"
+    )
+    assert isinstance(knowledge_base.token_ids, np.memmap)
+    assert knowledge_base.labels == ["PER", "LOC"]
+    assert [knowledge_base.get("PER", i) for i in range(knowledge_base.num_entities("PER"))] == [
+        ["Alan"],
+        ["Ada", "Lovelace"],
+        ["Alan", "Turing"],
+    ]
+    assert [knowledge_base.get("LOC", i) for i in range(knowledge_base.num_entities("LOC"))] == [
+        ["Paris"],
+        ["New", "York"],
+    ]
+
+    # Pickling only stores the path, and relabeled views share the same files
+    relabeled = pickle.loads(pickle.dumps(knowledge_base.relabel({1: "PER", 2: "MISC"})))
+    assert relabeled.labels == [1]
+    assert relabeled.sample(1, random.Random(0)) in (["Ada", "Lovelace"], ["Alan", "Turing"], ["Alan"])
+    assert 2 not in relabeled
+
+
+def test_first_occurrences() -> None:
+    # Entities 0, 2 and 4 share a hash with distinct tokens or labels, and 5 duplicates 2
+    tokens = [[1, 2], [3], [1, 3], [1, 2], [1, 2], [1, 3], [4]]
+    labels = np.array([0, 0, 0, 0, 1, 0, 0])
+    hashes = np.array([7, 5, 7, 7, 7, 7, 9], dtype=np.uint64)
+    offsets = np.cumsum([0] + [len(entity) for entity in tokens])
+    token_ids = np.array([token for entity in tokens for token in entity], dtype=np.int32)
+    assert first_occurrences(hashes, labels, token_ids, offsets).tolist() == [0, 1, 2, 4, 6]
+
+
+def test_gazetteer_knowledge_base_hash_collisions(tmp_path, monkeypatch) -> None:
+    (tmp_path / "gazetteer.tsv").write_text("PER\tAda Lovelace\nPER\tAlan Turing\nPER\tAda Lovelace\nLOC\tAda\n")
+    expected = build_gazetteer_knowledge_base([tmp_path / "gazetteer.tsv"], tmp_path / "expected")
+    # With every hash colliding, only the exact duplicate is removed
+    monkeypatch.setattr(
+        knowledge_base_module, "hash_sequences", lambda token_ids, offsets: np.zeros(len(offsets) - 1, dtype=np.uint64)
+    )
+    monkeypatch.setattr(knowledge_base_module, "splitmix64", lambda labels: np.zeros(len(labels), dtype=np.uint64))
+    knowledge_base = build_gazetteer_knowledge_base([tmp_path / "gazetteer.tsv"], tmp_path / "kb")
+    for label in ("PER", "LOC"):
+        entities = [knowledge_base.get(label, i) for i in range(knowledge_base.num_entities(label))]
+        assert entities == [expected.get(label, i) for i in range(expected.num_entities(label))]
+    assert knowledge_base.num_entities("PER") == 2
+
+
+def test_knowledge_base_copy() -> None:
+    knowledge_base = KnowledgeBase()
+    knowledge_base.add(1, ["New", "York"])
+    knowledge_base.build()
+    knowledge_base.add(1, ["Paris"])
+    copied = knowledge_base.copy()
+    copied.add(1, ["Zürich"])
+    copied.add(2, ["Ada"])
+    assert [copied.get(1, index) for index in range(copied.num_entities(1))] == [
+        ["Paris"],
+        ["Zürich"],
+        ["New", "York"],
+    ]
+    assert knowledge_base.labels == [1]
+    assert [knowledge_base.get(1, index) for index in range(knowledge_base.num_entities(1))] == [
+        ["Paris"],
+        ["New", "York"],
+    ]
+    assert knowledge_base.vocab == ["New", "York", "Paris"]
+
+
+def test_knowledge_base_max_length(tmp_path) -> None:
+    knowledge_base = KnowledgeBase()
+    for entity in (["a", "b", "c"], ["a"], ["b", "c"], ["b"]):
+        knowledge_base.add(0, entity)
+    knowledge_base.build()
+    assert [knowledge_base.num_entities(0, max_length) for max_length in (-1, 0, 1, 2, 3, 10)] == [0, 0, 2, 3, 4, 4]
+    assert all(len(knowledge_base.sample(0, random.Random(seed), max_length=1)) == 1 for seed in range(10))
+
+    knowledge_base.save(tmp_path / "kb")
+    memory_mapped = MemoryMappedKnowledgeBase(tmp_path / "kb")
+    assert [memory_mapped.num_entities(0, max_length) for max_length in (-1, 0, 1, 2, 3, 10)] == [0, 0, 2, 3, 4, 4]
+    assert KnowledgeBase.load(tmp_path / "kb").num_entities(0, 2) == 3
+
+
+def test_memory_mapped_knowledge_base(tmp_path) -> None:
+    knowledge_base = KnowledgeBase()
+    knowledge_base.add(1, ["New", "York"])
+    knowledge_base.add(1, ["Paris"])
+    knowledge_base.add(2, ["Zürich"])
+    knowledge_base.save(tmp_path / "kb")
+
+    memory_mapped = MemoryMappedKnowledgeBase(tmp_path / "kb")
+    assert memory_mapped.labels == [1, 2]
+    assert len(memory_mapped) == 3
+    assert memory_mapped.get(1, 1) == ["New", "York"]
+    assert memory_mapped.get(2, 0) == ["Zürich"]
@@ -0,0 +1,62 @@
+import json
+import tracemalloc
+
+from adept_augmentations import Deduplicator, EntitySwapAugmenter
+from adept_augmentations.profilers import count, get_profiler, profile, stage
+from adept_augmentations.utils import convert_dataset_to_docbin
+
+
+def test_profile_augmenter(iob_offline_tiny, tmp_path) -> None:
+    with profile(track_memory=True) as profiler:
+        augmenter = EntitySwapAugmenter(iob_offline_tiny)
+        augmenter.augment(N=10, seed=0, deduplicator=Deduplicator())
+        convert_dataset_to_docbin(iob_offline_tiny)
+    assert get_profiler() is None
+
+    metrics = profiler.to_dict()
+    for name in (
+        "EntitySwapAugmenter.__init__",
+        "extract",
+        "extract_entities_batch",
+        "build_knowledge_base",
+        "augment",
+        "replace_entities",
+        "deduplicator.filter",
+        "convert_dataset_to_docbin",
+    ):
+        assert metrics["stages"][name]["calls"] >= 1
+        assert metrics["stages"][name]["seconds"] >= 0
+        # Per-stage peaks require `tracemalloc.reset_peak`, i.e. Python 3.9 or later
+        if hasattr(tracemalloc, "reset_peak"):
+            assert metrics["stages"][name]["peak_memory"] > 0
+        else:
+            assert "peak_memory" not in metrics["stages"][name]
+    # Nested stages are included in the stages that contain them
+    assert metrics["stages"]["extract"]["seconds"] <= metrics["stages"]["EntitySwapAugmenter.__init__"]["seconds"]
+
+    counters = metrics["counters"]
+    assert counters["extract.rows"] == len(iob_offline_tiny)
+    assert counters["extract.entities"] == 9
+    assert counters["replace_entities.rows"] == len(iob_offline_tiny)
+    assert counters["replace_entities.candidates"] == 10 * len(iob_offline_tiny)
+    assert counters["convert_dataset_to_docbin.rows"] == len(iob_offline_tiny)
+    assert 0 < metrics["rates"]["deduplicate"] < 1
+    assert metrics["gauges"]["knowledge_base.entities"] == {"PER": 2, "ORG": 3, "LOC": 2, "MISC": 2}
+    assert metrics["peak_memory"] > 0
+
+    assert json.loads(profiler.to_json(tmp_path / "metrics.json")) == json.loads(
+        (tmp_path / "metrics.json").read_text()
+    )
+
+
+def test_profile_disabled() -> None:
+    # Without an active profiler, the hooks do nothing
+    with stage("stage"):
+        count("counter")
+    with profile() as profiler:
+        with stage("outer"):
+            with stage("inner"):
+                count("counter", 2)
+    assert profiler.to_dict()["stages"].keys() == {"outer", "inner"}
+    assert profiler.to_dict()["counters"] == {"counter": 2}
+    assert profiler.to_dict()["peak_memory"] is None
@@ -0,0 +1,84 @@
+from itertools import chain
+
+import numpy as np
+import pytest
+from spacy.tokens import DocBin
+from spacy.vocab import Vocab
+
+from adept_augmentations import EntitySwapAugmenter, SentenceCropAugmenter
+from adept_augmentations.augmenters.sentence_crop import window_boundaries
+from adept_augmentations.synthetic import SCHEMES, generate_dataset, generate_docbin
+
+
+def entity_tokens(augmenter: SentenceCropAugmenter, dataset) -> list:
+    # The label and tokens of every entity, in order
+    return [
+        (label, tuple(tokens[start:end]))
+        for tokens, ner_tags in zip(dataset["tokens"], dataset["ner_tags"])
+        for label, start, end in augmenter.entity_extractor(ner_tags)
+    ]
+
+
+def test_window_boundaries() -> None:
+    # Rows of 5, 0 and 4 tokens, with entities at [1, 3) and [3, 5) in the first row and [0, 4) in the last
+    offsets = np.array([0, 5, 5, 9])
+    starts, ends, entity_offsets = np.array([1, 3, 0]), np.array([3, 5, 4]), np.array([0, 2, 2, 3])
+    window_starts, window_ends = window_boundaries(offsets, starts, ends, entity_offsets, 2)
+    assert list(zip(window_starts.tolist(), window_ends.tolist())) == [(0, 1), (1, 3), (3, 5), (5, 9)]
+    window_starts, window_ends = window_boundaries(offsets, starts, ends, entity_offsets, 4)
+    assert list(zip(window_starts.tolist(), window_ends.tolist())) == [(0, 3), (3, 5), (5, 9)]
+
+
+@pytest.mark.parametrize("max_length", (1, 3, 100))
+def test_sentence_crop_augmenter(iob_offline_tiny, max_length: int) -> None:
+    augmenter = SentenceCropAugmenter(iob_offline_tiny)
+    cropped_ds = augmenter.augment(max_length=max_length)
+    assert cropped_ds.features == iob_offline_tiny.features
+    # The windows are consecutive and never split an entity
+    assert list(chain.from_iterable(cropped_ds["tokens"])) == list(chain.from_iterable(iob_offline_tiny["tokens"]))
+    assert entity_tokens(augmenter, cropped_ds) == entity_tokens(augmenter, iob_offline_tiny)
+    for tokens, ner_tags in zip(cropped_ds["tokens"], cropped_ds["ner_tags"]):
+        assert len(tokens) == len(ner_tags)
+        # Only an entity that is too long itself exceeds the maximum length
+        entities = list(augmenter.entity_extractor(ner_tags))
+        assert len(tokens) <= max_length or [entity[1:] for entity in entities] == [(0, len(tokens))]
+    if max_length == 100:
+        assert cropped_ds["ner_tags"] == iob_offline_tiny["ner_tags"]
+
+    with pytest.raises(ValueError):
+        augmenter.augment(max_length=0)
+
+
+@pytest.mark.parametrize("scheme", SCHEMES)
+def test_sentence_crop_augmenter_schemes(scheme: str) -> None:
+    dataset = generate_dataset(num_sentences=300, sentence_length=(1, 40), entity_density=0.3, scheme=scheme)
+    augmenter = SentenceCropAugmenter(dataset)
+    cropped_ds = augmenter.augment(max_length=8)
+    assert list(chain.from_iterable(cropped_ds["tokens"])) == list(chain.from_iterable(dataset["tokens"]))
+    assert entity_tokens(augmenter, cropped_ds) == entity_tokens(augmenter, dataset)
+    assert max(len(tokens) for tokens in cropped_ds["tokens"]) <= 8
+
+    # Cropping the output of `EntitySwapAugmenter`, also with multiple processes
+    augmented_ds = EntitySwapAugmenter(dataset).augment(N=2, seed=0)
+    augmenter = SentenceCropAugmenter(augmented_ds)
+    cropped_ds = augmenter.augment(max_length=8, num_proc=2)
+    assert cropped_ds["tokens"] == augmenter.augment(max_length=8)["tokens"]
+    assert entity_tokens(augmenter, cropped_ds) == entity_tokens(augmenter, augmented_ds)
+
+
+def test_sentence_crop_augmenter_docbin_and_streaming() -> None:
+    doc_bin = generate_docbin(num_sentences=50, sentence_length=(10, 20))
+    augmenter = SentenceCropAugmenter(doc_bin)
+    cropped_doc_bin = augmenter.augment(max_length=5)
+    assert isinstance(cropped_doc_bin, DocBin)
+    # Adjacent entities of the same label are merged without a tagging scheme, so compare with uncropped docs
+    docs = list(augmenter.augment(max_length=100).get_docs(Vocab()))
+    cropped_docs = list(cropped_doc_bin.get_docs(Vocab()))
+    assert [token.text for doc in cropped_docs for token in doc] == [token.text for doc in docs for token in doc]
+    assert [ent.text for doc in cropped_docs for ent in doc.ents] == [ent.text for doc in docs for ent in doc.ents]
+
+    dataset = generate_dataset(num_sentences=50)
+    expected = SentenceCropAugmenter(dataset).augment(max_length=5)
+    cropped_examples = list(SentenceCropAugmenter(dataset.to_iterable_dataset()).augment(max_length=5))
+    assert [example["tokens"] for example in cropped_examples] == expected["tokens"]
+    assert [example["ner_tags"] for example in cropped_examples] == expected["ner_tags"]
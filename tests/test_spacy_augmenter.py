@@ -0,0 +1,70 @@
+import random
+
+import spacy
+from spacy.tokens import Doc, DocBin, Span
+from spacy.training import Corpus
+
+from adept_augmentations.augmenters.spacy_augmenter import (
+    build_docbin_knowledge_base,
+    swap_doc_entities,
+)
+
+
+def write_corpus(path) -> None:
+    nlp = spacy.blank("en")
+    docs = []
+    doc = nlp("Apple is looking at buying U.K. startup for $1 billion")
+    doc.ents = [Span(doc, 0, 1, "ORG"), Span(doc, 5, 6, "GPE"), Span(doc, 8, 11, "MONEY")]
+    docs.append(doc)
+    doc = nlp("Microsoft acquires GitHub for $7.5 billion")
+    doc.ents = [Span(doc, 0, 1, "ORG"), Span(doc, 2, 3, "ORG"), Span(doc, 4, 7, "MONEY")]
+    docs.append(doc)
+    docs.append(nlp("Nothing to see here."))
+    DocBin(docs=docs).to_disk(path)
+
+
+def test_build_docbin_knowledge_base(tmp_path) -> None:
+    write_corpus(tmp_path / "train.spacy")
+    knowledge_base = build_docbin_knowledge_base([tmp_path])
+    assert knowledge_base.labels == ["GPE", "MONEY", "ORG"]
+    assert [knowledge_base.get("ORG", i) for i in range(knowledge_base.num_entities("ORG"))] == [
+        ["Apple"],
+        ["GitHub"],
+        ["Microsoft"],
+    ]
+    assert knowledge_base.get("MONEY", 0) == ["$", "1", "billion"]
+
+
+def test_swap_doc_entities(tmp_path) -> None:
+    write_corpus(tmp_path / "train.spacy")
+    knowledge_base = build_docbin_knowledge_base([tmp_path / "train.spacy"])
+    nlp = spacy.blank("en")
+    doc = Doc(nlp.vocab, words=["Hi", "Bob", "of", "GitHub", "!"], spaces=[True, True, True, False, False])
+    doc.set_ents([Span(doc, 1, 2, "PERSON"), Span(doc, 3, 4, "ORG")], missing=[doc[4:5]], default="outside")
+    rng = random.Random(0)
+    for _ in range(10):
+        augmented_doc = swap_doc_entities(doc, knowledge_base, rng)
+        # PERSON is missing from the knowledge base, so it is kept
+        assert [(ent.label_, ent.text) for ent in augmented_doc.ents][0] == ("PERSON", "Bob")
+        assert augmented_doc.ents[1].text in ("Apple", "GitHub", "Microsoft")
+        assert augmented_doc.text.startswith("Hi Bob of ") and augmented_doc.text.endswith("!")
+        assert [token.ent_iob_ for token in augmented_doc] == ["O", "B", "O", "B", ""]
+
+
+def test_registered_augmenter(tmp_path) -> None:
+    write_corpus(tmp_path / "train.spacy")
+    create_augmenter = spacy.registry.augmenters.get("adept_augmentations.EntitySwapAugmenter.v1")
+    augmenter = create_augmenter(corpus=tmp_path / "train.spacy", level=1.0)
+    nlp = spacy.blank("en")
+    corpus = Corpus(tmp_path / "train.spacy", augmenter=augmenter)
+    texts = set()
+    for _ in range(20):
+        examples = list(corpus(nlp))
+        assert len(examples) == 3
+        assert examples[2].reference.text == "Nothing to see here."
+        for example in examples[:2]:
+            assert example.predicted.text == example.reference.text
+            assert [ent.label_ for ent in example.reference.ents] in (["ORG", "GPE", "MONEY"], ["ORG", "ORG", "MONEY"])
+        texts.add(examples[1].reference.text)
+    # Every epoch draws new swaps
+    assert len(texts) > 1
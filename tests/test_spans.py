@@ -0,0 +1,28 @@
+import numpy as np
+
+from adept_augmentations.augmenters.spans import EntitySpans
+
+
+def test_entity_spans(tmp_path) -> None:
+    # Three rows, of which the second has no entities
+    entity_spans = EntitySpans([1, 2, 1], [0, 3, 2], [2, 4, 3], [0, 2, 2, 3])
+    assert len(entity_spans) == 3
+    assert entity_spans.num_entities == 3
+    assert entity_spans.labels.dtype == np.int32
+    expected = [[(1, 0, 2), (2, 3, 4)], [], [(1, 2, 3)]]
+    assert entity_spans.to_list() == expected
+    assert entity_spans[2] == expected[2]
+    assert entity_spans.rows([2, 0, 2]) == [expected[2], expected[0], expected[2]]
+    assert entity_spans.rows([]) == []
+    assert entity_spans.to_arrow().to_pylist() == [[list(entity) for entity in row] for row in expected]
+
+    tail = entity_spans.slice(1, 3)
+    assert tail.to_list() == expected[1:]
+    assert EntitySpans.concatenate([entity_spans.slice(0, 1), tail]).to_list() == expected
+    assert EntitySpans.concatenate([tail, EntitySpans.empty(), entity_spans]).to_list() == expected[1:] + expected
+    assert len(EntitySpans.concatenate([])) == 0
+
+    tail.save(tmp_path / "tail")
+    loaded = EntitySpans.load(tmp_path / "tail")
+    assert loaded.to_list() == expected[1:]
+    assert loaded.offsets.tolist() == [0, 0, 1]
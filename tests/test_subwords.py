@@ -0,0 +1,81 @@
+from typing import List
+
+import pytest
+
+from adept_augmentations import Deduplicator, EntitySwapAugmenter, SubwordEncoder
+
+tokenizers = pytest.importorskip("tokenizers")
+
+
+@pytest.fixture
+def tokenizer_path(iob_offline_tiny, tmp_path) -> str:
+    # A WordPiece tokenizer that splits the longer words of the dataset into two subwords
+    vocab = {"[PAD]": 0, "[UNK]": 1, "[CLS]": 2, "[SEP]": 3}
+    for tokens in iob_offline_tiny["tokens"]:
+        for token in tokens:
+            for piece in (token[:4], "##" + token[4:]) if len(token) > 4 else (token,):
+                vocab.setdefault(piece, len(vocab))
+    tokenizer = tokenizers.Tokenizer(tokenizers.models.WordPiece(vocab, unk_token="[UNK]"))
+    tokenizer.pre_tokenizer = tokenizers.pre_tokenizers.WhitespaceSplit()
+    tokenizer.post_processor = tokenizers.processors.TemplateProcessing(
+        single="[CLS] $A [SEP]", special_tokens=[("[CLS]", 2), ("[SEP]", 3)]
+    )
+    tokenizer.enable_truncation(max_length=4)
+    path = tmp_path / "tokenizer.json"
+    tokenizer.save(str(path))
+    return str(path)
+
+
+def retokenize(tokenizer, batch_tokens: List[List[str]], batch_labels: List[List[int]], label_all_subwords: bool):
+    # The common, slower approach: tokenize every augmented sentence and align the labels by word ids
+    input_ids = []
+    labels = []
+    for tokens, ner_tags in zip(batch_tokens, batch_labels):
+        encoding = tokenizer.encode(tokens, is_pretokenized=True)
+        input_ids.append(encoding.ids)
+        labels.append([])
+        for position, word_id in enumerate(encoding.word_ids):
+            is_first = word_id is not None and (position == 0 or encoding.word_ids[position - 1] != word_id)
+            labels[-1].append(ner_tags[word_id] if word_id is not None and (is_first or label_all_subwords) else -100)
+    return input_ids, labels
+
+
+@pytest.mark.parametrize("label_all_subwords", (False, True))
+def test_subword_encoder(iob_offline_tiny, tokenizer_path: str, label_all_subwords: bool) -> None:
+    tokenizer = tokenizers.Tokenizer.from_file(tokenizer_path)
+    tokenizer.no_truncation()
+    subword_encoder = SubwordEncoder(tokenizer_path, label_all_subwords=label_all_subwords)
+    assert (subword_encoder.prefix_ids, subword_encoder.suffix_ids) == ([2], [3])
+    # The words are tokenized in one call, and only once
+    subword_encoder.add_words(["European", "European", "EU"])
+    assert subword_encoder.cache == {
+        "European": [tokenizer.token_to_id("Euro"), tokenizer.token_to_id("##pean")],
+        "EU": [tokenizer.token_to_id("EU")],
+    }
+
+    augmenter = EntitySwapAugmenter(iob_offline_tiny)
+    for get_kwargs in (dict, lambda: {"exact": True}, lambda: {"deduplicator": Deduplicator(), "exclude_gold": True}):
+        expected = augmenter.augment(N=5, seed=3, **get_kwargs())
+        augmented_ds = augmenter.augment(N=5, seed=3, subword_encoder=subword_encoder, **get_kwargs())
+        assert augmented_ds.column_names == ["input_ids", "labels"]
+        input_ids, labels = retokenize(tokenizer, expected["tokens"], expected["ner_tags"], label_all_subwords)
+        assert augmented_ds["input_ids"] == input_ids
+        assert augmented_ds["labels"] == labels
+
+    # Also for streamed datasets and multiple processes
+    expected = augmenter.augment(N=3, seed=1, subword_encoder=subword_encoder)
+    streaming_augmenter = EntitySwapAugmenter(iob_offline_tiny.to_iterable_dataset())
+    assert list(streaming_augmenter.augment(N=3, seed=1, subword_encoder=subword_encoder)) == list(expected)
+    assert (
+        augmenter.augment(N=3, seed=1, subword_encoder=subword_encoder, num_proc=2)["input_ids"]
+        == expected["input_ids"]
+    )
+
+
+def test_subword_encoder_without_special_tokens(tokenizer_path: str) -> None:
+    subword_encoder = SubwordEncoder(tokenizer_path, add_special_tokens=False)
+    input_ids, labels, offsets = subword_encoder.encode(["European", "Union"], [3, 4])
+    assert len(input_ids) == len(labels) == 4
+    assert labels == [3, -100, 4, -100]
+    assert offsets == [0, 2, 4]
+    assert subword_encoder.finalize(input_ids, labels) == (input_ids, labels)
@@ -0,0 +1,108 @@
+import json
+import os
+import subprocess
+import sys
+from pathlib import Path
+
+import pytest
+from spacy.vocab import Vocab
+
+from adept_augmentations import EntitySwapAugmenter
+from adept_augmentations.synthetic import (
+    SCHEMES,
+    generate_dataset,
+    generate_docbin,
+    generate_examples,
+    generate_labels,
+)
+
+ROOT = Path(__file__).parent.parent
+
+
+def test_generate_labels() -> None:
+    assert generate_labels(2, "IOB2") == ["O", "B-LABEL0", "I-LABEL0", "B-LABEL1", "I-LABEL1"]
+    assert generate_labels(1, "BIOES") == ["O", "B-LABEL0", "I-LABEL0", "E-LABEL0", "S-LABEL0"]
+    assert generate_labels(1, "BILOU") == ["O", "B-LABEL0", "I-LABEL0", "L-LABEL0", "U-LABEL0"]
+    assert generate_labels(2, "none") == ["O", "LABEL0", "LABEL1"]
+    with pytest.raises(ValueError):
+        generate_labels(2, "IOB1")
+
+
+def test_generate_examples() -> None:
+    examples = generate_examples(num_sentences=50, sentence_length=(3, 8), max_entity_length=2, seed=1)
+    assert examples == generate_examples(num_sentences=50, sentence_length=(3, 8), max_entity_length=2, seed=1)
+    assert len(examples["tokens"]) == 50
+    for tokens, ner_tags in zip(examples["tokens"], examples["ner_tags"]):
+        assert len(tokens) == len(ner_tags)
+        # The last entity of a sentence may exceed the maximum length
+        assert 3 <= len(tokens) <= 8 + 1
+
+    examples = generate_examples(num_sentences=10, entity_density=0.0)
+    assert not any(any(ner_tags) for ner_tags in examples["ner_tags"])
+
+
+@pytest.mark.parametrize("scheme", SCHEMES)
+def test_generate_dataset(scheme: str) -> None:
+    dataset = generate_dataset(num_sentences=100, num_labels=3, kb_cardinality=5, scheme=scheme)
+    assert len(dataset) == 100
+    assert dataset.features["ner_tags"].feature.names == generate_labels(3, scheme)
+    knowledge_base = EntitySwapAugmenter(dataset).knowledge_base
+    assert len(knowledge_base.labels) == 3
+    if scheme != "none":
+        # At most 5 unique entities per label, while without a scheme adjacent entities of a label are merged
+        assert all(0 < knowledge_base.num_entities(label) <= 5 for label in knowledge_base.labels)
+
+
+@pytest.mark.parametrize("scheme", SCHEMES)
+def test_generate_docbin(scheme: str) -> None:
+    doc_bin = generate_docbin(num_sentences=20, num_labels=2, scheme=scheme)
+    docs = list(doc_bin.get_docs(Vocab()))
+    assert len(docs) == 20
+    assert {ent.label_ for doc in docs for ent in doc.ents} <= {"LABEL0", "LABEL1"}
+    assert all(token.text.startswith("Ent") for doc in docs for ent in doc.ents for token in ent)
+
+
+@pytest.mark.parametrize("track_memory", (True, False))
+def test_run_benchmarks(tmp_path, track_memory: bool) -> None:
+    output = tmp_path / "benchmarks.json"
+    subprocess.run(
+        [
+            sys.executable,
+            str(ROOT / "benchmarks" / "run_benchmarks.py"),
+            "--sentences",
+            "20",
+            "--N",
+            "2",
+            "--schemes",
+            "IOB2",
+            "--import-repeats",
+            "1",
+            "--output",
+            str(output),
+            *([] if track_memory else ["--no-memory"]),
+        ],
+        check=True,
+        cwd=tmp_path,
+        env={**os.environ, "PYTHONPATH": str(ROOT)},
+    )
+    report = json.loads(output.read_text())
+    # The import time is measured without pulling in the heavy dependencies that aren't needed
+    assert [(result["name"], result["modules"]) for result in report["imports"]] == [
+        ("import/import adept_augmentations", []),
+        ("import/from adept_augmentations import EntitySwapAugmenter", ["datasets"]),
+        ("import/from adept_augmentations.augmenters.spacy_augmenter import create_entity_swap_augmenter", ["spacy"]),
+    ]
+    assert all(result["seconds"] > 0 for result in report["imports"])
+    assert [result["name"] for result in report["results"]] == [
+        "IOB2/construction",
+        "IOB2/augment/N=2",
+        "IOB2/augment/N=2/deduplicator",
+        "IOB2/crop/max_length=8",
+        "IOB2/convert_dataset_to_docbin",
+        "IOB2/convert_docbin_to_dataset",
+    ]
+    assert all(result["rows_per_second"] > 0 for result in report["results"])
+    if track_memory:
+        assert all(result["peak_memory"] > 0 for result in report["results"])
+    else:
+        assert not any("peak_memory" in result for result in report["results"])
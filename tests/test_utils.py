@@ -0,0 +1,87 @@
+from typing import Optional
+
+import pytest
+from spacy.tokens import Doc, DocBin, Span
+from spacy.vocab import Vocab
+
+from adept_augmentations import EntitySwapAugmenter
+from adept_augmentations.utils import (
+    convert_dataset_to_docbin,
+    convert_docbin_to_dataset,
+    write_docbin_shards,
+)
+
+# The entities of `iob_offline_tiny`, as (label, start, end) per row
+IOB_OFFLINE_TINY_ENTS = [
+    [("ORG", 0, 1), ("MISC", 2, 3), ("MISC", 6, 7)],
+    [("PER", 0, 2)],
+    [("LOC", 0, 1)],
+    [("ORG", 1, 3)],
+    [("LOC", 0, 1), ("ORG", 5, 7), ("PER", 7, 9)],
+    [],
+]
+
+
+def get_ents(docs) -> list:
+    return [[(ent.label_, ent.start, ent.end) for ent in doc.ents] for doc in docs]
+
+
+def make_docbin(**kwargs) -> DocBin:
+    vocab = Vocab()
+    docs = []
+    doc = Doc(vocab, words=["Apple", "is", "in", "New", "York", "."])
+    doc.ents = [Span(doc, 0, 1, "ORG"), Span(doc, 3, 5, "GPE")]
+    docs.append(doc)
+    doc = Doc(vocab, words=["Hi", "Bob"])
+    doc.ents = [Span(doc, 1, 2, "PERSON")]
+    docs.append(doc)
+    docs.append(Doc(vocab, words=["Nothing"]))
+    # Round trip through bytes, like a DocBin that is read from a `.spacy` file
+    return DocBin().from_bytes(DocBin(docs=docs, **kwargs).to_bytes())
+
+
+def test_convert_docbin_to_dataset(tmp_path) -> None:
+    for batch_size in (1, 2, 1000):
+        dataset = convert_docbin_to_dataset(make_docbin(), batch_size=batch_size)
+        assert dataset.features["ner_tags"].feature.names == ["O", "ORG", "GPE", "PERSON"]
+        assert dataset["tokens"] == [["Apple", "is", "in", "New", "York", "."], ["Hi", "Bob"], ["Nothing"]]
+        assert dataset["ner_tags"] == [[1, 0, 0, 2, 2, 0], [0, 3], [0]]
+
+    # Entities with labels that are not given become "O"
+    dataset = convert_docbin_to_dataset(make_docbin(), labels=["PERSON"])
+    assert dataset.features["ner_tags"].feature.names == ["O", "PERSON"]
+    assert dataset["ner_tags"] == [[0, 0, 0, 0, 0, 0], [0, 1], [0]]
+
+    dataset = convert_docbin_to_dataset(make_docbin(), cache_file_name=tmp_path / "dataset.arrow")
+    assert dataset.cache_files == [{"filename": str(tmp_path / "dataset.arrow")}]
+    assert dataset["ner_tags"] == [[1, 0, 0, 2, 2, 0], [0, 3], [0]]
+
+    dataset = convert_docbin_to_dataset(make_docbin(attrs=["ORTH"]))
+    assert dataset["ner_tags"] == [[0] * 6, [0, 0], [0]]
+    assert len(convert_docbin_to_dataset(DocBin())) == 0
+
+
+def test_convert_dataset_to_docbin(iob_offline_tiny) -> None:
+    docs = list(convert_dataset_to_docbin(iob_offline_tiny, batch_size=4).get_docs(Vocab()))
+    assert [[token.text for token in doc] for doc in docs] == iob_offline_tiny["tokens"]
+    assert get_ents(docs) == IOB_OFFLINE_TINY_ENTS
+
+
+@pytest.mark.parametrize("num_proc", (None, 2))
+def test_write_docbin_shards(iob_offline_tiny, tmp_path, num_proc: Optional[int]) -> None:
+    paths = write_docbin_shards(iob_offline_tiny, tmp_path, shard_size=4, num_proc=num_proc)
+    assert paths == sorted(paths)
+    assert all(path.suffix == ".spacy" for path in paths)
+    docs = [doc for path in paths for doc in DocBin().from_disk(path).get_docs(Vocab())]
+    assert [[token.text for token in doc] for doc in docs] == iob_offline_tiny["tokens"]
+    assert get_ents(docs) == IOB_OFFLINE_TINY_ENTS
+
+
+def test_augment_to_disk_spacy(iob_offline_tiny, tmp_path) -> None:
+    augmenter = EntitySwapAugmenter(iob_offline_tiny)
+    expected = augmenter.augment(N=3, seed=7)
+    paths = augmenter.augment_to_disk(tmp_path, N=3, seed=7, shard_size=4, format="spacy", batch_size=2)
+    assert len(paths) == -(-len(expected) // 4)
+    docs = [doc for path in paths for doc in DocBin().from_disk(path).get_docs(Vocab())]
+    assert [[token.text for token in doc] for doc in docs] == expected["tokens"]
+    assert get_ents(docs) == get_ents(convert_dataset_to_docbin(expected).get_docs(Vocab()))